@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from cv_pipeline import rendering as ren
+
+log = logging.getLogger(__name__)
+
+
+def build_cv_artifacts(pdf_path: str, profile: ren.RenderProfile, pool=None) -> dict:
+    """
+    Renders the pages and extracts the text layer of a CV, on `pool` (a
+    `RenderPool`) if given.
+
+    Returns:
+        The artifacts: page image parts, the usable text layer (or None) and the
+        page count and byte size of the pdf.
+    """
+    stat = os.stat(pdf_path)
+    if pool is not None:
+        pages = pool.render(pdf_path, profile)
+        text = pool.extract_text(pdf_path)
+    else:
+        pages = ren.render_pdf_pages(pdf_path, profile)
+        text = ren.extract_text_layer(pdf_path)
+    return {
+        "meta": {
+            "page_count": len(pages),
+            "byte_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "image_bytes": sum(len(page) for page in pages),
+            "profile": asdict(profile),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+        "image_parts": [ren.image_part(page) for page in pages],
+        "text": text,
+    }
+
+
+class CVArtifactStore:
+    """
+    Per application store of CVs that are ready to send to an LLM.
+
+    CVs are rendered and their text extracted once, when they are ingested (see
+    `cv_pipeline.pipelines.cv_artifacts`), so the `extract_cv_information` node
+    starts from ready-made message parts. Each application has a folder
+    `<position_number>/<application_id>` holding `meta.json` (page count, byte
+    size, render settings), `pages.json` (image parts) and, for CVs with a
+    usable text layer, `text.txt`.
+
+    Artifacts are only used while they match the pdf (by size and modification
+    time, which moving the file keeps) and the current render profile, otherwise
+    the node renders the pdf as before.
+
+    Args
+    ----
+
+    directory : str
+        Where the artifacts are stored.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, position_number: str, application_id: str) -> Path:
+        return self.directory / position_number / application_id
+
+    def put(self, position_number: str, application_id: str, artifacts: dict) -> None:
+        path = self.path(position_number, application_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary folder first so readers never see a partial set
+        tmp_path = Path(
+            tempfile.mkdtemp(dir=path.parent, prefix=f".{application_id}.")
+        )
+        with open(tmp_path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(artifacts["meta"], f)
+        with open(tmp_path / "pages.json", "w", encoding="utf-8") as f:
+            json.dump(artifacts["image_parts"], f)
+        if artifacts["text"] is not None:
+            with open(tmp_path / "text.txt", "w", encoding="utf-8") as f:
+                f.write(artifacts["text"])
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def meta(self, position_number: str, application_id: str) -> dict | None:
+        try:
+            with open(
+                self.path(position_number, application_id) / "meta.json",
+                "r",
+                encoding="utf-8",
+            ) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_current(
+        self, meta: dict | None, pdf_path: str, profile: ren.RenderProfile
+    ) -> bool:
+        """Whether artifacts were built from this pdf with these settings."""
+        if meta is None or meta.get("profile") != asdict(profile):
+            return False
+        try:
+            stat = os.stat(pdf_path)
+        except FileNotFoundError:
+            # The artifacts are all that's left of the pdf
+            return True
+        return (meta["byte_size"], meta["source_mtime_ns"]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def message_parts(
+        self,
+        position_number: str,
+        application_id: str,
+        pdf_path: str,
+        label: str,
+        mode: str,
+        profile: ren.RenderProfile,
+    ) -> list | None:
+        """
+        Message parts for a CV, as `rendering.pdf_to_message_parts` would build
+        them, or None if there are no current artifacts.
+        """
+        path = self.path(position_number, application_id)
+        parts = None
+        meta = self.meta(position_number, application_id)
+        if self.is_current(meta, pdf_path, profile):
+            try:
+                if mode == "auto" and (path / "text.txt").exists():
+                    with open(path / "text.txt", "r", encoding="utf-8") as f:
+                        parts = [ren.text_part(label, f.read())]
+                else:
+                    with open(path / "pages.json", "r", encoding="utf-8") as f:
+                        parts = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                # Replaced or removed while being read
+                parts = None
+
+        with self._lock:
+            if parts is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return parts
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        log.info(
+            f"CV artifacts: {self.hits} used, {self.misses} missing ({hit_rate:.0%} hit rate)"
+        )
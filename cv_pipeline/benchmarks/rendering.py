@@ -0,0 +1,57 @@
+"""
+Compares render profiles by payload size and render time.
+
+Run from the repository root with
+`python -m cv_pipeline.benchmarks.rendering [pdf ...]`. If no pdfs are given the
+first few CVs and position descriptions in `data/raw` are used.
+"""
+
+from .. import rendering as ren
+import glob
+import statistics
+import sys
+import time
+
+
+def benchmark_profile(pdf_paths, profile, thread_count):
+    render_seconds = []
+    page_bytes = []
+    for pdf_path in pdf_paths:
+        start = time.perf_counter()
+        pages = ren.render_pdf_pages(pdf_path, profile, thread_count=thread_count)
+        render_seconds.append(time.perf_counter() - start)
+        page_bytes += [len(page) for page in pages]
+
+    return {
+        "pages": len(page_bytes),
+        "mean_bytes_per_page": statistics.mean(page_bytes),
+        # base64 adds a third on top of the raw bytes
+        "mean_base64_bytes_per_page": statistics.mean(
+            4 * ((b + 2) // 3) for b in page_bytes
+        ),
+        "mean_seconds_per_pdf": statistics.mean(render_seconds),
+    }
+
+
+if __name__ == "__main__":
+    pdf_paths = sys.argv[1:] or (
+        sorted(glob.glob("data/raw/cvs/*/*.pdf"))[:10]
+        + sorted(glob.glob("data/raw/pds/*.pdf"))[:10]
+    )
+    if not pdf_paths:
+        sys.exit("No pdfs found, pass some paths or run the pre-processing first.")
+
+    print(f"Rendering {len(pdf_paths)} pdfs with each profile")
+    print(
+        f'{"profile":<10} {"pages":>6} {"KB/page":>9} {"b64 KB/page":>12} {"s/pdf":>7}'
+    )
+    for name, profile in ren.PROFILES.items():
+        # Render once first so file system caches don't favour later profiles
+        ren.render_pdf_pages(pdf_paths[0], profile)
+        results = benchmark_profile(pdf_paths, profile, thread_count=2)
+        print(
+            f"{name:<10} {results['pages']:>6} "
+            f"{results['mean_bytes_per_page'] / 1024:>9.1f} "
+            f"{results['mean_base64_bytes_per_page'] / 1024:>12.1f} "
+            f"{results['mean_seconds_per_pdf']:>7.2f}"
+        )
@@ -0,0 +1,47 @@
+"""
+Measures the per-call overhead of building structured output LLMs.
+
+Compares building `with_structured_output(...).with_retry(...)` on every call,
+as the nodes used to, with looking up the runnables built once by
+`services.structured_llm`. No requests are sent to the provider.
+
+Run from the repository root with `python -m cv_pipeline.benchmarks.structured_llm`.
+"""
+
+from ..services import services
+from ..pipelines.agent.nodes import CVModel, Recommendation
+import time
+
+N_CALLS = 200
+
+
+def per_call_build(schema):
+    return services.base_llm.with_structured_output(schema).with_retry(
+        stop_after_attempt=5, wait_exponential_jitter=True
+    )
+
+
+def registry_lookup(schema):
+    return services.structured_llm(schema)
+
+
+def mean_microseconds(build, schema):
+    start = time.perf_counter()
+    for _ in range(N_CALLS):
+        build(schema)
+    return (time.perf_counter() - start) / N_CALLS * 1e6
+
+
+if __name__ == "__main__":
+    # Initialise the base LLM and registry outside the timings
+    for schema in (CVModel, Recommendation):
+        registry_lookup(schema)
+
+    print(f"Mean overhead over {N_CALLS} calls")
+    print(f'{"schema":<16} {"per call (us)":>14} {"registry (us)":>14} {"speed up":>9}')
+    for schema in (CVModel, Recommendation):
+        before = mean_microseconds(per_call_build, schema)
+        after = mean_microseconds(registry_lookup, schema)
+        print(
+            f"{schema.__name__:<16} {before:>14.1f} {after:>14.1f} {before / after:>8.0f}x"
+        )
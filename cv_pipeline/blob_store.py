@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from cv_pipeline import rendering as ren
+
+log = logging.getLogger(__name__)
+
+DATA_URL_PREFIX = "data:image/jpeg;base64,"
+
+
+class BlobStore:
+    """
+    Content addressed on-disk store of page images and document text.
+
+    Keeps the large parts of LLM messages out of the agent state. Instead of
+    base64 page images the state holds small references (`put_parts`), and the
+    parts are only read back when a message is assembled (`get_parts`). The
+    state that is copied between nodes, returned and checkpointed then stays a
+    few hundred bytes per document.
+
+    Blobs are named by the sha256 of their contents, so the same page is stored
+    once however many applications refer to it. The store is bounded in size
+    and evicts the least recently used blobs first, so it should be large
+    enough for the documents of one run.
+
+    Args
+    ----
+
+    directory : str
+        Where blobs are stored.
+
+    max_bytes : int
+        Total size of the store before the least recently used blobs are
+        evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in ren.file_entries(self._blob_paths()))
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def _blob_paths(self):
+        return (p for p in self.directory.glob("*/*") if p.suffix != ".tmp")
+
+    def put(self, data: bytes) -> str:
+        """Stores `data` if it isn't already. Returns its key (sha256)."""
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        try:
+            # Touch the blob so it counts as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # Not stored yet, or evicted by another process
+            pass
+        else:
+            return key
+
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first so readers never see a partial blob
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return key
+
+    def get(self, key: str) -> bytes:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise KeyError(f"Blob {key} is not in {self.directory}") from None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            pass
+        return data
+
+    def _evict(self):
+        """Removes least recently used blobs until the store is 90% full."""
+        self._size = ren.evict_least_recently_used(
+            self._blob_paths(), self.max_bytes, "blob store"
+        )
+
+    def put_parts(self, parts: list) -> list:
+        """
+        Stores the images and text of LLM message parts.
+
+        Returns:
+            A reference for each part, `{"type": "image", "blob": key}` or
+            `{"type": "text", "blob": key}`. Parts that aren't JPEG data urls
+            or text are kept as they are.
+        """
+        refs = []
+        for part in parts:
+            url = part.get("image_url", {}).get("url", "")
+            if part.get("type") == "image_url" and url.startswith(DATA_URL_PREFIX):
+                page = base64.b64decode(url[len(DATA_URL_PREFIX) :])
+                refs.append({"type": "image", "blob": self.put(page)})
+            elif part.get("type") == "text":
+                text = part["text"].encode("utf-8")
+                refs.append({"type": "text", "blob": self.put(text)})
+            else:
+                refs.append(part)
+        return refs
+
+    def get_parts(self, refs: list) -> list:
+        """Rebuilds the message parts stored by `put_parts`."""
+        parts = []
+        for ref in refs:
+            if ref.get("type") == "image":
+                parts.append(ren.image_part(self.get(ref["blob"])))
+            elif ref.get("type") == "text":
+                text = self.get(ref["blob"]).decode("utf-8")
+                parts.append({"type": "text", "text": text})
+            else:
+                parts.append(ref)
+        return parts
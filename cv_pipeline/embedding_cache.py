@@ -0,0 +1,80 @@
+import logging
+from typing import Iterator, Optional, Sequence
+from langchain_core.stores import ByteStore
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+log = logging.getLogger(__name__)
+
+
+class PostgresByteStore(ByteStore):
+    """
+    Key value store of bytes in the `embedding_cache` table.
+
+    Used as the store behind LangChain's `CacheBackedEmbeddings`, which keys
+    entries by the embeddings model (its namespace) and a hash of the text, and
+    stores the serialised vectors. Identical texts, e.g. a position description
+    that is ingested again or searched for by every applicant, are then looked
+    up rather than sent to the embeddings provider.
+
+    Args
+    ----
+
+    engine :
+        SQLAlchemy engine of the database holding the table.
+
+    table :
+        The `embedding_cache` data model.
+
+    prefix : str
+        Prepended to every key, so several stores can share the table (e.g.
+        document and query embeddings, which some providers compute
+        differently).
+    """
+
+    def __init__(self, engine, table, prefix: str = ""):
+        self.engine = engine
+        self.table = table.__table__
+        self.prefix = prefix
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        if not keys:
+            return []
+        stmt = select(self.table.c.key, self.table.c.value).where(
+            self.table.c.key.in_([self.prefix + key for key in keys])
+        )
+        with self.engine.connect() as connection:
+            values = dict(connection.execute(stmt).all())
+        return [values.get(self.prefix + key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        # The same text can appear twice in one batch
+        rows = {self.prefix + key: value for key, value in key_value_pairs}
+        if not rows:
+            return
+        stmt = insert(self.table).values(
+            [{"key": key, "value": value} for key, value in rows.items()]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"], set_={"value": stmt.excluded.value}
+        )
+        with self.engine.begin() as connection:
+            connection.execute(stmt)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(self.table).where(
+                    self.table.c.key.in_([self.prefix + key for key in keys])
+                )
+            )
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        stmt = select(self.table.c.key).where(
+            self.table.c.key.startswith(self.prefix + (prefix or ""), autoescape=True)
+        )
+        with self.engine.connect() as connection:
+            for key in connection.execute(stmt).scalars():
+                yield key[len(self.prefix) :]
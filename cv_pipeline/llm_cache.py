@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+log = logging.getLogger(__name__)
+
+
+class LLMResponseCache(BaseCache):
+    """
+    Exact match cache of LLM responses, stored in Postgres or a SQLite file.
+
+    Plugs into chat models through their `cache` argument (see
+    `ChatFactory.create`). LangChain passes the serialised messages (`prompt`)
+    and the model settings, including any bound structured output schema
+    (`llm_string`). Entries are keyed by a hash of those together with the
+    model, temperature and prompt version, so a rerun over the same CVs and
+    position descriptions gets the earlier responses back without calling the
+    LLM.
+
+    Only use with deterministic settings (temperature 0), otherwise the cache
+    returns one sample for every call.
+
+    Args
+    ----
+
+    engine :
+        SQLAlchemy engine of the database holding the `llm_cache` table.
+
+    table :
+        The `llm_cache` data model.
+
+    model : str
+        Name of the model the responses come from.
+
+    temperature : float
+        Temperature the model is run at.
+
+    prompt_version : str
+        Bump to stop using responses to earlier versions of the prompts.
+
+    ttl_seconds : int | None
+        Entries older than this are ignored and eventually deleted. None keeps
+        entries until they are evicted by `max_entries`.
+
+    max_entries : int
+        Number of entries kept. The oldest entries are deleted first.
+
+    bypass : bool
+        Skip lookups (every call goes to the LLM) but still store the responses,
+        which refreshes the cache.
+    """
+
+    # Expired and surplus entries are pruned after this many writes
+    prune_every = 100
+
+    def __init__(
+        self,
+        engine,
+        table,
+        model: str,
+        temperature: float,
+        prompt_version: str,
+        ttl_seconds: Optional[int] = None,
+        max_entries: int = 100_000,
+        bypass: bool = False,
+    ):
+        self.engine = engine
+        self.table = table.__table__
+        self.model = model
+        self.temperature = temperature
+        self.prompt_version = prompt_version
+        self.ttl = timedelta(seconds=ttl_seconds) if ttl_seconds else None
+        self.max_entries = max_entries
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def key(self, prompt: str, llm_string: str) -> str:
+        """Hash of the model settings and the message content."""
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps(
+                [self.model, self.temperature, self.prompt_version, llm_string]
+            ).encode("utf-8")
+        )
+        digest.update(prompt.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.bypass:
+            self._count(hit=False)
+            return None
+
+        stmt = select(self.table.c.response).where(
+            self.table.c.cache_key == self.key(prompt, llm_string)
+        )
+        if self.ttl is not None:
+            stmt = stmt.where(
+                self.table.c.created_at > datetime.now(timezone.utc) - self.ttl
+            )
+        with self.engine.connect() as connection:
+            response = connection.execute(stmt).scalar()
+
+        if response is None:
+            self._count(hit=False)
+            return None
+
+        try:
+            generations = [loads(generation) for generation in json.loads(response)]
+        except Exception as e:
+            # e.g. stored by a version of LangChain that serialised differently
+            log.warning(f"Ignoring unreadable LLM cache entry --- {e}")
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        values = {
+            "cache_key": self.key(prompt, llm_string),
+            "model": self.model,
+            "temperature": self.temperature,
+            "prompt_version": self.prompt_version,
+            "response": json.dumps([dumps(generation) for generation in return_val]),
+            "created_at": datetime.now(timezone.utc),
+        }
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(self.table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["cache_key"],
+            set_={
+                "response": stmt.excluded.response,
+                "created_at": stmt.excluded.created_at,
+            },
+        )
+        with self.engine.begin() as connection:
+            connection.execute(stmt)
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """Deletes expired entries and the oldest entries beyond `max_entries`."""
+        with self.engine.begin() as connection:
+            if self.ttl is not None:
+                connection.execute(
+                    delete(self.table).where(
+                        self.table.c.created_at
+                        <= datetime.now(timezone.utc) - self.ttl
+                    )
+                )
+            surplus = (
+                select(self.table.c.cache_key)
+                .order_by(self.table.c.created_at.desc())
+                .offset(self.max_entries)
+                .scalar_subquery()
+            )
+            result = connection.execute(
+                delete(self.table).where(self.table.c.cache_key.in_(surplus))
+            )
+        if result.rowcount:
+            log.info(f"Evicted {result.rowcount} entries from the LLM cache")
+
+    def clear(self, **kwargs: Any) -> None:
+        """Deletes the entries for this model, temperature and prompt version."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(self.table).where(
+                    self.table.c.model == self.model,
+                    self.table.c.temperature == self.temperature,
+                    self.table.c.prompt_version == self.prompt_version,
+                )
+            )
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        log.info(
+            f"LLM cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+            + (" (bypassed)" if self.bypass else "")
+        )
@@ -8,6 +8,8 @@ import os
 from pathlib import Path
 import logging
 
+ASSESSMENT_MODES = ["two_step", "merged"]
+
 
 class CVAgent:
 
@@ -23,43 +25,73 @@ class CVAgent:
         # Initialise graph object from state object
         builder = StateGraph(AgentState)
 
-        # Create custom nodes
+        # Create custom nodes. Kept on the agent so that callers can compute
+        # position level context once for many applications.
         nodes = Nodes(
             self.config,
         )
+        self.nodes = nodes
 
         edges = Edges(
             self.config,
         )
 
+        # The async graph (driven with `ainvoke`) uses the native async nodes.
+        # Edges only route on the state, so they are shared by both graphs.
+        def node(name):
+            if not self.config.get("async"):
+                return getattr(nodes, name)
+            async_node = getattr(nodes, f"a{name}", None)
+            if async_node is not None:
+                return async_node
+            sync_node = getattr(nodes, name)
+
+            # Placeholder nodes do no I/O, so run them on the event loop rather
+            # than handing them to a thread
+            async def run_inline(state: AgentState) -> AgentState:
+                return sync_node(state)
+
+            return run_inline
+
         # Specify first node to run
         builder.set_entry_point("check_cv_for_validity")
 
         # Add nodes
-        builder.add_node("check_cv_for_validity", nodes.check_cv_for_validity)
+        builder.add_node("check_cv_for_validity", node("check_cv_for_validity"))
 
-        builder.add_node("clean_up_invalid_cv", nodes.clean_up_invalid_cv)
+        builder.add_node("clean_up_invalid_cv", node("clean_up_invalid_cv"))
 
         builder.add_node(
-            "check_if_calibration_scheduled", nodes.check_if_calibration_scheduled
+            "check_if_calibration_scheduled", node("check_if_calibration_scheduled")
         )
 
         builder.add_node(
-            "retrieve_related_applications", nodes.retrieve_related_applications
+            "retrieve_related_applications", node("retrieve_related_applications")
         )
 
-        builder.add_node("schedule_calibration", nodes.schedule_calibration)
+        builder.add_node("schedule_calibration", node("schedule_calibration"))
 
-        builder.add_node("extract_cv_information", nodes.extract_cv_information)
+        builder.add_node("extract_cv_information", node("extract_cv_information"))
 
-        builder.add_node("preliminary_assessment", nodes.preliminary_assessment)
+        # "two_step" assesses the application, then reconsiders with the historical
+        # comments in a second LLM call. "merged" does both in one call.
+        assessment_mode = self.config.get("assessment_mode", "two_step")
+        if assessment_mode not in ASSESSMENT_MODES:
+            raise ValueError(
+                f"Unknown assessment mode: {assessment_mode}. Use one of {ASSESSMENT_MODES}"
+            )
+
+        if assessment_mode == "merged":
+            builder.add_node("combined_assessment", node("combined_assessment"))
+        else:
+            builder.add_node("preliminary_assessment", node("preliminary_assessment"))
+
+            builder.add_node("final_assessment", node("final_assessment"))
 
         builder.add_node(
-            "check_for_prompt_injection_signs", nodes.check_for_prompt_injection_signs
+            "check_for_prompt_injection_signs", node("check_for_prompt_injection_signs")
         )
 
-        builder.add_node("final_assessment", nodes.final_assessment)
-
         # Add edges
 
         builder.add_conditional_edges("check_cv_for_validity", edges.route_suitability)
@@ -78,11 +110,16 @@ class CVAgent:
 
         builder.add_edge("schedule_calibration", END)
 
-        builder.add_edge("extract_cv_information", "preliminary_assessment")
+        if assessment_mode == "merged":
+            builder.add_edge("extract_cv_information", "combined_assessment")
+
+            builder.add_edge("combined_assessment", "check_for_prompt_injection_signs")
+        else:
+            builder.add_edge("extract_cv_information", "preliminary_assessment")
 
-        builder.add_edge("preliminary_assessment", "final_assessment")
+            builder.add_edge("preliminary_assessment", "final_assessment")
 
-        builder.add_edge("final_assessment", "check_for_prompt_injection_signs")
+            builder.add_edge("final_assessment", "check_for_prompt_injection_signs")
 
         builder.add_conditional_edges(
             "check_for_prompt_injection_signs", edges.route_prompt_injection
@@ -1,18 +1,17 @@
+import asyncio
 import logging
 from .state import AgentState
-import logging
-from ... import utils as ut
+from ... import rendering as ren
 from ...services import services, tables
+from ..similar_positions import (
+    SIMILAR_POSITIONS_K,
+    get_similar_position_numbers,
+    search_similar_positions,
+)
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, Dict
-import base64
-import io
-import os
-from PIL import Image
-from pdf2image import convert_from_path
+from typing import Optional
 from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from sqlalchemy import create_engine, select, Table, MetaData, Column, String
+from sqlalchemy import select, Table, MetaData, Column, String
 from sqlalchemy.dialects.postgresql import JSONB
 
 log = logging.getLogger(__name__)
@@ -65,8 +64,32 @@ class Recommendation(BaseModel):
     # )
 
 
-# This is a messy workaround to access the vectorstore because I didn't put the position summaries
-# in the relational db
+class CombinedAssessment(BaseModel):
+    """
+    Structured assessment of an applicant's suitability made in one step, both
+    before and after considering the comments on historical applications.
+    """
+
+    preliminary_assessment: str = Field(
+        description="Assessment of the candidate's suitability based only on the CV and "
+        "the position description. Do not include names."
+    )
+    preliminary_recommendation: bool = Field(
+        description="A True/False indicator of the candidate's suitability based only on "
+        "the CV and the position description."
+    )
+    assessment: str = Field(
+        description="Overall assessment of the candidate's suitability after considering "
+        "the historical comments. Do not include names."
+    )
+    recommendation: bool = Field(
+        description="A True/False indicator of the candidate's suitability after "
+        "considering the historical comments."
+    )
+
+
+# Position summaries are now stored in the positions table. This is only used to
+# look up positions that were ingested before that.
 metadata = MetaData()
 langchain_pg_embedding_table = Table(
     "langchain_pg_embedding",
@@ -147,13 +170,52 @@ class Nodes:
     ) -> AgentState:
         log.info("<ENTER NODE>extract_cv_information</ENTER NODE>")
 
+        message, cv_page_refs = self.cv_information_message(state)
+
+        # Structured output LLM with retry, built once and shared by all calls
+        llm = services.structured_llm(CVModel)
+
+        cv_info = llm.invoke([message]).model_dump()
+
+        log.info("<EXIT NODE>extract_cv_information</EXIT NODE>")
+        return {
+            "cv_info": cv_info,
+            "cv_page_refs": cv_page_refs,
+            "calibration_needed": False,
+        }
+
+    async def aextract_cv_information(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        log.info("<ENTER NODE>extract_cv_information</ENTER NODE>")
+
+        # Reading artifacts or rendering (poppler, hashing the file) blocks, keep
+        # it off the event loop
+        message, cv_page_refs = await asyncio.to_thread(
+            self.cv_information_message, state
+        )
+
+        llm = services.structured_llm(CVModel)
+
+        cv_info = (await llm.ainvoke([message])).model_dump()
+
+        log.info("<EXIT NODE>extract_cv_information</EXIT NODE>")
+        return {
+            "cv_info": cv_info,
+            "cv_page_refs": cv_page_refs,
+            "calibration_needed": False,
+        }
+
+    def cv_information_message(self, state: AgentState) -> tuple[HumanMessage, list]:
+        """
+        Builds the message for extract_cv_information and blob store
+        references to the CV pdf parts.
+        """
         cv_pdf_file_path = (
             f'data/raw/cvs/{state["position_number"]}/{state["application_id"]}.pdf'
         )
 
-        # # Convert PDF pages to a list of PIL Image objects
-        images = convert_from_path(cv_pdf_file_path)
-
         # Prepare the content for the LangChain message
         # Start with text prompt
         text_part = [
@@ -167,48 +229,37 @@ class Nodes:
             },
         ]
 
-        cv_pdf_parts = []
-
-        # Loop through each image, encode it, and add it to the content list
-        for image in images:
-            # In-memory buffer to save the image without writing to disk
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")  # Save image to buffer in JPEG format
-
-            # Base64 encode the image
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        # Use the parts prepared when the CV was ingested
+        cv_pdf_parts = None
+        if services.cv_artifacts is not None:
+            cv_pdf_parts = services.cv_artifacts.message_parts(
+                state["position_number"],
+                state["application_id"],
+                cv_pdf_file_path,
+                label="Candidate CV",
+                mode=services.document_mode,
+                profile=services.render_profile,
+            )
 
-            # Add the image part to the content list
-            cv_pdf_parts.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
-                }
+        if cv_pdf_parts is None:
+            # Convert the PDF to text or image parts, reusing earlier renders of the same file
+            cv_pdf_parts = ren.pdf_to_message_parts(
+                cv_pdf_file_path,
+                label="Candidate CV",
+                mode=services.document_mode,
+                cache=services.render_cache,
+                profile=services.render_profile,
+                thread_count=services.render_threads,
+                pool=services.render_pool,
             )
 
         content_parts = text_part + cv_pdf_parts
 
         # Create the final HumanMessage
-        message = HumanMessage(content=content_parts)
-
-        # Need to use the base llm from services (does not yet have retry applied)
-        structured_llm = services.base_llm.with_structured_output(CVModel)
-
-        # Apply the retry logic to the *structured* LLM.
-        # handles retries AND structured output.
-        llm = structured_llm.with_retry(
-            stop_after_attempt=5, wait_exponential_jitter=True
+        return HumanMessage(content=content_parts), services.blob_store.put_parts(
+            cv_pdf_parts
         )
 
-        cv_info = llm.invoke([message]).model_dump()
-
-        log.info("<EXIT NODE>extract_cv_information</EXIT NODE>")
-        return {
-            "cv_info": cv_info,
-            "cv_pdf_parts": cv_pdf_parts,
-            "calibration_needed": False,
-        }
-
     def retrieve_related_applications(
         self,
         state: AgentState,
@@ -220,38 +271,77 @@ class Nodes:
         # similar identified position. Could be adapted to retrieve more
         # information (such as the application files themselves).
 
-        statement = select(langchain_pg_embedding_table).where(
-            langchain_pg_embedding_table.c.cmetadata["id"]
-            .as_string()
-            .contains(state["position_number"])
-        )
-
-        with services.engine_vectorstore.connect() as connection:
-            results = connection.execute(statement).all()
+        if state.get("similar_position_numbers") is not None:
+            # Already retrieved once for all applications to this position
+            log.info("<EXIT NODE>retrieve_related_applications</EXIT NODE>")
+            return {"calibration_needed": False}
 
-        position_description = results[0].document
+        related_applications = self.get_related_applications(
+            state["position_number"], state["level"]
+        )
 
-        filter_criteria = {
-            "level": state["level"],
-            "id": {
-                "$ne": f'{state["position_number"]}_cv_{os.environ.get("EMBEDDINGS_PROVIDER")}_{os.environ.get("EMBEDDINGS_MODEL")}'  # noqa: E501
-            },
+        log.info("<EXIT NODE>retrieve_related_applications</EXIT NODE>")
+        return {
+            **related_applications,
+            "calibration_needed": False,
         }
 
-        # The plan is to put a threshold on this and ensure that only very similar positions are returned
-        similar_pds = services.vector_store_cv.similarity_search_with_score(
-            position_description,
-            k=3,  # Retrieve top N chunks
-            filter=filter_criteria,
+    async def aretrieve_related_applications(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        # Database and vector store queries are blocking, run them in a thread
+        return await asyncio.to_thread(self.retrieve_related_applications, state)
+
+    def get_related_applications(self, position_number: str, level: str) -> dict:
+        """
+        Finds positions similar to `position_number` and the reviewer comments on
+        applications to them. Only depends on the position, not the applicant, so
+        results are cached per position.
+        """
+        related_applications = services.retrieval_cache.get(position_number, level)
+        if related_applications is None:
+            related_applications = self.search_related_applications(
+                position_number, level
+            )
+            services.retrieval_cache.put(position_number, level, related_applications)
+        return related_applications
+
+    def search_related_applications(self, position_number: str, level: str) -> dict:
+        """Uncached vector search and comment queries behind get_related_applications."""
+        # Indexed exact match on the position number
+        stmt = select(tables["positions"].summary).where(
+            tables["positions"].position_number == position_number
         )
 
-        similar_position_numbers = [
-            s[0].id.replace(
-                f'_cv_{os.environ.get("EMBEDDINGS_PROVIDER")}_{os.environ.get("EMBEDDINGS_MODEL")}',
-                "",
+        with services.get_session() as session:
+            position_description = session.scalars(stmt).first()
+
+        if position_description is None:
+            # Positions ingested before summaries were stored in the positions table.
+            # Exact match on the metadata id, which has an expression index.
+            statement = select(langchain_pg_embedding_table.c.document).where(
+                langchain_pg_embedding_table.c.cmetadata["id"].astext
+                == f"{position_number}_{services.collection_name}"
             )
-            for s in similar_pds
-        ]
+
+            with services.engine_vectorstore.connect() as connection:
+                position_description = connection.execute(statement).scalars().first()
+
+        if position_description is None:
+            raise ValueError(f"No position description found for {position_number}")
+
+        # Similar positions are precomputed when position descriptions are ingested
+        similar_position_numbers = get_similar_position_numbers(position_number)
+
+        if similar_position_numbers is None:
+            # Positions ingested before similar positions were precomputed
+            similar_position_numbers = [
+                similar_position_number
+                for similar_position_number, _ in search_similar_positions(
+                    position_number, level, position_description, k=SIMILAR_POSITIONS_K
+                )
+            ]
 
         stmt = select(tables["applicant_suitability_manual"].suitability_comment).where(
             tables["applicant_suitability_manual"].position_number.in_(
@@ -275,13 +365,63 @@ class Nodes:
         with services.get_session() as session:
             suitability_comments_negative = session.scalars(stmt).all()
 
-        log.info("<EXIT NODE>retrieve_related_applications</EXIT NODE>")
         return {
             "similar_position_numbers": similar_position_numbers,
             "suitability_comments_positive": suitability_comments_positive,
             "suitability_comments_negative": suitability_comments_negative,
             "position_description": position_description,
-            "calibration_needed": False,
+        }
+
+    def get_pd_pdf_parts(self, position_number: str) -> list:
+        """Converts the position description pdf into message parts."""
+        pd_pdf_file_path = f"data/raw/pds/{position_number}.pdf"
+
+        # Convert the PDF to text or image parts, reusing earlier renders of the same file
+        pd_pdf_parts = ren.pdf_to_message_parts(
+            pd_pdf_file_path,
+            label="Position Description",
+            mode=services.document_mode,
+            cache=services.render_cache,
+            profile=services.render_profile,
+            thread_count=services.render_threads,
+            pool=services.render_pool,
+        )
+
+        return pd_pdf_parts
+
+    def get_pd_page_refs(self, position_number: str) -> list:
+        """The position description parts, stored in the blob store, as references."""
+        return services.blob_store.put_parts(self.get_pd_pdf_parts(position_number))
+
+    def load_pd_pdf_parts(self, state: AgentState) -> tuple[list, list]:
+        """
+        Reads the position description parts referred to by the state back from
+        the blob store, to build a message.
+
+        Returns:
+            The parts and the references to them.
+        """
+        # Reuse the parts if they were computed once for the position
+        pd_page_refs = state.get("pd_page_refs") or self.get_pd_page_refs(
+            state["position_number"]
+        )
+        try:
+            return services.blob_store.get_parts(pd_page_refs), pd_page_refs
+        except KeyError:
+            # Evicted since the references were made, store the pages again
+            pd_page_refs = self.get_pd_page_refs(state["position_number"])
+            return services.blob_store.get_parts(pd_page_refs), pd_page_refs
+
+    def get_position_context(self, position_number: str, level: str) -> dict:
+        """
+        State that only depends on the position: related applications and the
+        position description parts. Passing this in with every application to
+        the position lets the nodes skip the lookups and the pdf conversion.
+        The position description is passed as blob store references, not pages.
+        """
+        return {
+            **self.get_related_applications(position_number, level),
+            "pd_page_refs": self.get_pd_page_refs(position_number),
         }
 
     def schedule_calibration(
@@ -302,11 +442,50 @@ class Nodes:
     ) -> AgentState:
         log.info("<ENTER NODE>preliminary_assessment</ENTER NODE>")
         # Placeholder for now.
-        pd_pdf_file_path = f'data/raw/pds/{state["position_number"]}.pdf'
 
-        # Convert PDF pages to a list of PIL Image objects
-        images = convert_from_path(pd_pdf_file_path)
+        message, pd_page_refs = self.preliminary_assessment_message(state)
+
+        # Structured output LLM with retry, built once and shared by all calls
+        llm = services.structured_llm(Recommendation)
+
+        preliminary_assessment_response = llm.invoke([message]).model_dump()
+
+        log.info("<EXIT NODE>preliminary_assessment</EXIT NODE>")
+        return {
+            "preliminary_reasoning": preliminary_assessment_response["assessment"],
+            "preliminary_assessment": preliminary_assessment_response["recommendation"],
+            "pd_page_refs": pd_page_refs,
+        }
+
+    async def apreliminary_assessment(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        log.info("<ENTER NODE>preliminary_assessment</ENTER NODE>")
+
+        # May have to render the position description, keep it off the event loop
+        message, pd_page_refs = await asyncio.to_thread(
+            self.preliminary_assessment_message, state
+        )
+
+        llm = services.structured_llm(Recommendation)
+
+        preliminary_assessment_response = (await llm.ainvoke([message])).model_dump()
+
+        log.info("<EXIT NODE>preliminary_assessment</EXIT NODE>")
+        return {
+            "preliminary_reasoning": preliminary_assessment_response["assessment"],
+            "preliminary_assessment": preliminary_assessment_response["recommendation"],
+            "pd_page_refs": pd_page_refs,
+        }
 
+    def preliminary_assessment_message(
+        self, state: AgentState
+    ) -> tuple[HumanMessage, list]:
+        """
+        Builds the message for preliminary_assessment and blob store references
+        to the PD pdf parts.
+        """
         # Prepare the content for the LangChain message
         # Start with text prompt
         # NOTE: This version has been commented out because it was making gemini-2.5-flash hang.
@@ -351,13 +530,13 @@ class Nodes:
                 "type": "text",
                 "text": f"""
             **Role:** AI Recruitment Specialist for the Arts & Cultural Heritage sector.
-            **Goal:** Rapidly assess candidate suitability based on their CV and the Position Description image.
+            **Goal:** Rapidly assess candidate suitability based on their CV and the Position Description.
 
             **Candidate Information:**
             {str(state["cv_info"])}
 
             **Instructions:**
-            1.  Identify the key requirements from the Position Description image.
+            1.  Identify the key requirements from the Position Description.
             2.  Compare the candidate's information against these requirements.
             3.  Generate a 1-2 sentence assessment.
             4.  Provide a definitive YES/NO recommendation.
@@ -370,48 +549,116 @@ class Nodes:
             },
         ]
 
-        pd_pdf_parts = []
+        pd_pdf_parts, pd_page_refs = self.load_pd_pdf_parts(state)
 
-        # Loop through each image, encode it, and add it to the content list
-        for image in images:
-            # In-memory buffer to save the image without writing to disk
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG")  # Save image to buffer in JPEG format
+        content_parts = text_part + pd_pdf_parts
 
-            # Base64 encode the image
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        # Create the final HumanMessage
+        return HumanMessage(content=content_parts), pd_page_refs
 
-            # Add the image part to the content list
-            pd_pdf_parts.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
-                }
-            )
+    def combined_assessment(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        log.info("<ENTER NODE>combined_assessment</ENTER NODE>")
+        # Does the preliminary and final assessments in one call, so the position
+        # description is only sent once per application.
 
-        content_parts = text_part + pd_pdf_parts
+        message, pd_page_refs = self.combined_assessment_message(state)
 
-        # Create the final HumanMessage
-        message = HumanMessage(content=content_parts)
+        # Structured output LLM with retry, built once and shared by all calls
+        llm = services.structured_llm(CombinedAssessment)
+
+        combined_assessment_response = llm.invoke([message]).model_dump()
 
-        # Need to use the base llm from services (does not yet have retry applied)
-        structured_llm = services.base_llm.with_structured_output(Recommendation)
+        log.info("<EXIT NODE>combined_assessment</EXIT NODE>")
+        return {
+            **self.combined_assessment_update(combined_assessment_response),
+            "pd_page_refs": pd_page_refs,
+        }
 
-        # Apply the retry logic to the *structured* LLM.
-        # handles retries AND structured output.
-        llm = structured_llm.with_retry(
-            stop_after_attempt=5, wait_exponential_jitter=True
+    async def acombined_assessment(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        log.info("<ENTER NODE>combined_assessment</ENTER NODE>")
+
+        # May have to render the position description, keep it off the event loop
+        message, pd_page_refs = await asyncio.to_thread(
+            self.combined_assessment_message, state
         )
 
-        preliminary_assessment_response = llm.invoke([message]).model_dump()
+        llm = services.structured_llm(CombinedAssessment)
 
-        log.info("<EXIT NODE>preliminary_assessment</EXIT NODE>")
+        combined_assessment_response = (await llm.ainvoke([message])).model_dump()
+
+        log.info("<EXIT NODE>combined_assessment</EXIT NODE>")
         return {
-            "preliminary_reasoning": preliminary_assessment_response["assessment"],
-            "preliminary_assessment": preliminary_assessment_response["recommendation"],
-            "pd_pdf_parts": pd_pdf_parts,
+            **self.combined_assessment_update(combined_assessment_response),
+            "pd_page_refs": pd_page_refs,
         }
 
+    def combined_assessment_update(self, response: dict) -> dict:
+        """State set by combined_assessment, the same keys as the two step assessment."""
+        return {
+            "preliminary_reasoning": response["preliminary_assessment"],
+            "preliminary_assessment": response["preliminary_recommendation"],
+            "suitability_reasoning": response["assessment"],
+            "suitability_automatic": "Y" if response["recommendation"] else "N",
+        }
+
+    def combined_assessment_message(
+        self, state: AgentState
+    ) -> tuple[HumanMessage, list]:
+        """
+        Builds the message for combined_assessment and blob store references to
+        the PD pdf parts.
+        """
+        text_part = [
+            {
+                "type": "text",
+                "text": f"""
+            **Role:** AI Recruitment Specialist for the Arts & Cultural Heritage sector.
+            **Goal:** Rapidly assess candidate suitability based on their CV and the Position Description.
+            **Special consideration:** Access has been provided to comments of historical CV evaluations of
+            similar positions. These may indicate things you would otherwise miss. These may be blank if
+            historical information could not be found, if so ignore this content, do not make anything up.
+
+            **Candidate Information:**
+            {str(state["cv_info"])}
+
+            **Comments of Historical CVs that were __suitable__**
+            {str(state["suitability_comments_positive"])}
+
+            **Comments of Historical CVs that were __not suitable__**
+            {str(state["suitability_comments_negative"])}
+
+            **Instructions:**
+            1.  Identify the key requirements from the Position Description.
+            2.  Compare the candidate's information against these requirements.
+            3.  Without using the historical comments, generate a 1-2 sentence preliminary assessment
+                and a YES/NO preliminary recommendation.
+            4.  Compare your preliminary assessment and recommendation with the historical comments.
+            5.  Provide a final 1-2 sentence assessment.
+            6.  Provide a final YES/NO recommendation.
+            7.  Adhere strictly to the format below.
+
+            **Output Format:**
+            **Preliminary Assessment:** [Insert 1-2 sentence summary here, don't use names]
+            **Preliminary Recommendation:** [YES or NO]
+            **Assessment:** [Insert 1-2 sentence summary here, don't use names]
+            **Recommendation:** [YES or NO]
+            """,
+            },
+        ]
+
+        pd_pdf_parts, pd_page_refs = self.load_pd_pdf_parts(state)
+
+        content_parts = text_part + pd_pdf_parts
+
+        # Create the final HumanMessage
+        return HumanMessage(content=content_parts), pd_page_refs
+
     def check_for_prompt_injection_signs(
         self,
         state: AgentState,
@@ -429,12 +676,52 @@ class Nodes:
     ) -> AgentState:
         log.info("<ENTER NODE>final_assessment</ENTER NODE>")
 
+        message = self.final_assessment_message(state)
+
+        # Structured output LLM with retry, built once and shared by all calls
+        llm = services.structured_llm(Recommendation)
+
+        final_assessment_response = llm.invoke([message]).model_dump()
+
+        log.info("<EXIT NODE>final_assessment</EXIT NODE>")
+
+        return {
+            "suitability_reasoning": final_assessment_response["assessment"],
+            "suitability_automatic": (
+                "Y" if final_assessment_response["recommendation"] else "N"
+            ),
+        }
+
+    async def afinal_assessment(
+        self,
+        state: AgentState,
+    ) -> AgentState:
+        log.info("<ENTER NODE>final_assessment</ENTER NODE>")
+
+        # The pages are read from the blob store, keep it off the event loop
+        message = await asyncio.to_thread(self.final_assessment_message, state)
+
+        llm = services.structured_llm(Recommendation)
+
+        final_assessment_response = (await llm.ainvoke([message])).model_dump()
+
+        log.info("<EXIT NODE>final_assessment</EXIT NODE>")
+
+        return {
+            "suitability_reasoning": final_assessment_response["assessment"],
+            "suitability_automatic": (
+                "Y" if final_assessment_response["recommendation"] else "N"
+            ),
+        }
+
+    def final_assessment_message(self, state: AgentState) -> HumanMessage:
+        """Builds the message for final_assessment."""
         text_part = [
             {
                 "type": "text",
                 "text": f"""
             **Role:** AI Recruitment Specialist for the Arts & Cultural Heritage sector.
-            **Goal:** Rapidly assess candidate suitability based on their CV and the Position Description image.
+            **Goal:** Rapidly assess candidate suitability based on their CV and the Position Description.
             **Background:** You already did an initial assessment, with details included below.
             **Special consideration:** Access has been provided to comments of historical CV evaluations of
             similar positions. These may indicate things you missed in your initial assessment. These may
@@ -451,7 +738,7 @@ class Nodes:
             {str(state["suitability_comments_negative"])}
             
             **Instructions:**
-            1.  Identify the key requirements from the Position Description image.
+            1.  Identify the key requirements from the Position Description.
             2.  Compare the candidate's information against these requirements.
             3.  Consider your previous 1-2 sentence assessment.
             4.  Consider your previous YES/NO recommendation.
@@ -467,27 +754,8 @@ class Nodes:
             },
         ]
 
-        content_parts = text_part + state["pd_pdf_parts"]
+        pd_pdf_parts, _ = self.load_pd_pdf_parts(state)
+        content_parts = text_part + pd_pdf_parts
 
         # Create the final HumanMessage
-        message = HumanMessage(content=content_parts)
-
-        # Need to use the base llm from services (does not yet have retry applied)
-        structured_llm = services.base_llm.with_structured_output(Recommendation)
-
-        # Apply the retry logic to the *structured* LLM.
-        # handles retries AND structured output.
-        llm = structured_llm.with_retry(
-            stop_after_attempt=5, wait_exponential_jitter=True
-        )
-
-        final_assessment_response = llm.invoke([message]).model_dump()
-
-        log.info("<EXIT NODE>final_assessment</EXIT NODE>")
-
-        return {
-            "suitability_reasoning": final_assessment_response["assessment"],
-            "suitability_automatic": (
-                "Y" if final_assessment_response["recommendation"] else "N"
-            ),
-        }
+        return HumanMessage(content=content_parts)
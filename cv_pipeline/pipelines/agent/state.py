@@ -16,8 +16,8 @@ class AgentState(TypedDict):
     suitability_comments_negative: str  # Historical comments for unsuitable applicants
     prompt_injection: bool  # Indicator for signs of prompt injection
     cv_info: dict  # Details extracted from cv file
-    cv_pdf_parts: list  # cv pdf image parts put here so only need to be processed once
-    pd_pdf_parts: list  # pd pdf image parts put here so only need to be processed once
+    cv_page_refs: list  # Blob store references to the cv pdf parts, so they only need to be processed once
+    pd_page_refs: list  # Blob store references to the pd pdf parts, so they only need to be processed once
     preliminary_assessment: (
         bool  # Indicator of assessment before historical comments injected
     )
@@ -25,6 +25,7 @@ class AgentState(TypedDict):
         str  # Reasoning for assessment before historical comments injected
     )
     level: str  # Level of position
+    position_description: str  # Summary of the position description from the vector store
     similar_position_numbers: List[
         str
     ]  # Positions identified as similar to the one being applied for
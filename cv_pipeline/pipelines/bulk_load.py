@@ -0,0 +1,91 @@
+from ..services import services
+import csv
+import logging
+import time
+from psycopg import sql
+
+log = logging.getLogger(__name__)
+
+
+def copy_csv(csv_file_name: str, Model, key: str) -> int:
+    """
+    Streams a source csv into the table of `Model` and upserts on `key`.
+
+    Rows are fed straight from the file into a temporary staging table with
+    `COPY ... FROM STDIN`, so the file is never held in memory and no ORM
+    objects are built. The staging table is then merged into the target table
+    in one statement, updating rows with the same `key` that were loaded
+    before. If `key` is repeated within the file the last row wins.
+
+    The csv header has to match column names of the table.
+
+    Returns:
+        The number of rows in the csv.
+    """
+    table = Model.__table__
+    start = time.perf_counter()
+
+    with open(csv_file_name, mode="r", newline="", encoding="utf-8") as csv_file:
+        reader = csv.reader(csv_file)
+        columns = next(reader, [])
+        unknown = set(columns).difference(table.columns.keys())
+        if unknown or key not in columns:
+            raise ValueError(
+                f"Columns of {csv_file_name} don't match {table.name}: "
+                f"unknown {sorted(unknown)}, expected a {key} column"
+            )
+
+        target = sql.Identifier(table.schema, table.name)
+        staging = sql.Identifier(f"staging_{table.name}")
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+        updates = [c for c in columns if c != key]
+        if updates:
+            on_conflict = sql.SQL("DO UPDATE SET {}").format(
+                sql.SQL(", ").join(
+                    sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c))
+                    for c in updates
+                )
+            )
+        else:
+            on_conflict = sql.SQL("DO NOTHING")
+
+        n_rows = 0
+        with services.engine.begin() as connection:
+            cursor = connection.connection.dbapi_connection.cursor()
+            cursor.execute(
+                sql.SQL(
+                    "CREATE TEMP TABLE {} ON COMMIT DROP AS "
+                    "SELECT {} FROM {} WITH NO DATA"
+                ).format(staging, column_list, target)
+            )
+            # Row order, so the last copy of a repeated key wins
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} ADD COLUMN _row bigserial").format(staging)
+            )
+            with cursor.copy(
+                sql.SQL("COPY {} ({}) FROM STDIN").format(staging, column_list)
+            ) as copy:
+                for row in reader:
+                    copy.write_row(row)
+                    n_rows += 1
+            cursor.execute(
+                sql.SQL(
+                    "INSERT INTO {target} ({columns}) "
+                    "SELECT DISTINCT ON ({key}) {columns} FROM {staging} "
+                    "ORDER BY {key}, _row DESC "
+                    "ON CONFLICT ({key}) {on_conflict}"
+                ).format(
+                    target=target,
+                    columns=column_list,
+                    key=sql.Identifier(key),
+                    staging=staging,
+                    on_conflict=on_conflict,
+                )
+            )
+
+    duration = time.perf_counter() - start
+    log.info(
+        f"Loaded {n_rows} rows from {csv_file_name} into {table.name} in "
+        f"{duration:.1f}s ({n_rows / duration if duration else 0:.0f} rows/s)"
+    )
+    return n_rows
@@ -0,0 +1,141 @@
+"""
+Compares experiment runs by how often they agree with the manual reviews in
+`applicant_suitability_manual`, e.g. to choose between the two step and merged
+assessment modes (`CV_ASSESSMENT_MODE`).
+
+Run from the repository root with
+`python -m cv_pipeline.pipelines.compare_assessments [experiment_id ...]`. With
+several experiment ids only the applications processed in all of them are
+counted, so the runs are compared on the same applications. Without ids every
+experiment is reported over its own applications.
+"""
+
+from ..services import services, tables
+import sys
+from sqlalchemy import and_, func, or_, select
+
+
+def cohens_kappa(tp: int, fp: int, fn: int, tn: int) -> float | None:
+    """Agreement corrected for the agreement expected by chance."""
+    n = tp + fp + fn + tn
+    if n == 0:
+        return None
+    observed = (tp + tn) / n
+    expected = ((tp + fp) * (tp + fn) + (fn + tn) * (fp + tn)) / n**2
+    if expected == 1:
+        return None
+    return (observed - expected) / (1 - expected)
+
+
+def agreement(experiment_ids: list[str] | None = None) -> list[dict]:
+    """
+    Agreement of each experiment's results with the manual reviews.
+
+    Returns:
+        One dict per experiment with its assessment mode, the number of
+        applications compared, the confusion counts (manual review is the
+        truth, Y is positive), agreement, Cohen's kappa and the agreement of the
+        preliminary assessment (before the historical comments were considered).
+    """
+    Experiment = tables["applicant_suitability_automatic_experiment"]
+    Manual = tables["applicant_suitability_manual"]
+    trace = Experiment.suitability_automatic_trace
+    preliminary = trace["preliminary_assessment"].astext
+
+    def count(condition):
+        return func.count().filter(condition)
+
+    automatic_yes = Experiment.suitability_automatic == "Y"
+    automatic_no = Experiment.suitability_automatic == "N"
+    manual_yes = Manual.suitability_manual == "Y"
+    manual_no = Manual.suitability_manual == "N"
+
+    stmt = (
+        select(
+            Experiment.experiment,
+            func.max(trace["assessment_mode"].astext),
+            count(and_(automatic_yes, manual_yes)),
+            count(and_(automatic_yes, manual_no)),
+            count(and_(automatic_no, manual_yes)),
+            count(and_(automatic_no, manual_no)),
+            count(
+                or_(
+                    and_(preliminary == "true", manual_yes),
+                    and_(preliminary == "false", manual_no),
+                )
+            ),
+            count(preliminary.in_(["true", "false"])),
+        )
+        .join(Manual, Manual.application_id == Experiment.application_id)
+        .where(
+            Experiment.suitability_automatic.in_(["Y", "N"]),
+            Manual.suitability_manual.in_(["Y", "N"]),
+        )
+        .group_by(Experiment.experiment)
+        .order_by(Experiment.experiment)
+    )
+
+    if experiment_ids:
+        stmt = stmt.where(Experiment.experiment.in_(experiment_ids))
+    if experiment_ids and len(set(experiment_ids)) > 1:
+        # Only applications every experiment has a result for
+        common = (
+            select(Experiment.application_id)
+            .where(Experiment.experiment.in_(experiment_ids))
+            .group_by(Experiment.application_id)
+            .having(
+                func.count(func.distinct(Experiment.experiment))
+                == len(set(experiment_ids))
+            )
+        )
+        stmt = stmt.where(Experiment.application_id.in_(common))
+
+    with services.get_session() as session:
+        rows = session.execute(stmt).all()
+
+    results = []
+    for experiment, mode, tp, fp, fn, tn, preliminary_agree, preliminary_n in rows:
+        n = tp + fp + fn + tn
+        results.append(
+            {
+                "experiment": experiment,
+                # Runs from before the mode was recorded used the two step graph
+                "assessment_mode": mode or "two_step",
+                "applications": n,
+                "true_positives": tp,
+                "false_positives": fp,
+                "false_negatives": fn,
+                "true_negatives": tn,
+                "agreement": (tp + tn) / n if n else None,
+                "kappa": cohens_kappa(tp, fp, fn, tn),
+                "preliminary_agreement": (
+                    preliminary_agree / preliminary_n if preliminary_n else None
+                ),
+            }
+        )
+    return results
+
+
+def print_agreement(experiment_ids: list[str] | None = None) -> None:
+    """Prints the agreement of each experiment as a table."""
+
+    def percent(value):
+        return "n/a" if value is None else f"{value:.1%}"
+
+    print(
+        f"{'experiment':<36}  {'mode':<8}  {'n':>6}  {'agree':>6}  {'kappa':>6}  "
+        f"{'prelim':>6}  {'TP':>5}  {'FP':>5}  {'FN':>5}  {'TN':>5}"
+    )
+    for result in agreement(experiment_ids):
+        kappa = "n/a" if result["kappa"] is None else f"{result['kappa']:.2f}"
+        print(
+            f"{result['experiment']:<36}  {result['assessment_mode']:<8}  "
+            f"{result['applications']:>6}  {percent(result['agreement']):>6}  "
+            f"{kappa:>6}  {percent(result['preliminary_agreement']):>6}  "
+            f"{result['true_positives']:>5}  {result['false_positives']:>5}  "
+            f"{result['false_negatives']:>5}  {result['true_negatives']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    print_agreement(sys.argv[1:] or None)
@@ -0,0 +1,98 @@
+from ..services import services
+from ..artifacts import build_cv_artifacts
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+# Number of CVs prepared at the same time at ingestion (0 means one per render
+# pool process)
+CV_ARTIFACT_WORKERS = int(os.environ.get("CV_ARTIFACT_WORKERS", 0))
+
+
+def raw_cv_path(position_number: str, application_id: str) -> str:
+    return f"data/raw/cvs/{position_number}/{application_id}.pdf"
+
+
+def build_artifacts(applications: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+    """
+    Renders and extracts the text of the ingested CVs of `applications`
+    ((position number, application id) pairs) on the render pool, and stores
+    the results in the CV artifact store.
+
+    Only a few CVs per worker are in flight at once, so memory stays flat
+    however many CVs a file lists.
+
+    Returns:
+        The error for each application whose CV could not be processed. Those
+        CVs are rendered by the agent instead.
+    """
+    store = services.cv_artifacts
+    if store is None or not applications:
+        return {}
+
+    profile = services.render_profile
+    pool = services.render_pool
+    workers = CV_ARTIFACT_WORKERS or (pool.workers if pool else os.cpu_count())
+    workers = min(workers, len(applications))
+    errors = {}
+    start = time.perf_counter()
+
+    # Threads hand the CPU work to the render pool and write the results
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        todo = iter(applications)
+        in_flight = {}
+        while True:
+            for application in todo:
+                future = executor.submit(
+                    build_cv_artifacts, raw_cv_path(*application), profile, pool
+                )
+                in_flight[future] = application
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                position_number, application_id = in_flight.pop(future)
+                try:
+                    store.put(position_number, application_id, future.result())
+                except Exception as e:
+                    log.warning(
+                        f"Could not prepare CV {position_number}/{application_id}.pdf --- {e}"
+                    )
+                    errors[(position_number, application_id)] = str(e)
+
+    elapsed = time.perf_counter() - start
+    log.info(
+        f"Prepared {len(applications) - len(errors)} CVs in {elapsed:.1f}s "
+        f"with {workers} workers ({len(applications) / elapsed:.1f} CVs/s)"
+    )
+    if pool is not None:
+        pool.log_stats()
+    return errors
+
+
+if __name__ == "__main__":
+    # Backfill for CVs ingested before artifacts were prepared, or after the
+    # render profile changed
+    logging.basicConfig(level=logging.INFO)
+    store = services.cv_artifacts
+    if store is None:
+        sys.exit("CV artifacts are disabled (CV_ARTIFACTS=false), nothing to prepare")
+    profile = services.render_profile
+    applications = []
+    for pdf_path in sorted(glob.glob("data/raw/cvs/*/*.pdf")):
+        position_number = os.path.basename(os.path.dirname(pdf_path))
+        application_id = os.path.splitext(os.path.basename(pdf_path))[0]
+        meta = store.meta(position_number, application_id)
+        if not store.is_current(meta, pdf_path, profile):
+            applications.append((position_number, application_id))
+
+    log.info(f"Preparing {len(applications)} CVs...")
+    build_artifacts(applications)
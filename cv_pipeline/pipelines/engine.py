@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Iterable, Iterator
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def process_concurrently(
+    cv_agent, work_items: Iterable[dict], max_concurrency: int
+) -> Iterator[dict[str, Any]]:
+    """
+    Runs the CV agent graph over many applications at once.
+
+    At most `max_concurrency` applications are in flight at any time, so wall
+    clock time scales with the concurrency limit rather than the number of
+    applications. Work items are pulled lazily from `work_items`, which means a
+    generator can be passed in without materialising the whole work list.
+
+    Args:
+        cv_agent: A `CVAgent` instance whose compiled graph is invoked.
+        work_items: Iterable of graph inputs (position_number, application_id,
+            level, ...).
+        max_concurrency: Maximum number of applications processed at once.
+
+    Yields:
+        One dictionary per application as soon as it finishes, with keys
+        `input`, `response`, `error` and `duration`. Exactly one of `response`
+        and `error` is set, so a failing application never stops the run.
+    """
+    work_items = iter(work_items)
+    in_flight = {}
+
+    def timed_invoke(item):
+        start = time.perf_counter()
+        try:
+            return cv_agent.agent.invoke(item), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    with ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix="cv_agent"
+    ) as executor:
+
+        def submit_next() -> bool:
+            item = next(work_items, None)
+            if item is None:
+                return False
+            in_flight[executor.submit(timed_invoke, item)] = item
+            return True
+
+        while len(in_flight) < max_concurrency and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                response, error, duration = future.result()
+                if error is not None:
+                    log.error(f'Error processing {item["application_id"]} --- {error}')
+                yield {
+                    "input": item,
+                    "response": response,
+                    "error": error,
+                    "duration": duration,
+                }
+                submit_next()
+
+
+_DONE = object()
+
+
+def process_concurrently_async(
+    cv_agent, work_items: Iterable[dict], max_concurrency: int
+) -> Iterator[dict[str, Any]]:
+    """
+    Runs the CV agent graph over many applications on an asyncio event loop.
+
+    Same contract as `process_concurrently`, but `cv_agent` must be built with
+    `config["async"]` set so the graph uses the async nodes. Applications are
+    coroutines rather than threads, so a high `max_concurrency` costs little
+    more than the open LLM requests themselves.
+
+    The event loop runs in a background thread and hands finished applications
+    back through a bounded queue, so callers keep consuming a plain iterator.
+    Work items are pulled in a worker thread because they may come from
+    blocking database queries.
+    """
+    work_items = iter(work_items)
+    results = queue.Queue(maxsize=max_concurrency)
+    stop = threading.Event()
+    failure = []
+
+    def put(result):
+        # Back pressure: waits while the caller catches up, unless it has stopped
+        while not stop.is_set():
+            try:
+                results.put(result, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    async def timed_ainvoke(item):
+        start = time.perf_counter()
+        try:
+            response = await cv_agent.agent.ainvoke(item)
+            return item, response, None, time.perf_counter() - start
+        except Exception as e:
+            return item, None, e, time.perf_counter() - start
+
+    async def run():
+        in_flight = set()
+        exhausted = False
+        try:
+            while not stop.is_set():
+                while not exhausted and len(in_flight) < max_concurrency:
+                    item = await asyncio.to_thread(next, work_items, None)
+                    if item is None:
+                        exhausted = True
+                    else:
+                        in_flight.add(asyncio.create_task(timed_ainvoke(item)))
+                if not in_flight:
+                    return
+                done, in_flight = await asyncio.wait(
+                    in_flight, timeout=1, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    await asyncio.to_thread(put, task.result())
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def run_loop():
+        try:
+            asyncio.run(run())
+        except Exception as e:
+            failure.append(e)
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=run_loop, name="cv_agent_async", daemon=True)
+    thread.start()
+    try:
+        while (result := results.get()) is not _DONE:
+            item, response, error, duration = result
+            if error is not None:
+                log.error(f'Error processing {item["application_id"]} --- {error}')
+            yield {
+                "input": item,
+                "response": response,
+                "error": error,
+                "duration": duration,
+            }
+    finally:
+        stop.set()
+        thread.join()
+
+    if failure:
+        # e.g. the work list query failed, same as the threaded engine raising
+        raise failure[0]
+
+
+def with_position_context(cv_agent, work_items: Iterable[dict]) -> Iterator[dict]:
+    """
+    Adds position level context to work items that are grouped by position.
+
+    The context (related applications and position description parts) only
+    depends on the position, so it is computed once per group and passed in with
+    every application in the group. The nodes then skip those lookups. If the
+    context can't be computed the items are passed through unchanged and each
+    application computes (and reports) it on its own.
+    """
+    current_position = None
+    position_context = {}
+    for item in work_items:
+        position = (item["position_number"], item["level"])
+        if position != current_position:
+            current_position = position
+            try:
+                position_context = cv_agent.nodes.get_position_context(*position)
+            except Exception as e:
+                log.error(f"Error getting context for position {position[0]} --- {e}")
+                position_context = {}
+        yield {**item, **position_context}
@@ -4,7 +4,10 @@ from sqlalchemy import (
     Text,
     Boolean,
     DateTime,
+    Float,
+    LargeBinary,
     String,
+    func,
 )
 from sqlalchemy.dialects.postgresql import JSONB
 
@@ -20,8 +23,8 @@ def get_data_models(Base, experiment=None):
 
         id = Column(Integer, primary_key=True, autoincrement=True)
 
-        # Application id
-        application_id = Column(Text, primary_key=True)
+        # Application id (unique so that ingestion can upsert on it)
+        application_id = Column(Text, primary_key=True, index=True, unique=True)
 
         # Position number
         position_number = Column(Text, index=True)
@@ -54,8 +57,8 @@ def get_data_models(Base, experiment=None):
 
         id = Column(Integer, primary_key=True, autoincrement=True)
 
-        # Application id
-        application_id = Column(Text, primary_key=True)
+        # Application id (unique so that ingestion can upsert on it)
+        application_id = Column(Text, primary_key=True, index=True, unique=True)
 
         # Position number
         position_number = Column(Text, index=True)
@@ -114,8 +117,8 @@ def get_data_models(Base, experiment=None):
 
         id = Column(Integer, primary_key=True, autoincrement=True)
 
-        # Position number
-        position_number = Column(Text, primary_key=True, index=True)
+        # Position number (unique so that ingestion can upsert on it)
+        position_number = Column(Text, primary_key=True, index=True, unique=True)
 
         # Job title
         job_title = Column(Text)
@@ -126,12 +129,215 @@ def get_data_models(Base, experiment=None):
         # Level
         level = Column(Text)
 
+        # LLM summary of the position description (also embedded in the vector store)
+        summary = Column(Text)
+
+    class ProcessingJobs(Base):
+        # Queue of applications to be assessed, shared by all cv_process workers
+        __tablename__ = "processing_jobs"
+        __table_args__ = {"schema": schema_name}
+
+        # Application id
+        application_id = Column(Text, primary_key=True)
+
+        # Position number
+        position_number = Column(Text, index=True)
+
+        # Level of position
+        level = Column(Text)
+
+        # One of pending, claimed, done or failed
+        status = Column(Text, index=True, nullable=False, default="pending")
+
+        # Worker currently holding the job
+        worker_id = Column(Text)
+
+        # Claimed jobs whose lease has expired are handed to another worker
+        lease_expires_at = Column(DateTime(timezone=True))
+
+        # Last time the holding worker reported it was alive
+        heartbeat_at = Column(DateTime(timezone=True))
+
+        # Number of times the job has been claimed
+        attempts = Column(Integer, nullable=False, default=0)
+
+        # Error from the last failed attempt
+        last_error = Column(Text)
+
+    class PositionRetrievalCache(Base):
+        # Related applications retrieved for a position, so the vector search and
+        # comment queries only run once per position
+        __tablename__ = "position_retrieval_cache"
+        __table_args__ = {"schema": schema_name}
+
+        # Position number
+        position_number = Column(Text, primary_key=True)
+
+        # Level of position
+        level = Column(Text, primary_key=True, index=True)
+
+        # Embeddings collection the similar positions were found in
+        collection_name = Column(Text, primary_key=True)
+
+        # Summary of the position description
+        position_description = Column(Text)
+
+        # Positions identified as similar
+        similar_position_numbers = Column(JSONB)
+
+        # Reviewer comments for suitable applicants to the similar positions
+        suitability_comments_positive = Column(JSONB)
+
+        # Reviewer comments for unsuitable applicants to the similar positions
+        suitability_comments_negative = Column(JSONB)
+
+        # When the entry was created
+        created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    class SimilarPositions(Base):
+        # Most similar positions at the same level, computed when position
+        # descriptions are ingested
+        __tablename__ = "similar_positions"
+        __table_args__ = {"schema": schema_name}
+
+        # Position number
+        position_number = Column(Text, primary_key=True)
+
+        # Position number of a similar position
+        similar_position_number = Column(Text, primary_key=True)
+
+        # Embeddings collection the similarity was computed in
+        collection_name = Column(Text, primary_key=True)
+
+        # Level of both positions
+        level = Column(Text, index=True)
+
+        # Distance between the position descriptions, lower is more similar
+        score = Column(Float)
+
+    class SimilarPositionsComputed(Base):
+        # Positions whose similar positions have been computed, so that a
+        # position without any similar positions isn't searched for again
+        __tablename__ = "similar_positions_computed"
+        __table_args__ = {"schema": schema_name}
+
+        # Position number
+        position_number = Column(Text, primary_key=True)
+
+        # Embeddings collection the similarity was computed in
+        collection_name = Column(Text, primary_key=True)
+
+        # When the similar positions were last computed
+        computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    class LLMCache(Base):
+        # Responses of the LLM, so identical requests (e.g. experiment reruns)
+        # don't call it again. See cv_pipeline/llm_cache.py.
+        __tablename__ = "llm_cache"
+        __table_args__ = {"schema": schema_name}
+
+        # Hash of the model settings, prompt version and message content
+        cache_key = Column(Text, primary_key=True)
+
+        # Model that generated the response
+        model = Column(Text, index=True)
+
+        # Temperature the model was run at
+        temperature = Column(Float)
+
+        # Version of the prompts the response was generated with
+        prompt_version = Column(Text)
+
+        # Serialised LangChain generations
+        response = Column(Text)
+
+        # When the response was generated, used for the TTL and the size cap
+        created_at = Column(DateTime(timezone=True), index=True)
+
+    class EmbeddingCache(Base):
+        # Embeddings of texts, so identical texts aren't sent to the embeddings
+        # provider again. See cv_pipeline/embedding_cache.py.
+        __tablename__ = "embedding_cache"
+        __table_args__ = {"schema": schema_name}
+
+        # Embeddings model namespace and hash of the text
+        key = Column(Text, primary_key=True)
+
+        # Serialised embedding
+        value = Column(LargeBinary)
+
+        # When the embedding was stored
+        created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    class IngestionManifest(Base):
+        # Source files that have been ingested, identified by their contents
+        __tablename__ = "ingestion_manifest"
+        __table_args__ = {"schema": schema_name}
+
+        # Hash of the file contents
+        content_hash = Column(Text, primary_key=True)
+
+        # Name of the file when it was last ingested
+        file_name = Column(Text)
+
+        # Type of file (cvs, manual-review or pds)
+        kind = Column(Text)
+
+        # processing, done or failed
+        status = Column(Text, index=True)
+
+        # Number of rows in the file
+        rows_total = Column(Integer)
+
+        # Number of rows ingested
+        rows_done = Column(Integer, default=0)
+
+        # Number of rows that failed on the last attempt
+        rows_failed = Column(Integer, default=0)
+
+        # Error that stopped the file from being ingested
+        error = Column(Text)
+
+        # When the file was first seen
+        created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+        # When the status last changed
+        updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    class IngestionManifestRows(Base):
+        # Status of each row (application or position) of an ingested file
+        __tablename__ = "ingestion_manifest_rows"
+        __table_args__ = {"schema": schema_name}
+
+        # Hash of the file contents
+        content_hash = Column(Text, primary_key=True)
+
+        # Application id or position number
+        row_key = Column(Text, primary_key=True)
+
+        # pending, done or failed
+        status = Column(Text, default="pending")
+
+        # Error from the last attempt
+        error = Column(Text)
+
+        # When the status last changed
+        updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
     tables = {
         "applicants": Applicants,
         "positions": Positions,
         "applicant_suitability_manual": ApplicantSuitabilityManual,
         "applicant_suitability_automatic": ApplicantSuitabilityAutomatic,
         "applicant_suitability_automatic_experiment": ApplicantSuitabilityAutomatiExperiment,
+        "processing_jobs": ProcessingJobs,
+        "position_retrieval_cache": PositionRetrievalCache,
+        "similar_positions": SimilarPositions,
+        "similar_positions_computed": SimilarPositionsComputed,
+        "llm_cache": LLMCache,
+        "embedding_cache": EmbeddingCache,
+        "ingestion_manifest": IngestionManifest,
+        "ingestion_manifest_rows": IngestionManifestRows,
     }
 
     return tables
@@ -0,0 +1,229 @@
+from ..services import services
+from datetime import timedelta
+from typing import Iterator
+import logging
+import os
+import socket
+import threading
+import uuid
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+log = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Postgres backed queue that lets several cv_process workers share one work list.
+
+    Jobs are claimed in batches with `SELECT ... FOR UPDATE SKIP LOCKED`, so two
+    workers never claim the same application. Each claim holds a lease that a
+    background heartbeat keeps extending while the worker is alive. If a worker
+    dies its leases run out and the jobs are claimed by another worker.
+
+    Args
+    ----
+
+    jobs_table :
+        The `processing_jobs` data model.
+
+    lease_seconds : int
+        How long a claim is valid for without a heartbeat.
+
+    max_attempts : int
+        Number of claims after which a failing job is marked as failed rather
+        than handed out again.
+    """
+
+    def __init__(self, jobs_table, lease_seconds: int = 300, max_attempts: int = 3):
+        self.jobs = jobs_table
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat_thread = None
+
+    def enqueue(self, work_list_stmt) -> None:
+        """
+        Adds the applications selected by `work_list_stmt` to the queue.
+
+        `work_list_stmt` must select application_id, position_number and level.
+        Jobs that are already queued are left alone, except failed jobs which are
+        reset so that they are retried on the next run, and done jobs which the
+        work list selects again because their results were deleted.
+        """
+        stmt = insert(self.jobs).from_select(
+            ["application_id", "position_number", "level"], work_list_stmt
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[self.jobs.application_id],
+            set_={"status": "pending", "attempts": 0, "worker_id": None},
+            where=self.jobs.status.in_(["failed", "done"]),
+        )
+        with services.get_session() as session:
+            session.execute(stmt)
+
+    def claim(self, batch_size: int) -> list[dict]:
+        """
+        Claims up to `batch_size` pending or abandoned jobs for this worker.
+
+        An abandoned job counts as an attempt too, so one that keeps killing its
+        worker is marked as failed after max_attempts rather than claimed again.
+        """
+        lease_expired = and_(
+            self.jobs.status == "claimed",
+            self.jobs.lease_expires_at < func.now(),
+        )
+        sweep = (
+            update(self.jobs)
+            .where(lease_expired, self.jobs.attempts >= self.max_attempts)
+            .values(
+                status="failed",
+                worker_id=None,
+                lease_expires_at=None,
+                last_error="Lease expired on the last attempt",
+            )
+            .execution_options(synchronize_session=False)
+        )
+        claimable = (
+            select(self.jobs.application_id)
+            .where(
+                or_(
+                    self.jobs.status == "pending",
+                    and_(lease_expired, self.jobs.attempts < self.max_attempts),
+                )
+            )
+            # Keep applications for the same position together
+            .order_by(self.jobs.position_number, self.jobs.application_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(self.jobs)
+            .where(self.jobs.application_id.in_(claimable))
+            .values(
+                status="claimed",
+                worker_id=self.worker_id,
+                lease_expires_at=func.now() + self.lease,
+                heartbeat_at=func.now(),
+                attempts=self.jobs.attempts + 1,
+            )
+            .returning(
+                self.jobs.application_id, self.jobs.position_number, self.jobs.level
+            )
+            .execution_options(synchronize_session=False)
+        )
+        with services.get_session() as session:
+            session.execute(sweep)
+            rows = session.execute(stmt).all()
+
+        return [
+            {"position_number": pos_num, "application_id": app_id, "level": level}
+            for app_id, pos_num, level in sorted(rows, key=lambda r: (r[1] or "", r[0]))
+        ]
+
+    def claimed_work_items(self, batch_size: int) -> Iterator[dict]:
+        """Yields work items, claiming a new batch whenever the last one runs out."""
+        while True:
+            batch = self.claim(batch_size)
+            if not batch:
+                return
+            log.info(f"Worker {self.worker_id} claimed {len(batch)} applications")
+            yield from batch
+
+    def complete(self, session, application_ids: list[str]) -> set[str]:
+        """
+        Marks jobs as done within the caller's session.
+
+        Only jobs still held by this worker are marked, so the caller should
+        only write results for the returned ids. This keeps results exactly once
+        even if a lease expired and another worker took the job over.
+        """
+        if not application_ids:
+            return set()
+        stmt = (
+            update(self.jobs)
+            .where(
+                self.jobs.application_id.in_(application_ids),
+                self.jobs.worker_id == self.worker_id,
+                self.jobs.status == "claimed",
+            )
+            .values(status="done", lease_expires_at=None)
+            .returning(self.jobs.application_id)
+            .execution_options(synchronize_session=False)
+        )
+        return set(session.scalars(stmt).all())
+
+    def release(self, session, application_ids: list[str]) -> None:
+        """
+        Removes jobs that finished without a result (e.g. waiting for calibration)
+        so that they are queued again on the next run.
+        """
+        if not application_ids:
+            return
+        session.execute(
+            delete(self.jobs).where(
+                self.jobs.application_id.in_(application_ids),
+                self.jobs.worker_id == self.worker_id,
+            )
+        )
+
+    def fail(self, application_id: str, error: str) -> None:
+        """Hands a failed job back to the queue, or gives up after max_attempts."""
+        stmt = (
+            update(self.jobs)
+            .where(
+                self.jobs.application_id == application_id,
+                self.jobs.worker_id == self.worker_id,
+            )
+            .values(
+                status=case(
+                    (self.jobs.attempts >= self.max_attempts, "failed"),
+                    else_="pending",
+                ),
+                worker_id=None,
+                lease_expires_at=None,
+                last_error=error,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        with services.get_session() as session:
+            session.execute(stmt)
+
+    def heartbeat(self) -> None:
+        """Extends the lease of every job held by this worker."""
+        stmt = (
+            update(self.jobs)
+            .where(
+                self.jobs.worker_id == self.worker_id,
+                self.jobs.status == "claimed",
+            )
+            .values(
+                lease_expires_at=func.now() + self.lease,
+                heartbeat_at=func.now(),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        with services.get_session() as session:
+            session.execute(stmt)
+
+    def _heartbeat_loop(self):
+        interval = self.lease.total_seconds() / 3
+        while not self._stop_heartbeat.wait(interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                log.error(f"Heartbeat failed for worker {self.worker_id} --- {e}")
+
+    def __enter__(self):
+        self._stop_heartbeat.clear()
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, name="job_queue_heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop_heartbeat.set()
+        self._heartbeat_thread.join()
+        return False
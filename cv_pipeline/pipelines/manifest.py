@@ -0,0 +1,161 @@
+from ..services import services
+import hashlib
+import logging
+from itertools import islice
+from typing import Iterable
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+log = logging.getLogger(__name__)
+
+
+class IngestionManifest:
+    """
+    Record of which source files, and which rows within them, have been ingested.
+
+    Files are identified by a hash of their contents, so a file that was fully
+    ingested is skipped even if it is dropped again under another name, while an
+    edited file is ingested again. Each row of a file (an application or a
+    position) has its own status, so a rerun after a partial failure only
+    redoes the rows that failed.
+
+    Args
+    ----
+
+    files_table :
+        The `ingestion_manifest` data model.
+
+    rows_table :
+        The `ingestion_manifest_rows` data model.
+    """
+
+    def __init__(self, files_table, rows_table):
+        self.files = files_table
+        self.rows = rows_table
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """Hash of the file contents."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_done(self, content_hash: str) -> bool:
+        stmt = select(self.files.status).where(self.files.content_hash == content_hash)
+        with services.get_session() as session:
+            return session.scalars(stmt).first() == "done"
+
+    def start_file(
+        self, content_hash: str, file_name: str, kind: str, row_keys: Iterable[str]
+    ) -> set[str]:
+        """
+        Registers a file and its rows, keeping the status of rows from earlier
+        attempts.
+
+        `row_keys` is consumed in chunks, so it can be streamed from the file.
+
+        Returns:
+            The keys of the rows that still have to be ingested.
+        """
+        stmt = insert(self.files).values(
+            content_hash=content_hash,
+            file_name=file_name,
+            kind=kind,
+            status="processing",
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["content_hash"],
+            set_={
+                "file_name": stmt.excluded.file_name,
+                "status": "processing",
+                "updated_at": func.now(),
+            },
+        )
+        row_keys = iter(row_keys)
+        with services.get_session() as session:
+            session.execute(stmt)
+            # Chunked to stay below the bind parameter limit
+            while chunk := list(islice(row_keys, 5000)):
+                session.execute(
+                    insert(self.rows)
+                    .values(
+                        [
+                            {"content_hash": content_hash, "row_key": key}
+                            for key in chunk
+                        ]
+                    )
+                    .on_conflict_do_nothing()
+                )
+            rows_total = (
+                select(func.count())
+                .where(self.rows.content_hash == content_hash)
+                .scalar_subquery()
+            )
+            session.execute(
+                update(self.files)
+                .where(self.files.content_hash == content_hash)
+                .values(rows_total=rows_total)
+                .execution_options(synchronize_session=False)
+            )
+            pending = session.scalars(
+                select(self.rows.row_key).where(
+                    self.rows.content_hash == content_hash,
+                    self.rows.status != "done",
+                )
+            ).all()
+        return set(pending)
+
+    def mark_rows(
+        self,
+        content_hash: str,
+        row_keys: Iterable[str],
+        status: str,
+        error: str | None = None,
+    ) -> None:
+        row_keys = list(row_keys)
+        if not row_keys:
+            return
+        with services.get_session() as session:
+            session.execute(
+                update(self.rows)
+                .where(
+                    self.rows.content_hash == content_hash,
+                    self.rows.row_key.in_(row_keys),
+                )
+                .values(status=status, error=error, updated_at=func.now())
+                .execution_options(synchronize_session=False)
+            )
+
+    def finish_file(self, content_hash: str, error: str | None = None) -> bool:
+        """
+        Updates the file status from its rows: done if every row is done,
+        otherwise failed.
+
+        Returns:
+            Whether the file is done.
+        """
+        with services.get_session() as session:
+            counts = dict(
+                session.execute(
+                    select(self.rows.status, func.count())
+                    .where(self.rows.content_hash == content_hash)
+                    .group_by(self.rows.status)
+                ).all()
+            )
+            rows_done = counts.get("done", 0)
+            done = error is None and rows_done == sum(counts.values())
+            session.execute(
+                update(self.files)
+                .where(self.files.content_hash == content_hash)
+                .values(
+                    status="done" if done else "failed",
+                    rows_done=rows_done,
+                    rows_failed=counts.get("failed", 0),
+                    error=error,
+                    updated_at=func.now(),
+                )
+                .execution_options(synchronize_session=False)
+            )
+        return done
@@ -0,0 +1,396 @@
+from ..services import services, tables
+from .. import utils as ut
+from .. import rendering as ren
+from .similar_positions import update_similar_positions
+import asyncio
+import logging
+import os
+import shutil
+import time
+from sqlalchemy import bindparam, update
+from langchain_core.messages import HumanMessage
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+log = logging.getLogger(__name__)
+
+# Number of position descriptions rendered at the same time (0 means one per
+# render pool process)
+PD_RENDER_WORKERS = int(os.environ.get("PD_RENDER_WORKERS", 0))
+
+# Number of position descriptions summarised at the same time
+PD_SUMMARY_CONCURRENCY = int(os.environ.get("PD_SUMMARY_CONCURRENCY", 8))
+
+# Number of embeddings requests in flight at the same time
+PD_EMBED_CONCURRENCY = int(os.environ.get("PD_EMBED_CONCURRENCY", 2))
+
+# Number of summaries embedded and written to the database at once
+PD_UPLOAD_BATCH_SIZE = int(os.environ.get("PD_UPLOAD_BATCH_SIZE", 100))
+
+PD_SUMMARY_PROMPT = """
+                        You are an expert AI assistant specializing in roles within the arts and cultural
+                        heritage sector. Your task is to extract, synthesize, and structure key information
+                        from the provided museum position description.
+
+                        The output must be a concise, keyword-rich summary formatted in markdown. This output
+                        will be converted into a vector embedding to find similar roles across cultural
+                        institutions. Therefore, focus on capturing the essence of the role, its departmental
+                        function, required specializations, and interaction with collections or the public.
+
+                        **Instructions:**
+
+                        1.  **Analyze the Text:** Carefully read the entire position description provided
+                        below.
+                        2.  **Extract and Synthesize:** Do not just copy-paste. Synthesize the information
+                        into the specified categories. For example, consolidate skills mentioned in different
+                        sections into a single list.
+                        3.  **Use Keywords:** Be direct and use keywords that define the role (e.g.,
+                        "API development," "Agile methodology," "stakeholder management").
+                        4.  **Omit Fluff:** Exclude generic corporate boilerplate, benefits information, and
+                        equal opportunity statements.
+                        5.  **Format:** Use the exact markdown structure below. If a section is not
+                        applicable, write
+                        "N/A".
+
+                        **Structured Output:**
+
+                        **## Job Core**
+                        * **Job Title:** [Extracted Job Title, e.g., Registrar, Curator of Modern Art,
+                        Exhibition Designer]
+                        * **Seniority:** [e.g., Assistant, Associate, Senior, Head of, Intern]
+                        * **Team / Department:** [e.g., Curatorial, Collections Management, Conservation,
+                        Education, Exhibitions, Visitor Services, Development]
+                        * **Role Summary:** [A 1-2 sentence summary describing the core purpose of this
+                        role within the museum.]
+
+                        **## Key Responsibilities**
+                        [A concise, bulleted list of the primary duties. Start each bullet with an action
+                        verb relevant to museum work. Synthesize similar points.]
+                        *
+                        *
+                        *
+
+                        **## Core Competencies & Skills**
+                        * **Specialized Skills & Systems:** [Comma-separated list of essential technical
+                        systems, software, and practical skills. e.g., TMS, Vernon CMS, PastPerfect, Adobe
+                        Creative Suite, object handling, condition reporting, archival processing, grant
+                        writing, digital photography]
+                        * **Subject Matter Expertise:** [Comma-separated list of required knowledge areas.
+                        e.g., Art History, 19th-Century Photography, Material Culture, Conservation Science,
+                        Museum Education Theory]
+                        * **Soft Skills:** [Comma-separated list of key professional skills. e.g., Public
+                        Speaking, Research and Writing, Attention to Detail, Stakeholder Engagement,
+                        Cross-departmental Collaboration, Project Management]
+
+                        **## Qualifications & Experience**
+                        * **Education:** [Minimum or preferred educational background, e.g., MA in Museum
+                        Studies, PhD in Art History, Certificate in Conservation]
+                        * **Experience:** [Required years and type of experience, e.g., 3+ years in a museum
+                        registration role, demonstrated experience curating exhibitions]
+                        * **Collection Focus:** [The specific type of collection this role works with,
+                        if mentioned. e.g., Textiles, Works on Paper, Digital Media, Natural History
+                        Specimens, Archives]
+                        """
+
+
+# Marks the end of the items on a queue
+_DONE = object()
+
+
+def pd_summary_message(pd_pdf_parts: list) -> HumanMessage:
+    """Builds the message asking the LLM to summarise a position description."""
+    # Start with text prompt, followed by the text or image parts of the PDF
+    content_parts = [{"type": "text", "text": PD_SUMMARY_PROMPT}] + pd_pdf_parts
+
+    # Create the final HumanMessage
+    return HumanMessage(content=content_parts)
+
+
+def pd_pdf_path(position_number: str) -> str:
+    """The position description pdf, in the source folder unless already moved."""
+    source_path = f"data/source/pds/{position_number}.pdf"
+    if os.path.exists(source_path):
+        return source_path
+    return f"data/raw/pds/{position_number}.pdf"
+
+
+@retry(
+    wait=wait_exponential(multiplier=1, min=5, max=60),
+    stop=stop_after_attempt(5),
+    # Rate limits are handled, and already retried, by the rate limiter
+    retry=retry_if_exception(lambda e: not ut.is_rate_limit_error(e)),
+    reraise=True,
+    before_sleep=ut.log_retry_attempt,
+)
+async def embed_documents(texts: list[str]) -> list[list[float]]:
+    """Embeds texts with retry, within the embeddings rate limits."""
+    return await services.embeddings_rate_limiter.acall(
+        services.embeddings.aembed_documents,
+        texts,
+        tokens=ut.estimate_tokens(texts),
+    )
+
+
+class StageStats:
+    """Throughput counters of a pipeline stage."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.done = 0
+        self.failed = 0
+        # Seconds spent processing, summed over the workers
+        self.busy = 0.0
+        # Seconds spent waiting for room on the next stage's queue
+        self.blocked = 0.0
+
+    def log_stats(self, elapsed: float):
+        rate = self.done / elapsed if elapsed else 0
+        utilisation = self.busy / (elapsed * self.workers) if elapsed else 0
+        log.info(
+            f"{self.name}: {self.done} done, {self.failed} failed, {rate:.2f}/s, "
+            f"{self.workers} workers {utilisation:.0%} busy, "
+            f"{self.blocked:.1f}s blocked on the next stage"
+        )
+
+
+async def run_stage(
+    stats: StageStats,
+    inbox: asyncio.Queue,
+    outbox: asyncio.Queue | None,
+    process,
+    batch_size: int = 1,
+) -> None:
+    """
+    Runs `stats.workers` workers that take batches of up to `batch_size` items
+    from `inbox`, pass them to `process` and put the results on `outbox`.
+
+    `process` handles the failures of its items and returns the results of
+    those that succeeded. Workers wait while `outbox` is full, so a slow stage
+    holds back the ones before it rather than letting items pile up in memory.
+    """
+
+    async def worker():
+        while True:
+            batch = []
+            finished = False
+            while len(batch) < batch_size:
+                item = await inbox.get()
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if batch:
+                start = time.perf_counter()
+                results = await process(batch)
+                stats.busy += time.perf_counter() - start
+                stats.done += len(results)
+                stats.failed += len(batch) - len(results)
+                if outbox is not None:
+                    start = time.perf_counter()
+                    for result in results:
+                        await outbox.put(result)
+                    stats.blocked += time.perf_counter() - start
+
+            if finished:
+                # Pass the marker on to the other workers of this stage. There
+                # is room, the marker was the last item put on the queue.
+                inbox.put_nowait(_DONE)
+                return
+
+    await asyncio.gather(*(worker() for _ in range(stats.workers)))
+    if outbox is not None:
+        await outbox.put(_DONE)
+
+
+def write_positions(batch: list[tuple[dict, str, list[float]]], collection_name: str):
+    """
+    Stores a batch of embedded summaries in the vector store and the positions
+    table, updates the similar positions and moves the pdfs to the raw folder.
+    """
+    Positions = tables["positions"]
+
+    metadatas = [
+        {
+            "id": f'{data["position_number"]}_{collection_name}',
+            "file": f'data/raw/pds/{data["position_number"]}.pdf',
+            "type": "pd",
+            "department": data["department"],
+            "level": data["level"],
+        }
+        for data, _, _ in batch
+    ]
+    services.vector_store_cv.add_embeddings(
+        texts=[summary for _, summary, _ in batch],
+        embeddings=[vector for _, _, vector in batch],
+        metadatas=metadatas,
+        ids=[f'{metadata["id"]}_{collection_name}' for metadata in metadatas],
+    )
+
+    # Keep the summaries with the positions for indexed lookups
+    positions_table = Positions.__table__
+    with services.get_session() as session:
+        session.execute(
+            update(positions_table)
+            .where(positions_table.c.position_number == bindparam("b_position_number"))
+            .values(summary=bindparam("b_summary")),
+            [
+                {"b_position_number": data["position_number"], "b_summary": summary}
+                for data, summary, _ in batch
+            ],
+        )
+
+    for data, summary, _ in batch:
+        try:
+            # Precompute the most similar positions at the same level. Done one
+            # position at a time so each one sees the positions added before it.
+            update_similar_positions(data["position_number"], data["level"], summary)
+        except Exception as e:
+            log.error(
+                f'Error computing similar positions for {data["position_number"]} --- {e}'
+            )
+
+        source_path = f'data/source/pds/{data["position_number"]}.pdf'
+        if os.path.exists(source_path):
+            shutil.move(source_path, f'data/raw/pds/{data["position_number"]}.pdf')
+
+
+async def run_pd_pipeline(csv_data: list[dict], collection_name: str) -> dict[str, str]:
+    """
+    Renders, summarises, embeds and stores position descriptions in a pipeline
+    of stages connected by bounded queues, so rendering (CPU), LLM calls and
+    embeddings requests (network) and database writes overlap.
+
+    - render: `PD_RENDER_WORKERS` pdfs at a time on the render pool
+    - summarise: `PD_SUMMARY_CONCURRENCY` concurrent LLM calls
+    - embed: `PD_EMBED_CONCURRENCY` concurrent requests of `PD_UPLOAD_BATCH_SIZE` summaries
+    - write: one writer storing `PD_UPLOAD_BATCH_SIZE` positions at a time
+
+    Returns:
+        The error for each position that failed.
+    """
+    errors = {}
+    written_levels = set()
+    render_pool = services.render_pool
+    render_workers = PD_RENDER_WORKERS or (render_pool.workers if render_pool else 1)
+    render_workers = min(render_workers, len(csv_data))
+
+    def fail(items, error):
+        for item in items:
+            data = item[0] if isinstance(item, tuple) else item
+            log.error(f'Error preprocessing {data["position_number"]}.pdf --- {error}')
+            errors[data["position_number"]] = str(error)
+
+    async def render(batch):
+        [data] = batch
+        try:
+            # The work is done on the render pool, the thread only reads the
+            # render cache and waits for the pool
+            pd_pdf_parts = await asyncio.to_thread(
+                ren.pdf_to_message_parts,
+                pd_pdf_path(data["position_number"]),
+                label="Position Description",
+                mode=services.document_mode,
+                cache=services.render_cache,
+                profile=services.render_profile,
+                thread_count=services.render_threads,
+                pool=render_pool,
+            )
+        except Exception as e:
+            fail(batch, e)
+            return []
+        return [(data, pd_pdf_parts)]
+
+    async def summarise(batch):
+        [(data, pd_pdf_parts)] = batch
+        try:
+            response = await services.llm.ainvoke([pd_summary_message(pd_pdf_parts)])
+        except Exception as e:
+            fail(batch, e)
+            return []
+        return [(data, response.content)]
+
+    async def embed(batch):
+        try:
+            vectors = await embed_documents([summary for _, summary in batch])
+            # A provider returning fewer vectors than summaries fails the batch
+            # instead of dropping positions
+            return [
+                (data, summary, vector)
+                for (data, summary), vector in zip(batch, vectors, strict=True)
+            ]
+        except Exception as e:
+            fail(batch, e)
+            return []
+
+    async def write(batch):
+        try:
+            await asyncio.to_thread(write_positions, batch, collection_name)
+        except Exception as e:
+            fail(batch, e)
+            return []
+        written_levels.update(data["level"] for data, _, _ in batch)
+        return batch
+
+    stages = [
+        StageStats("render", render_workers),
+        StageStats("summarise", PD_SUMMARY_CONCURRENCY),
+        StageStats("embed", PD_EMBED_CONCURRENCY),
+        StageStats("write", 1),
+    ]
+    # Room for each stage to have one batch waiting per worker
+    queues = [
+        asyncio.Queue(maxsize=2 * render_workers),
+        asyncio.Queue(maxsize=PD_SUMMARY_CONCURRENCY),
+        asyncio.Queue(maxsize=PD_UPLOAD_BATCH_SIZE * PD_EMBED_CONCURRENCY),
+        asyncio.Queue(maxsize=PD_UPLOAD_BATCH_SIZE),
+    ]
+
+    async def produce():
+        for data in csv_data:
+            await queues[0].put(data)
+        await queues[0].put(_DONE)
+
+    start = time.perf_counter()
+    async with asyncio.TaskGroup() as group:
+        group.create_task(produce())
+        group.create_task(run_stage(stages[0], queues[0], queues[1], render))
+        group.create_task(run_stage(stages[1], queues[1], queues[2], summarise))
+        group.create_task(
+            run_stage(stages[2], queues[2], queues[3], embed, PD_UPLOAD_BATCH_SIZE)
+        )
+        group.create_task(
+            run_stage(stages[3], queues[3], None, write, PD_UPLOAD_BATCH_SIZE)
+        )
+    elapsed = time.perf_counter() - start
+
+    log.info(f"Ingested {stages[-1].done} position descriptions in {elapsed:.1f}s")
+    for stats in stages:
+        stats.log_stats(elapsed)
+    if render_pool is not None:
+        render_pool.log_stats()
+
+    # The new positions may be more similar to positions at their level than the
+    # ones that were cached for them
+    services.retrieval_cache.invalidate(levels=written_levels)
+
+    return errors
+
+
+def ingest_pds(csv_data: list[dict], collection_name: str) -> dict[str, str]:
+    """
+    Summarises, embeds and stores the position descriptions listed in a csv
+    (see `run_pd_pipeline`). A position that fails at any stage is logged and
+    its pdf is left in the source folder.
+
+    Returns:
+        The error for each position that failed.
+    """
+    if not csv_data:
+        return {}
+    return asyncio.run(run_pd_pipeline(csv_data, collection_name))
@@ -1,10 +1,19 @@
 from .agent.graph import CVAgent
+from .engine import (
+    process_concurrently,
+    process_concurrently_async,
+    with_position_context,
+)
+from .job_queue import JobQueue
+from .compare_assessments import print_agreement
 import os
 from .. import utils as ut
 from ..services import services, tables
 import uuid
 import logging
-from sqlalchemy import select
+import time
+from contextlib import nullcontext
+from sqlalchemy import func, insert, select, tuple_
 
 log = logging.getLogger(__name__)
 
@@ -25,95 +34,212 @@ if __name__ == "__main__":
         ]
         # In experiment mode we want applications which have already been manually reviewed.
         # In future this should be limited to a specific set according to a sampling strategy.
-        with services.get_session() as session:
-            all_applicant_ids = select(Applicants.application_id)
-            manual_ids = select(ApplicantSuitabilityManual.application_id)
-            # .intersect() returns unique values
-            common_ids_stmt = all_applicant_ids.intersect(manual_ids)
-            # .scalars().all() executes the query and returns the results as a simple list.
-            result = session.execute(common_ids_stmt)
-
-            applications_to_process = result.scalars().all()
+        all_applicant_ids = select(Applicants.application_id)
+        manual_ids = select(ApplicantSuitabilityManual.application_id)
+        # .intersect() returns unique values
+        ids_to_process = all_applicant_ids.intersect(manual_ids)
 
     else:
         ApplicantSuitabilityAutomatic = tables["applicant_suitability_automatic"]
         # In operational mode we want to process all unprocessed applications
-        with services.get_session() as session:
-            # all application IDs from the source table.
-            all_applicant_ids = select(Applicants.application_id)
-
-            # all application IDs from the table to subtract.
-            processed_ids = select(ApplicantSuitabilityAutomatic.application_id)
-
-            # Use .except_() to find the difference between the two queries.
-            stmt = all_applicant_ids.except_(processed_ids)
+        # all application IDs from the source table.
+        all_applicant_ids = select(Applicants.application_id)
+
+        # all application IDs from the table to subtract.
+        processed_ids = select(ApplicantSuitabilityAutomatic.application_id)
+
+        # Use .except_() to find the difference between the two queries.
+        ids_to_process = all_applicant_ids.except_(processed_ids)
+
+    # Build the whole work list in one query rather than looking up the position
+    # and level separately for every application.
+    work_list_stmt = (
+        select(Applicants.application_id, Applicants.position_number, Positions.level)
+        .outerjoin(Positions, Positions.position_number == Applicants.position_number)
+        .where(Applicants.application_id.in_(ids_to_process))
+        # Group applications by position so position level work is done once
+        .order_by(Applicants.position_number, Applicants.application_id)
+    )
 
-            result = session.execute(stmt)
+    # "threads" runs each application in a worker thread, "async" runs them as
+    # coroutines on an event loop with the async nodes. The async engine scales
+    # to many more in flight applications for the same resources.
+    engine = os.environ.get("CV_PROCESS_ENGINE", "threads")
+    engines = {"threads": process_concurrently, "async": process_concurrently_async}
+    if engine not in engines:
+        raise ValueError(
+            f"Unknown CV_PROCESS_ENGINE: {engine}. Use one of {list(engines)}"
+        )
+    config["async"] = engine == "async"
 
-            applications_to_process = result.scalars().all()
+    # "two_step" (default) makes a preliminary and a final assessment LLM call,
+    # "merged" makes both assessments in one call. Compare the two with
+    # experiment runs (see compare_assessments).
+    config["assessment_mode"] = os.environ.get("CV_ASSESSMENT_MODE", "two_step")
 
     cv_agent = CVAgent(config)
 
-    applications_automatic = []
-    for app_id in applications_to_process:
-        print(f"Processing {app_id}")
-        # Get position number from structured data
-        with services.get_session() as session:
-            stmt = select(Applicants.position_number).where(
-                Applicants.application_id == app_id
-            )
-
-            # Execute the statement and get the first result
-            pos_num = session.scalars(stmt).first()
-
-            stmt = select(Positions.level).where(Positions.position_number == pos_num)
-
-            # Execute the statement and get the first result
-            level = session.scalars(stmt).first()
+    # Number of applications sent through the agent at the same time. LLM calls
+    # dominate run time, so this is the main lever for throughput.
+    max_concurrency = int(os.environ.get("CV_PROCESS_CONCURRENCY", 4))
+
+    # The work list is read a page at a time with keyset pagination, each page
+    # in its own short transaction, so large work lists are never held in
+    # memory as a whole and no transaction stays open while applications are
+    # processed.
+    yield_per = int(os.environ.get("CV_PROCESS_YIELD_PER", 1000))
+
+    def work_list():
+        # Applications without a position number sort first rather than being
+        # skipped by the keyset comparison
+        position_key = func.coalesce(Applicants.position_number, "")
+        page_stmt = (
+            work_list_stmt.order_by(None)
+            .order_by(position_key, Applicants.application_id)
+            .limit(yield_per)
+        )
+        last_key = None
+        while True:
+            stmt = page_stmt
+            if last_key is not None:
+                stmt = stmt.where(
+                    tuple_(position_key, Applicants.application_id) > last_key
+                )
+            with services.get_session() as session:
+                rows = session.execute(stmt).all()
+            for app_id, pos_num, level in rows:
+                yield {
+                    "position_number": pos_num,
+                    "application_id": app_id,
+                    "level": level,
+                }
+            if len(rows) < yield_per:
+                return
+            app_id, pos_num, _ = rows[-1]
+            last_key = (pos_num or "", app_id)
+
+    keys_to_keep_for_trace = [
+        "invalid_reason",
+        "preliminary_assessment",
+        "suitability_reasoning",
+        "calibration_scheduled",
+        "calibration_needed",
+    ]
+
+    # Results are committed in chunks as they complete, so a crash only loses the
+    # chunk in flight. A rerun picks up the remainder through the work list query.
+    commit_every = int(os.environ.get("CV_PROCESS_COMMIT_EVERY", 50))
 
-        cv_agent_response = cv_agent.agent.invoke(
-            {"position_number": pos_num, "application_id": app_id, "level": level}
+    if os.environ.get("EXPERIMENT", None):
+        # Experiment runs are labelled per process so are not shared between workers
+        job_queue = None
+        work_items = work_list()
+    else:
+        # In operational mode several workers can run against the same database.
+        # Work is shared out through the processing_jobs queue so that every
+        # application is processed exactly once.
+        job_queue = JobQueue(
+            tables["processing_jobs"],
+            lease_seconds=int(os.environ.get("CV_PROCESS_LEASE_SECONDS", 300)),
+            max_attempts=int(os.environ.get("CV_PROCESS_MAX_ATTEMPTS", 3)),
         )
+        job_queue.enqueue(work_list_stmt)
+        work_items = job_queue.claimed_work_items(
+            int(os.environ.get("CV_PROCESS_CLAIM_BATCH", commit_every))
+        )
+        log.info(f"Running as worker {job_queue.worker_id}")
 
-        keys_to_keep_for_trace = [
-            "invalid_reason",
-            "suitability_reasoning",
-            "calibration_scheduled",
-            "calibration_needed",
-        ]
+    def commit_chunk(rows, released_ids):
+        if not rows and not released_ids:
+            return 0
+        with services.get_session() as session:
+            if job_queue is not None:
+                # Results and job completion are committed in the same transaction
+                done_ids = job_queue.complete(
+                    session, [r["application_id"] for r in rows]
+                )
+                rows = [r for r in rows if r["application_id"] in done_ids]
+                job_queue.release(session, released_ids)
+            if rows:
+                # Bulk insert of plain dictionaries, avoids building an ORM object per row
+                session.execute(insert(ApplicantSuitabilityAutomatic), rows)
+        log.info(
+            f"Committed {len(rows)} records to {ApplicantSuitabilityAutomatic.__tablename__}"
+        )
+        return len(rows)
 
-        suitability_automatic_trace = {
-            key: cv_agent_response[key]
-            for key in keys_to_keep_for_trace
-            if key in cv_agent_response
-        }
-
-        processed_application = {
-            "application_id": app_id,
-            "position_number": pos_num,
-            "suitability_automatic": cv_agent_response["suitability_automatic"],
-            "suitability_automatic_trace": suitability_automatic_trace,
-        }
-
-        if os.environ.get("EXPERIMENT", None):
-            processed_application["experiment"] = config["experiment_id"]
-
-        # Add to list of items to be db if not waiting for calibration
-        # For now we never schedule calibration, so this is placeholder logic
-        if (
-            not cv_agent_response["calibration_needed"]
-            and not cv_agent_response["calibration_scheduled"]
-        ):
-            applications_automatic.append(processed_application)
+    applications_automatic = []
+    released_ids = []
+    n_committed = 0
+    n_processed = 0
+    failed_applications = {}
+    run_start = time.perf_counter()
+    with job_queue if job_queue is not None else nullcontext():
+        work_items = with_position_context(cv_agent, work_items)
+        for result in engines[engine](cv_agent, work_items, max_concurrency):
+            app_id = result["input"]["application_id"]
+            pos_num = result["input"]["position_number"]
+            n_processed += 1
+
+            if result["error"] is not None:
+                failed_applications[app_id] = repr(result["error"])
+                if job_queue is not None:
+                    job_queue.fail(app_id, repr(result["error"]))
+                continue
+
+            print(f"Processed {app_id} in {result['duration']:.1f}s")
+            cv_agent_response = result["response"]
+
+            suitability_automatic_trace = {
+                key: cv_agent_response[key]
+                for key in keys_to_keep_for_trace
+                if key in cv_agent_response
+            }
+            suitability_automatic_trace["assessment_mode"] = config["assessment_mode"]
+
+            processed_application = {
+                "application_id": app_id,
+                "position_number": pos_num,
+                "suitability_automatic": cv_agent_response.get("suitability_automatic"),
+                "suitability_automatic_trace": suitability_automatic_trace,
+            }
+
+            if os.environ.get("EXPERIMENT", None):
+                processed_application["experiment"] = config["experiment_id"]
+
+            # Add to list of items to be db if not waiting for calibration
+            # For now we never schedule calibration, so this is placeholder logic
+            if not cv_agent_response.get(
+                "calibration_needed"
+            ) and not cv_agent_response.get("calibration_scheduled"):
+                applications_automatic.append(processed_application)
+            else:
+                released_ids.append(app_id)
+
+            if len(applications_automatic) + len(released_ids) >= commit_every:
+                n_committed += commit_chunk(applications_automatic, released_ids)
+                applications_automatic = []
+                released_ids = []
+
+        n_committed += commit_chunk(applications_automatic, released_ids)
 
     log.info(
-        f"Uploading {len(applications_automatic)} records to applicant_suitability_automatic"
+        f"Processed {n_processed} applications in {time.perf_counter() - run_start:.1f}s "
+        f"with concurrency {max_concurrency} ({engine}), committed {n_committed} records"
     )
-    with services.get_session() as session:
-        # Create a list of data objects from the processed applications
-        applicant_suitability_automatic = [
-            ApplicantSuitabilityAutomatic(**data) for data in applications_automatic
-        ]
-
-        # session.add_all() efficiently adds all objects to the session
-        session.add_all(applicant_suitability_automatic)
+    services.render_cache.log_stats()
+    if services.render_pool is not None:
+        services.render_pool.log_stats()
+    if services.cv_artifacts is not None:
+        services.cv_artifacts.log_stats()
+    services.retrieval_cache.log_stats()
+    if services.llm_cache is not None:
+        services.llm_cache.log_stats()
+    services.llm_rate_limiter.log_stats()
+    if os.environ.get("EXPERIMENT", None):
+        print_agreement([config["experiment_id"]])
+    if failed_applications:
+        log.error(
+            f"{len(failed_applications)} applications failed and will be retried: "
+            f"{failed_applications}"
+        )
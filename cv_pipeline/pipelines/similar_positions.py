@@ -0,0 +1,231 @@
+from ..services import services, tables
+import logging
+import os
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+log = logging.getLogger(__name__)
+
+# Number of similar positions kept for each position
+SIMILAR_POSITIONS_K = int(os.environ.get("SIMILAR_POSITIONS_K", 3))
+
+# Positions further apart than this are not considered similar (unset keeps all)
+SIMILAR_POSITIONS_MAX_DISTANCE = (
+    float(os.environ["SIMILAR_POSITIONS_MAX_DISTANCE"])
+    if os.environ.get("SIMILAR_POSITIONS_MAX_DISTANCE")
+    else None
+)
+
+# Number of neighbours checked when deciding which existing positions the new
+# one should be added to
+SIMILAR_POSITIONS_SEARCH_K = int(os.environ.get("SIMILAR_POSITIONS_SEARCH_K", 50))
+
+
+def search_similar_positions(
+    position_number: str, level: str, summary: str, k: int
+) -> list[tuple[str, float]]:
+    """
+    Searches the vector store for the positions at `level` most similar to the
+    position description `summary`.
+
+    Returns:
+        (position number, distance) pairs, most similar first, within the
+        configured maximum distance.
+    """
+    collection_name = services.collection_name
+    filter_criteria = {
+        "level": level,
+        "id": {"$ne": f"{position_number}_{collection_name}"},
+    }
+
+    similar_pds = services.vector_store_cv.similarity_search_with_score(
+        summary,
+        k=k,
+        filter=filter_criteria,
+    )
+
+    return [
+        (doc.id.replace(f"_{collection_name}", ""), score)
+        for doc, score in similar_pds
+        if SIMILAR_POSITIONS_MAX_DISTANCE is None
+        or score <= SIMILAR_POSITIONS_MAX_DISTANCE
+    ]
+
+
+def get_similar_position_numbers(position_number: str) -> list[str] | None:
+    """
+    Reads the precomputed similar positions, most similar first.
+
+    Returns an empty list if none were found within the maximum distance, and
+    None if nothing has been computed for the position (e.g. it was ingested
+    before the table existed).
+    """
+    SimilarPositions = tables["similar_positions"]
+    Computed = tables["similar_positions_computed"]
+    stmt = (
+        select(Computed.computed_at, SimilarPositions.similar_position_number)
+        .outerjoin(
+            SimilarPositions,
+            and_(
+                SimilarPositions.position_number == Computed.position_number,
+                SimilarPositions.collection_name == Computed.collection_name,
+            ),
+        )
+        .where(
+            Computed.position_number == position_number,
+            Computed.collection_name == services.collection_name,
+        )
+        .order_by(SimilarPositions.score)
+    )
+    with services.get_session() as session:
+        rows = session.execute(stmt).all()
+    if not rows:
+        return None
+    return [
+        similar_position_number
+        for _, similar_position_number in rows
+        if similar_position_number is not None
+    ]
+
+
+def update_similar_positions(position_number: str, level: str, summary: str) -> None:
+    """
+    Stores the most similar positions for a newly ingested position and adds it
+    to the similar positions of existing positions it is closer to than their
+    current ones. Only the affected positions are touched.
+    """
+    SimilarPositions = tables["similar_positions"]
+    Computed = tables["similar_positions_computed"]
+    collection_name = services.collection_name
+
+    neighbours = search_similar_positions(
+        position_number,
+        level,
+        summary,
+        k=max(SIMILAR_POSITIONS_K, SIMILAR_POSITIONS_SEARCH_K),
+    )
+
+    with services.get_session() as session:
+        # Replace the similar positions of the new position
+        session.execute(
+            delete(SimilarPositions).where(
+                SimilarPositions.position_number == position_number,
+                SimilarPositions.collection_name == collection_name,
+            )
+        )
+        # Record the computation even without similar positions, so the agent
+        # doesn't search for them again
+        stmt = insert(Computed).values(
+            position_number=position_number, collection_name=collection_name
+        )
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["position_number", "collection_name"],
+                set_={"computed_at": func.now()},
+            )
+        )
+        rows = [
+            {
+                "position_number": position_number,
+                "similar_position_number": similar_position_number,
+                "collection_name": collection_name,
+                "level": level,
+                "score": score,
+            }
+            for similar_position_number, score in neighbours[:SIMILAR_POSITIONS_K]
+        ]
+
+        # Distances are symmetric, so the new position belongs in the similar
+        # positions of any neighbour that has fewer than k or a worse one.
+        affected = []
+        if neighbours:
+            stored = session.execute(
+                select(
+                    SimilarPositions.position_number,
+                    func.count(),
+                    func.max(SimilarPositions.score),
+                )
+                .where(
+                    SimilarPositions.position_number.in_([n for n, _ in neighbours]),
+                    SimilarPositions.collection_name == collection_name,
+                )
+                .group_by(SimilarPositions.position_number)
+            ).all()
+            stored = {n: (count, worst) for n, count, worst in stored}
+
+            for neighbour, score in neighbours:
+                count, worst = stored.get(neighbour, (0, None))
+                if count < SIMILAR_POSITIONS_K or score < worst:
+                    affected.append(neighbour)
+                    rows.append(
+                        {
+                            "position_number": neighbour,
+                            "similar_position_number": position_number,
+                            "collection_name": collection_name,
+                            "level": level,
+                            "score": score,
+                        }
+                    )
+
+        if rows:
+            stmt = insert(SimilarPositions).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[
+                    "position_number",
+                    "similar_position_number",
+                    "collection_name",
+                ],
+                set_={"score": stmt.excluded.score, "level": stmt.excluded.level},
+            )
+            session.execute(stmt)
+
+        if affected:
+            # Trim the affected positions back to their k most similar
+            ranked = (
+                select(
+                    SimilarPositions.position_number,
+                    SimilarPositions.similar_position_number,
+                    func.row_number()
+                    .over(
+                        partition_by=SimilarPositions.position_number,
+                        order_by=SimilarPositions.score,
+                    )
+                    .label("rank"),
+                )
+                .where(
+                    SimilarPositions.position_number.in_(affected),
+                    SimilarPositions.collection_name == collection_name,
+                )
+                .subquery()
+            )
+            session.execute(
+                delete(SimilarPositions).where(
+                    SimilarPositions.collection_name == collection_name,
+                    SimilarPositions.position_number == ranked.c.position_number,
+                    SimilarPositions.similar_position_number
+                    == ranked.c.similar_position_number,
+                    ranked.c.rank > SIMILAR_POSITIONS_K,
+                )
+            )
+
+    log.info(
+        f"Updated similar positions for {position_number} and "
+        f"{len(affected)} existing positions"
+    )
+
+
+if __name__ == "__main__":
+    # Backfill for positions ingested before similar positions were precomputed
+    Positions = tables["positions"]
+    with services.get_session() as session:
+        positions = session.execute(
+            select(Positions.position_number, Positions.level, Positions.summary).where(
+                Positions.summary.is_not(None)
+            )
+        ).all()
+
+    for position_number, level, summary in positions:
+        try:
+            update_similar_positions(position_number, level, summary)
+        except Exception as e:
+            log.error(f"Error computing similar positions for {position_number} --- {e}")
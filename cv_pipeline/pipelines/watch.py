@@ -0,0 +1,148 @@
+from ..services import services
+from .. import utils as ut
+from .preprocess import ingest_cv_file, ingest_pd_file
+import glob
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+# How often the source folders are checked for new files
+WATCH_POLL_SECONDS = float(os.environ.get("WATCH_POLL_SECONDS", 5))
+
+# A csv and its pdfs must be unchanged for this long before they are ingested,
+# so files that are still being copied in are left alone
+WATCH_SETTLE_SECONDS = float(os.environ.get("WATCH_SETTLE_SECONDS", 10))
+
+# A csv whose pdfs haven't all arrived is ingested anyway after this long. The
+# rows with missing pdfs fail and are retried when the pdfs land.
+WATCH_MAX_WAIT_SECONDS = float(os.environ.get("WATCH_MAX_WAIT_SECONDS", 600))
+
+
+def _stat(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def referenced_pdfs(csv_file_name: str) -> list[str]:
+    """The pdfs in the source folders that a source csv refers to."""
+    if "manual-review" in csv_file_name:
+        return []
+    if os.path.dirname(csv_file_name).endswith("pds"):
+        return [
+            f'data/source/pds/{data["position_number"]}.pdf'
+            for data in ut.iter_csv(csv_file_name)
+        ]
+    return [
+        f'data/source/cvs/{data["position_number"]}/{data["application_id"]}.pdf'
+        for data in ut.iter_csv(csv_file_name)
+    ]
+
+
+class FolderWatcher:
+    """
+    Polls the source folders and ingests each csv as soon as it, and the pdfs
+    it refers to, have stopped changing.
+
+    Files are tracked by size and modification time, so a poll is one directory
+    listing plus a stat per file. A csv is only ingested again if it or one of
+    its pdfs changes (e.g. a missing pdf lands), so files with rows that keep
+    failing are not retried on every poll.
+    """
+
+    def __init__(self, settle_seconds: float, max_wait_seconds: float):
+        self.settle_seconds = settle_seconds
+        self.max_wait_seconds = max_wait_seconds
+        # csv -> (signature, first seen, last changed)
+        self._seen = {}
+        # csv -> (csv stat, referenced pdfs), so csvs are only parsed when they change
+        self._pdfs = {}
+        # csv -> signature when it was last ingested
+        self._attempted = {}
+
+    def _signature(self, csv_file_name: str):
+        csv_stat = _stat(csv_file_name)
+        cached = self._pdfs.get(csv_file_name)
+        if cached is None or cached[0] != csv_stat:
+            try:
+                pdfs = referenced_pdfs(csv_file_name)
+            except (KeyError, ValueError):
+                # Header not fully written yet
+                pdfs = None
+            cached = self._pdfs[csv_file_name] = (csv_stat, pdfs)
+        pdfs = cached[1]
+        if pdfs is None:
+            return csv_stat, None
+        return csv_stat, tuple(_stat(pdf) for pdf in pdfs)
+
+    def ready_files(self) -> list[str]:
+        """csvs that are ready to be ingested, in the order they should be."""
+        now = time.monotonic()
+        ready = []
+        # Positions first so applications can be assessed against them straight away
+        csv_files = sorted(glob.glob("data/source/pds/*.csv")) + sorted(
+            glob.glob("data/source/cvs/*.csv")
+        )
+        for csv_file_name in csv_files:
+            signature = self._signature(csv_file_name)
+            seen = self._seen.get(csv_file_name)
+            if seen is None or seen[0] != signature:
+                first_seen = seen[1] if seen else now
+                self._seen[csv_file_name] = (signature, first_seen, now)
+                continue
+
+            _, first_seen, changed_at = seen
+            csv_stat, pdf_stats = signature
+            if csv_stat is None or pdf_stats is None:
+                continue
+            if now - changed_at < self.settle_seconds:
+                continue
+            complete = all(stat is not None for stat in pdf_stats)
+            if not complete and now - first_seen < self.max_wait_seconds:
+                continue
+            if self._attempted.get(csv_file_name) == signature:
+                continue
+            ready.append(csv_file_name)
+
+        # Forget csvs that have been ingested and moved away
+        for csv_file_name in set(self._seen).difference(csv_files):
+            self._seen.pop(csv_file_name, None)
+            self._pdfs.pop(csv_file_name, None)
+            self._attempted.pop(csv_file_name, None)
+        return ready
+
+    def poll(self) -> int:
+        """Ingests the csvs that are ready. Returns how many were ingested."""
+        ready = self.ready_files()
+        for csv_file_name in ready:
+            self._attempted[csv_file_name] = self._seen[csv_file_name][0]
+            start = time.perf_counter()
+            try:
+                if os.path.dirname(csv_file_name).endswith("pds"):
+                    ingest_pd_file(csv_file_name, services.collection_name)
+                else:
+                    ingest_cv_file(csv_file_name)
+                log.info(
+                    f"Ingested {csv_file_name} in {time.perf_counter() - start:.1f}s"
+                )
+            except Exception as e:
+                log.error(f"Error preprocessing {csv_file_name} --- {e}")
+        return len(ready)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    watcher = FolderWatcher(WATCH_SETTLE_SECONDS, WATCH_MAX_WAIT_SECONDS)
+    log.info(f"Watching data/source for new files every {WATCH_POLL_SECONDS}s")
+    while True:
+        try:
+            watcher.poll()
+        except Exception as e:
+            log.error(f"Error watching data/source --- {e}")
+        time.sleep(WATCH_POLL_SECONDS)
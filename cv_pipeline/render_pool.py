@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from cv_pipeline import rendering as ren
+
+log = logging.getLogger(__name__)
+
+
+def _render(
+    pdf_path: str, profile: ren.RenderProfile
+) -> tuple[list[bytes], float, float]:
+    """Renders in a worker process. Returns the pages and when rendering started and ended."""
+    started = time.time()
+    pages = ren.render_pdf_pages(pdf_path, profile, thread_count=1)
+    return pages, started, time.time()
+
+
+class RenderPool:
+    """
+    Fixed number of worker processes that render pdf pages (and extract their
+    text layers).
+
+    Rendering in the caller's thread starts poppler processes for every
+    document being processed at once, which oversubscribes the cores, and does
+    the PIL work (whitespace trimming, re-encoding) under the GIL. The pool
+    caps rendering at `workers` documents at a time, one poppler process each,
+    and queues the rest.
+
+    The pool keeps track of how many renders are waiting or running (queue
+    depth), how long they waited for a worker and how long they took.
+
+    Args
+    ----
+
+    workers : int
+        Number of worker processes.
+
+    latency_window : int
+        Number of recent renders that latency percentiles are computed over.
+    """
+
+    def __init__(self, workers: int, latency_window: int = 1000):
+        self.workers = workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.total_render = 0.0
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                log.info(f"Starting render pool with {self.workers} processes...")
+                # Spawned workers don't inherit the database connections and
+                # threads of this process
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    @property
+    def depth(self) -> int:
+        """Number of renders waiting for or running on a worker."""
+        return self.submitted - self.completed - self.failed
+
+    def submit(self, pdf_path: str, profile: ren.RenderProfile) -> Future:
+        """Queues a render. The future's result is the JPEG bytes of each page."""
+        executor = self.executor
+        submitted_at = time.time()
+        with self._lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.depth)
+
+        result = Future()
+
+        def done(future: Future):
+            try:
+                pages, started, finished = future.result()
+            except BaseException as e:
+                with self._lock:
+                    self.failed += 1
+                result.set_exception(e)
+                return
+            with self._lock:
+                self.completed += 1
+                self.total_wait += started - submitted_at
+                self.total_render += finished - started
+                self._latencies.append(finished - submitted_at)
+            result.set_result(pages)
+
+        executor.submit(_render, pdf_path, profile).add_done_callback(done)
+        return result
+
+    def render(self, pdf_path: str, profile: ren.RenderProfile) -> list[bytes]:
+        """Renders each page of a pdf to JPEG bytes on a worker process."""
+        return self.submit(pdf_path, profile).result()
+
+    async def arender(self, pdf_path: str, profile: ren.RenderProfile) -> list[bytes]:
+        """Async version of `render`."""
+        return await asyncio.wrap_future(self.submit(pdf_path, profile))
+
+    def extract_text(self, pdf_path: str) -> str | None:
+        """`rendering.extract_text_layer` on a worker process."""
+        return self.executor.submit(ren.extract_text_layer, pdf_path).result()
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def log_stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            completed = self.completed
+            mean_wait = self.total_wait / completed if completed else 0
+            mean_render = self.total_render / completed if completed else 0
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0
+        log.info(
+            f"Render pool: {completed} renders, {self.failed} failed on {self.workers} "
+            f"processes, queue depth {self.depth} (peak {self.max_depth}), "
+            f"mean wait {mean_wait * 1000:.0f}ms, mean render {mean_render * 1000:.0f}ms, "
+            f"p95 latency {p95 * 1000:.0f}ms"
+        )
@@ -0,0 +1,393 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from PIL import Image, ImageChops
+from pdf2image import convert_from_path
+from pypdf import PdfReader
+
+log = logging.getLogger(__name__)
+
+
+def file_entries(paths) -> list[tuple[float, int, Path]]:
+    """
+    (modification time, size, path) of each file, least recently used first.
+
+    Files removed in the meantime (e.g. evicted by another process sharing the
+    directory) are skipped.
+    """
+    entries = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    return sorted(entries)
+
+
+def evict_least_recently_used(paths, max_bytes: int, name: str) -> int:
+    """
+    Removes the least recently used of `paths` until they take up at most 90%
+    of `max_bytes`.
+
+    Returns:
+        The total size of the files that are left.
+    """
+    entries = file_entries(paths)
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in entries:
+        if size <= 0.9 * max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        size -= entry_size
+        log.debug(f"Evicted {path.name} from {name}")
+    return size
+
+
+class RenderCache:
+    """
+    On-disk cache of pdf pages that are ready to send to an LLM.
+
+    Entries are keyed by a hash of the file contents plus the render parameters,
+    so a file that is moved or renamed still hits the cache while a changed file
+    or different settings miss it. The cache is bounded in size and evicts the
+    least recently used entries first.
+
+    Args
+    ----
+
+    directory : str
+        Where cache entries are stored.
+
+    max_bytes : int
+        Total size of the cache before the least recently used entries are
+        evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in file_entries(self.directory.glob("*.json")))
+
+    @staticmethod
+    def key(pdf_path: str, **params) -> str:
+        """Hash of the file contents and the parameters used to render it."""
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> list | None:
+        path = self.directory / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                parts = json.load(f)
+            # Touch the entry so it counts as recently used
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return parts
+
+    def put(self, key: str, parts: list) -> None:
+        path = self.directory / f"{key}.json"
+        # Write to a temporary file first so readers never see a partial entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(parts, f)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until the cache is 90% full."""
+        self._size = evict_least_recently_used(
+            self.directory.glob("*.json"), self.max_bytes, "render cache"
+        )
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        log.info(
+            f"Render cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+            f"{self._size / 1e6:.1f}MB in {self.directory}"
+        )
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """
+    Settings for turning pdf pages into images for an LLM.
+
+    Smaller images mean smaller payloads (faster uploads and fewer image tokens)
+    at the risk of losing detail the model needs. Use the rendering benchmark
+    (`python -m cv_pipeline.benchmarks.rendering`) to compare profiles.
+    """
+
+    # Resolution pages are rendered at
+    dpi: int = 200
+    # Render in grayscale rather than full colour
+    grayscale: bool = False
+    # Upper limit on the longest side of a page in pixels (lowers the dpi if needed)
+    max_dimension: int | None = None
+    # Crop blank margins. Needs a pass through PIL so is slower to render.
+    trim_whitespace: bool = False
+    # JPEG encoder quality
+    jpeg_quality: int = 75
+
+
+PROFILES = {
+    # Same resolution, colour and JPEG quality as the original poppler + PIL
+    # defaults. The JPEGs are encoded by poppler with optimised Huffman tables,
+    # so the files are not byte for byte the same.
+    "standard": RenderProfile(),
+    "balanced": RenderProfile(
+        dpi=150, grayscale=True, max_dimension=1600, trim_whitespace=True, jpeg_quality=70
+    ),
+    "compact": RenderProfile(
+        dpi=100, grayscale=True, max_dimension=1200, trim_whitespace=True, jpeg_quality=60
+    ),
+}
+
+
+def get_profile(name: str) -> RenderProfile:
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown render profile: {name}. Use one of {list(PROFILES)}"
+        ) from None
+
+
+def _effective_dpi(pdf_path: str, profile: RenderProfile) -> int:
+    """Lowers the dpi so the largest page fits within `profile.max_dimension`."""
+    if profile.max_dimension is None:
+        return profile.dpi
+    reader = PdfReader(pdf_path)
+    longest_side_points = max(
+        max(float(page.mediabox.width), float(page.mediabox.height))
+        for page in reader.pages
+    )
+    # PDF sizes are in points, 72 to the inch
+    max_dpi = int(profile.max_dimension * 72 / longest_side_points)
+    return max(1, min(profile.dpi, max_dpi))
+
+
+def _trim_whitespace(image: Image.Image) -> Image.Image:
+    """Crops the blank margins around the content of a page."""
+    background = Image.new(image.mode, image.size, 255 if image.mode == "L" else "white")
+    # Small differences (e.g. JPEG noise) shouldn't count as content
+    diff = ImageChops.difference(image, background).point(lambda p: 255 if p > 16 else 0)
+    bbox = diff.getbbox()
+    return image.crop(bbox) if bbox else image
+
+
+def render_pdf_pages(
+    pdf_path: str, profile: RenderProfile = PROFILES["standard"], thread_count: int = 1
+) -> list[bytes]:
+    """
+    Renders each page of a pdf to JPEG bytes.
+
+    poppler writes the JPEGs directly, so pages are not decoded and re-encoded
+    through PIL. The exception is whitespace trimming, which has to crop the
+    decoded image.
+
+    Args:
+        pdf_path: Path to the pdf file.
+        profile: Settings to render with.
+        thread_count: Number of poppler processes to render pages with.
+
+    Returns:
+        The encoded JPEG bytes of each page.
+    """
+    dpi = _effective_dpi(pdf_path, profile)
+
+    if profile.trim_whitespace:
+        images = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            grayscale=profile.grayscale,
+            thread_count=thread_count,
+        )
+        pages = []
+        for image in images:
+            buffered = io.BytesIO()
+            _trim_whitespace(image).save(
+                buffered, format="JPEG", quality=profile.jpeg_quality, optimize=True
+            )
+            pages.append(buffered.getvalue())
+        return pages
+
+    with tempfile.TemporaryDirectory() as output_folder:
+        paths = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            fmt="jpeg",
+            jpegopt={"quality": profile.jpeg_quality, "optimize": True},
+            grayscale=profile.grayscale,
+            thread_count=thread_count,
+            output_folder=output_folder,
+            paths_only=True,
+        )
+        # Paths are returned in page order
+        pages = []
+        for path in paths:
+            with open(path, "rb") as f:
+                pages.append(f.read())
+        return pages
+
+
+def image_part(page: bytes) -> dict:
+    """An `image_url` message part holding a JPEG page as a base64 data url."""
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{base64.b64encode(page).decode('utf-8')}"
+        },
+    }
+
+
+def text_part(label: str, text: str) -> dict:
+    """A `text` message part holding the extracted text of a document."""
+    return {"type": "text", "text": f"**{label} (text of the pdf):**\n{text}"}
+
+
+def pdf_to_image_parts(
+    pdf_path: str,
+    cache: RenderCache | None = None,
+    profile: RenderProfile = PROFILES["standard"],
+    thread_count: int = 1,
+    pool=None,
+) -> list:
+    """
+    Converts each page of a pdf into an image message part for an LLM.
+
+    Args:
+        pdf_path: Path to the pdf file.
+        cache: Optional cache of previously rendered pages.
+        profile: Settings to render with.
+        thread_count: Number of poppler processes to render pages with.
+        pool: Optional `RenderPool` to render on instead of the calling
+            thread (`thread_count` is then ignored).
+
+    Returns:
+        A list of `image_url` content parts, one per page, with the images as
+        base64 data urls.
+    """
+    if cache is not None:
+        key = cache.key(pdf_path, **asdict(profile))
+        parts = cache.get(key)
+        if parts is not None:
+            return parts
+
+    if pool is not None:
+        pages = pool.render(pdf_path, profile)
+    else:
+        pages = render_pdf_pages(pdf_path, profile, thread_count=thread_count)
+    parts = [image_part(page) for page in pages]
+
+    if cache is not None:
+        cache.put(key, parts)
+
+    return parts
+
+
+def extract_text_layer(pdf_path: str, min_chars_per_page: int = 100) -> str | None:
+    """
+    Extracts the text layer of a pdf if it is good enough to send instead of
+    page images.
+
+    Documents generated by word processors have a full text layer, while scanned
+    documents have little or none, or only garbage from a poor OCR layer. Every
+    page has to have at least `min_chars_per_page` characters, mostly letters
+    and numbers, for the text to be used.
+
+    Returns:
+        The text of all pages, or None if the pdf should be sent as images.
+    """
+    try:
+        reader = PdfReader(pdf_path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        log.warning(f"Could not read text layer of {pdf_path} --- {e}")
+        return None
+
+    if not pages:
+        return None
+
+    for text in pages:
+        chars = "".join(text.split())
+        if len(chars) < min_chars_per_page:
+            return None
+        if sum(c.isalnum() for c in chars) / len(chars) < 0.6:
+            return None
+
+    return "\n\n".join(
+        f"--- Page {i} ---\n{text.strip()}" for i, text in enumerate(pages, start=1)
+    )
+
+
+def pdf_to_message_parts(
+    pdf_path: str,
+    label: str,
+    mode: str = "images",
+    cache: RenderCache | None = None,
+    profile: RenderProfile = PROFILES["standard"],
+    thread_count: int = 1,
+    pool=None,
+) -> list:
+    """
+    Converts a pdf into message parts for an LLM.
+
+    Args:
+        pdf_path: Path to the pdf file.
+        label: What the document is (e.g. "Position Description"), used to
+            introduce extracted text.
+        mode: `images` always sends page images. `auto` sends the text layer
+            when the pdf has a usable one and falls back to page images for
+            scanned documents. Text costs far fewer tokens than images.
+        cache: Optional cache of previously rendered pages.
+        profile: Settings to render with.
+        thread_count: Number of poppler processes to render pages with.
+        pool: Optional `RenderPool` to render and extract text on instead of
+            the calling thread (`thread_count` is then ignored).
+
+    Returns:
+        A list of content parts, either a single `text` part or one `image_url`
+        part per page.
+    """
+    if mode not in ("images", "auto"):
+        raise ValueError(f"Unknown document mode: {mode}. Use one of images, auto")
+
+    if mode == "auto":
+        if pool is not None:
+            text = pool.extract_text(pdf_path)
+        else:
+            text = extract_text_layer(pdf_path)
+        if text is not None:
+            return [text_part(label, text)]
+        log.info(f"No usable text layer in {pdf_path}, sending page images")
+
+    return pdf_to_image_parts(
+        pdf_path, cache=cache, profile=profile, thread_count=thread_count, pool=pool
+    )
+
@@ -0,0 +1,176 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable
+from sqlalchemy import delete, or_, select
+from sqlalchemy.dialects.postgresql import array, insert
+
+log = logging.getLogger(__name__)
+
+FIELDS = [
+    "position_description",
+    "similar_position_numbers",
+    "suitability_comments_positive",
+    "suitability_comments_negative",
+]
+
+
+class RetrievalCache:
+    """
+    Cache of the related applications retrieved for a position.
+
+    The vector search and reviewer comment queries in
+    `retrieve_related_applications` depend only on the position, its level and
+    the embeddings collection, so their results are shared by every applicant to
+    the position. Results are held in an in-process LRU and, optionally, in the
+    `position_retrieval_cache` table so they survive between runs and are shared
+    between workers.
+
+    The persisted entries are invalidated by pre-processing when new manual
+    reviews or position descriptions are ingested (see `invalidate`). The
+    in-process entries live for as long as the process, i.e. one cv_process run.
+
+    Args
+    ----
+
+    table :
+        The `position_retrieval_cache` data model.
+
+    get_session :
+        Context manager providing a database session.
+
+    collection_name : str
+        Embeddings collection the similar positions are searched in.
+
+    max_entries : int
+        Number of positions held in memory.
+
+    persist : bool
+        Whether to also read and write the database table.
+    """
+
+    def __init__(
+        self,
+        table,
+        get_session,
+        collection_name: str,
+        max_entries: int = 512,
+        persist: bool = False,
+    ):
+        self.table = table
+        self.get_session = get_session
+        self.collection_name = collection_name
+        self.max_entries = max_entries
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, position_number: str, level: str) -> dict | None:
+        key = (position_number, level)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(self._entries[key])
+
+        if self.persist:
+            stmt = select(self.table).where(
+                self.table.position_number == position_number,
+                self.table.level == level,
+                self.table.collection_name == self.collection_name,
+            )
+            with self.get_session() as session:
+                row = session.scalars(stmt).first()
+                related = (
+                    {field: getattr(row, field) for field in FIELDS} if row else None
+                )
+            if related is not None:
+                self._remember(key, related)
+                with self._lock:
+                    self.hits += 1
+                return dict(related)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, position_number: str, level: str, related: dict) -> None:
+        related = {field: related[field] for field in FIELDS}
+        self._remember((position_number, level), related)
+
+        if self.persist:
+            stmt = insert(self.table).values(
+                position_number=position_number,
+                level=level,
+                collection_name=self.collection_name,
+                **related,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["position_number", "level", "collection_name"],
+                set_=related,
+            )
+            with self.get_session() as session:
+                session.execute(stmt)
+
+    def _remember(self, key, related):
+        with self._lock:
+            self._entries[key] = related
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(
+        self,
+        position_numbers: Iterable[str] = (),
+        levels: Iterable[str] = (),
+    ) -> None:
+        """
+        Drops entries that may be out of date after ingestion.
+
+        Args:
+            position_numbers: Positions with new manual reviews. Entries for these
+                positions, or that use them as a similar position, are dropped.
+            levels: Levels with new position descriptions. A new position can be
+                more similar than the existing ones, so all entries at these
+                levels are dropped.
+        """
+        position_numbers = set(position_numbers)
+        levels = set(levels)
+        if not position_numbers and not levels:
+            return
+
+        with self._lock:
+            for key in list(self._entries):
+                position_number, level = key
+                if (
+                    position_number in position_numbers
+                    or level in levels
+                    or position_numbers.intersection(
+                        self._entries[key]["similar_position_numbers"]
+                    )
+                ):
+                    del self._entries[key]
+
+        if self.persist:
+            conditions = []
+            if position_numbers:
+                conditions.append(self.table.position_number.in_(position_numbers))
+                conditions.append(
+                    self.table.similar_position_numbers.has_any(
+                        array(sorted(position_numbers))
+                    )
+                )
+            if levels:
+                conditions.append(self.table.level.in_(levels))
+            with self.get_session() as session:
+                result = session.execute(delete(self.table).where(or_(*conditions)))
+            log.info(f"Invalidated {result.rowcount} retrieval cache entries")
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        log.info(
+            f"Retrieval cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+        )
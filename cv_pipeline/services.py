@@ -1,15 +1,27 @@
 # services.py
 import os
 import logging
+import threading
 from functools import cached_property
+from pydantic import BaseModel
+from langchain_core.runnables import Runnable
 from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
 from sqlalchemy.orm import declarative_base, DeclarativeBase, sessionmaker
 from langchain_postgres.vectorstores import PGVector
+from langchain.embeddings import CacheBackedEmbeddings
 from contextlib import contextmanager
+from pathlib import Path
 
 # Import custom utility functions
 from cv_pipeline.pipelines import get_data_models
+from cv_pipeline.rendering import RenderCache, RenderProfile, get_profile
+from cv_pipeline.artifacts import CVArtifactStore
+from cv_pipeline.render_pool import RenderPool
+from cv_pipeline.blob_store import BlobStore
+from cv_pipeline.retrieval_cache import RetrievalCache
+from cv_pipeline.llm_cache import LLMResponseCache
+from cv_pipeline.embedding_cache import PostgresByteStore
 import cv_pipeline.utils as ut
 
 # --- 1. Setup Logger ---
@@ -29,6 +41,35 @@ EMBEDDINGS_MODEL = os.environ["EMBEDDINGS_MODEL"]
 LLM_PROVIDER = os.environ["LLM_PROVIDER"]
 LLM_MODEL = os.environ["LLM_MODEL"]
 
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", "data/cache/render")
+RENDER_CACHE_MAX_MB = int(os.environ.get("RENDER_CACHE_MAX_MB", 1024))
+RENDER_PROFILE = os.environ.get("RENDER_PROFILE", "standard")
+RENDER_THREADS = int(os.environ.get("RENDER_THREADS", 2))
+RENDER_POOL_WORKERS = int(os.environ.get("RENDER_POOL_WORKERS", os.cpu_count()))
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "data/cache/blobs")
+BLOB_STORE_MAX_MB = int(os.environ.get("BLOB_STORE_MAX_MB", 2048))
+DOCUMENT_MODE = os.environ.get("DOCUMENT_MODE", "images")
+
+CV_ARTIFACTS = os.environ.get("CV_ARTIFACTS", "true").lower() in ("1", "true")
+CV_ARTIFACTS_DIR = os.environ.get("CV_ARTIFACTS_DIR", "data/artifacts/cvs")
+
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 512))
+RETRIEVAL_CACHE_PERSIST = os.environ.get("RETRIEVAL_CACHE_PERSIST", "").lower() in (
+    "1",
+    "true",
+)
+
+EMBEDDINGS_CACHE = os.environ.get("EMBEDDINGS_CACHE", "true").lower() in ("1", "true")
+
+LLM_CACHE = os.environ.get("LLM_CACHE", "off")
+LLM_CACHE_SQLITE_PATH = os.environ.get(
+    "LLM_CACHE_SQLITE_PATH", "data/cache/llm_cache.sqlite"
+)
+LLM_CACHE_TTL_HOURS = float(os.environ.get("LLM_CACHE_TTL_HOURS", 0))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100_000))
+LLM_CACHE_BYPASS = os.environ.get("LLM_CACHE_BYPASS", "").lower() in ("1", "true")
+LLM_PROMPT_VERSION = os.environ.get("LLM_PROMPT_VERSION", "1")
+
 
 Base: DeclarativeBase = declarative_base()
 
@@ -56,6 +97,8 @@ class ServiceProvider:
         self.vectorstore_schema = (
             "vectorstore"  # This is determined by langgraph and can't be changed atm
         )
+        self._structured_llms = {}
+        self._structured_llms_lock = threading.Lock()
 
     # --- Database Services ---
     @cached_property
@@ -101,42 +144,196 @@ class ServiceProvider:
             },
         )
 
+    # --- File Services ---
+    @cached_property
+    def render_cache(self) -> RenderCache:
+        """On-disk cache of pdf pages rendered for LLM messages."""
+        log.info(f"Initializing render cache in {RENDER_CACHE_DIR}...")
+        return RenderCache(RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_MB * 1024 * 1024)
+
+    @cached_property
+    def blob_store(self) -> BlobStore:
+        """On-disk store of the page images and text referred to by the agent state."""
+        log.info(f"Initializing blob store in {BLOB_STORE_DIR}...")
+        return BlobStore(BLOB_STORE_DIR, max_bytes=BLOB_STORE_MAX_MB * 1024 * 1024)
+
+    @cached_property
+    def render_profile(self) -> RenderProfile:
+        """Settings used to turn pdf pages into images for the LLM."""
+        log.info(f"Using render profile {RENDER_PROFILE}...")
+        return get_profile(RENDER_PROFILE)
+
+    @cached_property
+    def render_pool(self) -> RenderPool | None:
+        """
+        Worker processes that pdfs are rendered on. None when
+        `RENDER_POOL_WORKERS=0`, pdfs are then rendered in the calling thread.
+        """
+        if RENDER_POOL_WORKERS <= 0:
+            return None
+        return RenderPool(RENDER_POOL_WORKERS)
+
+    @property
+    def render_threads(self) -> int:
+        """Number of poppler processes used to render each pdf outside the render pool."""
+        return RENDER_THREADS
+
+    @property
+    def document_mode(self) -> str:
+        """Whether pdfs are sent as page images (`images`) or as text when possible (`auto`)."""
+        return DOCUMENT_MODE
+
+    @cached_property
+    def cv_artifacts(self) -> CVArtifactStore | None:
+        """
+        CVs rendered and extracted at ingestion, per application. None when
+        `CV_ARTIFACTS` is off.
+        """
+        if not CV_ARTIFACTS:
+            return None
+        log.info(f"Using CV artifacts in {CV_ARTIFACTS_DIR}...")
+        return CVArtifactStore(CV_ARTIFACTS_DIR)
+
+    @cached_property
+    def retrieval_cache(self) -> RetrievalCache:
+        """Cache of the related applications retrieved for each position."""
+        log.info("Initializing retrieval cache...")
+        return RetrievalCache(
+            tables["position_retrieval_cache"],
+            self.get_session,
+            collection_name=self.collection_name,
+            max_entries=RETRIEVAL_CACHE_SIZE,
+            persist=RETRIEVAL_CACHE_PERSIST,
+        )
+
+    @cached_property
+    def llm_cache(self) -> LLMResponseCache | None:
+        """
+        Cache of responses from the deterministic (temperature 0) LLMs, stored in
+        Postgres (`LLM_CACHE=postgres`) or a SQLite file (`LLM_CACHE=sqlite`).
+        None when `LLM_CACHE=off`.
+        """
+        if LLM_CACHE == "off":
+            return None
+        if LLM_CACHE == "postgres":
+            engine = self.engine
+        elif LLM_CACHE == "sqlite":
+            Path(LLM_CACHE_SQLITE_PATH).parent.mkdir(parents=True, exist_ok=True)
+            # SQLite has no schemas, so the cv schema of the table is dropped
+            engine = create_engine(
+                f"sqlite:///{LLM_CACHE_SQLITE_PATH}",
+                execution_options={"schema_translate_map": {self.cv_schema: None}},
+            )
+            tables["llm_cache"].__table__.create(engine, checkfirst=True)
+        else:
+            raise ValueError(
+                f"Unknown LLM_CACHE: {LLM_CACHE}. Use one of off, postgres, sqlite"
+            )
+        log.info(f"Initializing LLM cache ({LLM_CACHE})...")
+        return LLMResponseCache(
+            engine,
+            tables["llm_cache"],
+            model=f"{LLM_PROVIDER}/{LLM_MODEL}",
+            temperature=0,
+            prompt_version=LLM_PROMPT_VERSION,
+            ttl_seconds=int(LLM_CACHE_TTL_HOURS * 3600) or None,
+            max_entries=LLM_CACHE_MAX_ENTRIES,
+            bypass=LLM_CACHE_BYPASS,
+        )
+
     # --- AI & Vector Store Services ---
     @cached_property
     def embeddings(self):
         """Embeddings model client provider"""
         log.info("Initializing embeddings model...")
-        return ut.EmbeddingsFactory.create(EMBEDDINGS_PROVIDER, EMBEDDINGS_MODEL)
+        embeddings = ut.EmbeddingsFactory.create(EMBEDDINGS_PROVIDER, EMBEDDINGS_MODEL)
+        if not EMBEDDINGS_CACHE:
+            return embeddings
+
+        # Embeddings are looked up in the embedding_cache table by model and text
+        # hash before calling the provider. Queries are cached separately because
+        # some providers embed queries and documents differently.
+        log.info("Initializing embeddings cache...")
+        return CacheBackedEmbeddings.from_bytes_store(
+            embeddings,
+            PostgresByteStore(self.engine, tables["embedding_cache"]),
+            namespace=f"{EMBEDDINGS_PROVIDER}/{EMBEDDINGS_MODEL}:",
+            query_embedding_cache=PostgresByteStore(
+                self.engine, tables["embedding_cache"], prefix="query:"
+            ),
+            key_encoder="sha256",
+        )
+
+    @property
+    def collection_name(self) -> str:
+        """Name of the vector store collection for the configured embeddings model."""
+        return f"cv_{EMBEDDINGS_PROVIDER}_{EMBEDDINGS_MODEL}"
 
     @cached_property
     def vector_store_cv(self) -> PGVector:
         """Vector store for CV data."""
         log.info("Initializing CV vector store...")
-        collection_name = f"cv_{EMBEDDINGS_PROVIDER}_{EMBEDDINGS_MODEL}"
         return PGVector(
             embeddings=self.embeddings,
-            collection_name=collection_name,
+            collection_name=self.collection_name,
             connection=self.engine_vectorstore,
             use_jsonb=True,
             create_extension=False,
         )
 
+    @property
+    def llm_rate_limiter(self) -> ut.RateLimitController:
+        """Rate limiter shared by all calls to the LLM provider."""
+        return ut.get_rate_limiter(LLM_PROVIDER)
+
+    @property
+    def embeddings_rate_limiter(self) -> ut.RateLimitController:
+        """Rate limiter shared by all calls to the embeddings provider."""
+        return ut.get_rate_limiter(f"{EMBEDDINGS_PROVIDER}_embeddings")
+
     @cached_property
     def base_llm(self):
         """Base LLM to invoke. Only use when can't put retry logic first."""
         log.info(f"Initializing LLM provider {LLM_PROVIDER} model {LLM_MODEL} ...")
         return ut.ChatFactory.create(
-            LLM_PROVIDER, LLM_MODEL, temperature=0, retry=False
+            LLM_PROVIDER,
+            LLM_MODEL,
+            temperature=0,
+            retry=False,
+            cache=self.llm_cache,
+            rate_limiter=self.llm_rate_limiter,
         )
 
+    def structured_llm(self, schema: type[BaseModel]) -> Runnable:
+        """
+        Base LLM with structured output for `schema` and retry logic applied to
+        the *structured* LLM, so it handles retries AND structured output.
+        Rate limits are handled by the shared LLM rate limiter, other errors by
+        the jittered retry. Built once per schema rather than on every call.
+        """
+        with self._structured_llms_lock:
+            if schema not in self._structured_llms:
+                log.info(f"Building structured output LLM for {schema.__name__}...")
+                self._structured_llms[schema] = ut.rate_limited(
+                    self.base_llm.with_structured_output(schema),
+                    self.llm_rate_limiter,
+                    attempts=5,
+                )
+            return self._structured_llms[schema]
+
     @cached_property
     def llm(self):
         """Main LLM to invoke (has retry logic for Google and OpenAI)."""
         log.info(f"Initializing LLM provider {LLM_PROVIDER} model {LLM_MODEL} ...")
-        return ut.ChatFactory.create(
-            LLM_PROVIDER,
-            LLM_MODEL,
-            temperature=0,
+        return ut.rate_limited(
+            ut.ChatFactory.create(
+                LLM_PROVIDER,
+                LLM_MODEL,
+                temperature=0,
+                cache=self.llm_cache,
+                rate_limiter=self.llm_rate_limiter,
+            ),
+            self.llm_rate_limiter,
         )
 
     @cached_property
@@ -146,10 +343,14 @@ class ServiceProvider:
         log.info(
             f"Initializing LLM provider {LLM_PROVIDER} model {LLM_MODEL} with temp {temp}..."
         )
-        return ut.ChatFactory.create(
-            LLM_PROVIDER,
-            LLM_MODEL,
-            temperature=temp,
+        return ut.rate_limited(
+            ut.ChatFactory.create(
+                LLM_PROVIDER,
+                LLM_MODEL,
+                temperature=temp,
+                rate_limiter=self.llm_rate_limiter,
+            ),
+            self.llm_rate_limiter,
         )
 
 
@@ -1,17 +1,28 @@
 from langchain_core import language_models
+from langchain_core.caches import BaseCache
 from langchain_ollama import ChatOllama, OllamaEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from google.api_core.exceptions import ResourceExhausted
 from langchain_openai import OpenAI, OpenAIEmbeddings
 from openai import RateLimitError
+from langchain_core.rate_limiters import BaseRateLimiter
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 from tenacity import (
     retry,
-    wait_exponential,
+    retry_if_exception,
     stop_after_attempt,
+    wait_exponential_jitter,
 )
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import asyncio
+import contextvars
 import logging
 import csv
-from typing import List, Any
+import random
+import threading
+import time
+from typing import Callable, Iterator, List, Any
 import subprocess
 import os
 import shutil
@@ -20,9 +31,8 @@ log = logging.getLogger(__name__)
 
 
 def log_retry_attempt(retry_state):
-    print(f"{retry_state=}")
     log_message = f"""
-    Retrying upload set {retry_state.args[0] + 1} in {retry_state.next_action.sleep}s
+    Retrying {retry_state.fn.__name__} in {retry_state.next_action.sleep}s
     """
     if retry_state.outcome:
         error = retry_state.outcome.exception()
@@ -32,19 +42,394 @@ def log_retry_attempt(retry_state):
     log.info(log_message)
 
 
-@retry(
-    wait=wait_exponential(multiplier=1, min=60, max=180),
-    stop=stop_after_attempt(5),
-    reraise=True,
-    before_sleep=log_retry_attempt,
+# Rough token cost of an image part, used to budget tokens per minute before the
+# provider reports actual usage
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether `error` is a provider telling us to slow down (HTTP 429)."""
+    if isinstance(error, (ResourceExhausted, RateLimitError)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    return status == 429 or getattr(error, "code", None) == 429
+
+
+def retry_after_seconds(error: BaseException) -> float | None:
+    """
+    How long the provider asked us to wait, from the Retry-After headers of
+    HTTP errors or the RetryInfo details of Google API errors.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                # HTTP date form
+                retry_at = parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        pass
+
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            try:
+                return float(str(detail["retryDelay"]).rstrip("s"))
+            except ValueError:
+                pass
+    return None
+
+
+def estimate_tokens(value) -> int:
+    """
+    Rough token count of an LLM input or a list of documents: about four
+    characters per token for text plus a fixed cost per image.
+    """
+    if isinstance(value, str):
+        return len(value) // 4 + 1
+    if isinstance(value, dict):
+        if value.get("type") == "image_url":
+            return IMAGE_TOKEN_ESTIMATE
+        return estimate_tokens(value.get("text", ""))
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(v) for v in value)
+    if hasattr(value, "page_content"):
+        return estimate_tokens(value.page_content)
+    if hasattr(value, "content"):
+        return estimate_tokens(value.content)
+    return 1
+
+
+class TokenBucket:
+    """
+    Budget of `per_minute` units that refills continuously.
+
+    `reserve` takes the units straight away, letting the balance go negative,
+    and returns how long the caller has to wait for the balance to cover them.
+    Concurrent callers then queue up in order without holding a lock while
+    they wait.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        # A single call bigger than the whole budget can only wait for a full bucket
+        self.available -= min(amount, self.capacity)
+        return max(0.0, -self.available / self.rate)
+
+
+class RateLimitController:
+    """
+    Shared rate limiting for calls to one provider.
+
+    Calls go through `call` (or `acall` from async code), which
+
+    - waits for the requests per minute and tokens per minute budgets, so
+      bursts are spread out instead of being rejected,
+    - limits the number of calls in flight, adapting the limit with AIMD: it
+      grows by one for every `limit` successful calls and halves on a 429,
+    - retries rate limited calls after the provider's Retry-After (or a short
+      jittered backoff if there is none), pausing all callers meanwhile.
+
+    That keeps throughput close to the provider quota without a 429 stalling a
+    whole run. Other errors are raised straight away for the caller's own
+    retry logic.
+
+    With `deferred=True` the slot is only taken once a chat model created with
+    `ChatFactory.create(..., rate_limiter=controller)` is about to call the
+    provider, which LangChain does after looking the request up in the model's
+    cache. Cached responses then don't use up the budget.
+
+    Args
+    ----
+
+    name : str
+        Used in logs.
+
+    rpm : float (optional)
+        Requests per minute budget. None for no budget.
+
+    tpm : float (optional)
+        Tokens per minute budget. None for no budget.
+
+    max_concurrency : int
+        Upper limit on calls in flight. The adaptive limit starts here.
+
+    min_concurrency : int
+        Lower limit on calls in flight.
+
+    max_retries : int
+        Number of times a rate limited call is retried before the error is raised.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm: float | None = None,
+        tpm: float | None = None,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        max_retries: int = 8,
+    ):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def _try_acquire(self, tokens: int) -> float | None:
+        """Takes a slot and budget. Returns how long to wait, None if no slot."""
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+            wait = self._paused_until - time.monotonic()
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens))
+            return max(0.0, wait)
+
+    def _release(self, error: BaseException | None) -> float | None:
+        """Frees the slot and adapts the limit. Returns the backoff after a 429."""
+        with self._condition:
+            self.in_flight -= 1
+            self.calls += 1
+            backoff = None
+            if error is None:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif is_rate_limit_error(error):
+                self.rate_limited += 1
+                now = time.monotonic()
+                backoff = retry_after_seconds(error)
+                if backoff is None:
+                    backoff = random.uniform(1, 4)
+                # Calls that were in flight together all fail, only back off once
+                if now >= self._paused_until:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    log.warning(
+                        f"Rate limited by {self.name}, pausing {backoff:.1f}s and "
+                        f"lowering concurrency to {int(self.limit)}"
+                    )
+                self._paused_until = max(self._paused_until, now + backoff)
+            self._condition.notify_all()
+            return backoff
+
+    def _acquire(self, tokens: int):
+        with self._condition:
+            while (wait := self._try_acquire(tokens)) is None:
+                self._condition.wait()
+        if wait:
+            time.sleep(wait)
+
+    async def _aacquire(self, tokens: int):
+        # Polls rather than blocking the event loop on the condition
+        while (wait := self._try_acquire(tokens)) is None:
+            await asyncio.sleep(0.05)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def call(
+        self, fn: Callable, *args, tokens: int = 1, deferred: bool = False, **kwargs
+    ):
+        """Calls `fn(*args, **kwargs)` within the budget, retrying on 429s."""
+        for attempt in range(self.max_retries + 1):
+            slot = _Slot(self, tokens)
+            if not deferred:
+                self._acquire(tokens)
+                slot.taken = True
+            context_token = _pending_slot.set(slot)
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                # Always give the slot back, also on cancellation
+                backoff = self._release(e) if slot.taken else None
+                if backoff is None or attempt == self.max_retries:
+                    raise
+                continue
+            finally:
+                _pending_slot.reset(context_token)
+            if slot.taken:
+                self._release(None)
+            return result
+
+    async def acall(
+        self, fn: Callable, *args, tokens: int = 1, deferred: bool = False, **kwargs
+    ):
+        """Async version of `call` for coroutine functions."""
+        for attempt in range(self.max_retries + 1):
+            slot = _Slot(self, tokens)
+            if not deferred:
+                await self._aacquire(tokens)
+                slot.taken = True
+            context_token = _pending_slot.set(slot)
+            try:
+                result = await fn(*args, **kwargs)
+            except BaseException as e:
+                # Always give the slot back, also on cancellation
+                backoff = self._release(e) if slot.taken else None
+                if backoff is None or attempt == self.max_retries:
+                    raise
+                continue
+            finally:
+                _pending_slot.reset(context_token)
+            if slot.taken:
+                self._release(None)
+            return result
+
+    def log_stats(self):
+        log.info(
+            f"Rate limiter {self.name}: {self.calls} calls, {self.rate_limited} rate "
+            f"limited, concurrency limit {int(self.limit)}/{self.max_concurrency}"
+        )
+
+
+class _Slot:
+    """Slot of a call to a `RateLimitController`, taken up front or when deferred."""
+
+    def __init__(self, controller: RateLimitController, tokens: int):
+        self.controller = controller
+        self.tokens = tokens
+        self.taken = False
+
+
+# Slot of the controller call in progress. Holds a mutable object so the slot
+# taken in a copied context (e.g. a LangChain child run) is seen by the caller.
+_pending_slot: contextvars.ContextVar[_Slot | None] = contextvars.ContextVar(
+    "pending_rate_limit_slot", default=None
 )
-def upload_chunk_set(set_index, doc_objects, vector_store, collection_name):
-    """Uploads a set of document chunks to the vector store with retry."""
-    vector_store.add_documents(
-        doc_objects,
-        ids=[f'{o.metadata["id"]}_{collection_name}' for o in doc_objects],
+
+
+class ProviderRateLimiter(BaseRateLimiter):
+    """
+    Takes the deferred slot of a `RateLimitController` call when a chat model
+    calls the provider. Pass as the `rate_limiter` of a chat model.
+
+    Calls to the model that aren't made through `controller` (e.g. with
+    `rate_limited`) aren't limited.
+    """
+
+    def __init__(self, controller: RateLimitController):
+        self.controller = controller
+
+    def _pending(self) -> _Slot | None:
+        slot = _pending_slot.get()
+        if slot is None or slot.controller is not self.controller or slot.taken:
+            return None
+        return slot
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if slot := self._pending():
+            self.controller._acquire(slot.tokens)
+            slot.taken = True
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        if slot := self._pending():
+            await self.controller._aacquire(slot.tokens)
+            slot.taken = True
+        return True
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str) -> RateLimitController:
+    """
+    Process wide rate limit controller for `name` (e.g. a provider), so all
+    callers share the same budget.
+
+    Configured with the `RATE_LIMIT_<NAME>_RPM`, `RATE_LIMIT_<NAME>_TPM` and
+    `RATE_LIMIT_<NAME>_CONCURRENCY` environment variables (e.g.
+    `RATE_LIMIT_GOOGLE_RPM`). Budgets are off unless set.
+    """
+    with _rate_limiters_lock:
+        if name not in _rate_limiters:
+            prefix = f"RATE_LIMIT_{name.upper()}_"
+            rpm = os.environ.get(f"{prefix}RPM")
+            tpm = os.environ.get(f"{prefix}TPM")
+            _rate_limiters[name] = RateLimitController(
+                name,
+                rpm=float(rpm) if rpm else None,
+                tpm=float(tpm) if tpm else None,
+                max_concurrency=int(os.environ.get(f"{prefix}CONCURRENCY", 16)),
+            )
+        return _rate_limiters[name]
+
+
+def rate_limited(
+    runnable: Runnable, controller: RateLimitController, attempts: int = 1
+) -> Runnable:
+    """
+    Wraps a runnable (e.g. an LLM) so every call goes through `controller`.
+
+    The runnable's chat model has to be created with
+    `ChatFactory.create(..., rate_limiter=controller)`, which takes the slot
+    only when the provider is called, so responses from the model's cache
+    don't use up the budget.
+
+    Rate limits are retried by `controller`. Other errors (e.g. a response that
+    doesn't fit the structured output) are retried up to `attempts` times in
+    all, with jittered exponential backoff.
+    """
+    retrying = retry(
+        wait=wait_exponential_jitter(),
+        stop=stop_after_attempt(attempts),
+        # Rate limits were already retried by the controller
+        retry=retry_if_exception(lambda e: not is_rate_limit_error(e)),
+        reraise=True,
+        before_sleep=log_retry_attempt,
     )
 
+    @retrying
+    def invoke(input, config: RunnableConfig):
+        return controller.call(
+            runnable.invoke,
+            input,
+            config,
+            tokens=estimate_tokens(input),
+            deferred=True,
+        )
+
+    @retrying
+    async def ainvoke(input, config: RunnableConfig):
+        return await controller.acall(
+            runnable.ainvoke,
+            input,
+            config,
+            tokens=estimate_tokens(input),
+            deferred=True,
+        )
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"rate_limited_{controller.name}")
+
 
 class ChatFactory:
     """
@@ -66,6 +451,15 @@ class ChatFactory:
         Controls the randomness of the output. A value of 0 makes the output
         nearly deterministic, maximizing reproducibility.
 
+    cache : BaseCache (optional)
+        Response cache the model looks requests up in before calling the
+        provider, e.g. `cv_pipeline.llm_cache.LLMResponseCache`.
+
+    rate_limiter : RateLimitController (optional)
+        Controller whose slot is taken when the provider is called, i.e. after a
+        cache miss. Call the model through `rate_limited` with the same
+        controller.
+
 
     SETUP
     -----
@@ -100,8 +494,18 @@ class ChatFactory:
 
     @staticmethod
     def create(
-        provider: str, model_name: str, temperature: float = 0, retry=False, **params
+        provider: str,
+        model_name: str,
+        temperature: float = 0,
+        retry=False,
+        cache: BaseCache | None = None,
+        rate_limiter: RateLimitController | None = None,
+        **params,
     ) -> language_models.BaseChatModel:
+        if cache is not None:
+            params["cache"] = cache
+        if rate_limiter is not None:
+            params["rate_limiter"] = ProviderRateLimiter(rate_limiter)
         common_retry_config = {
             "stop_after_attempt": 5,
             "wait_exponential_jitter": True,
@@ -222,6 +626,17 @@ def read_from_csv(file_path: str) -> list[dict[str, Any]]:
         return []
 
 
+def iter_csv(file_path: str) -> Iterator[dict[str, str]]:
+    """
+    Reads a CSV file row by row as dictionaries, with column headers as keys.
+
+    Unlike `read_from_csv` the file is never held in memory as a whole, which
+    suits large files that are only passed over once.
+    """
+    with open(file_path, mode="r", newline="", encoding="utf-8") as csv_file:
+        yield from csv.DictReader(csv_file)
+
+
 def graph_drawer(compiled, experiment_id):
     mermaid_data = compiled.get_graph().draw_mermaid()
 
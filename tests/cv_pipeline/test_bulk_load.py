@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import select
+
+from cv_pipeline.pipelines.bulk_load import copy_csv
+from cv_pipeline.services import services, tables
+
+Applicants = tables["applicants"]
+Positions = tables["positions"]
+
+
+def write_csv(path, text: str) -> str:
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def table_rows(Model, *columns) -> list[tuple]:
+    with services.get_session() as session:
+        return [tuple(row) for row in session.execute(select(*columns).order_by(Model.id))]
+
+
+def test_last_row_wins_for_a_repeated_key(database, tmp_path) -> None:
+    csv_file_name = write_csv(
+        tmp_path / "pds.csv",
+        "position_number,job_title,level\nP1,Analyst,4\nP2,Engineer,5\nP1,Senior Analyst,5\n",
+    )
+
+    assert copy_csv(csv_file_name, Positions, "position_number") == 3
+    assert table_rows(Positions, Positions.position_number, Positions.job_title) == [
+        ("P1", "Senior Analyst"),
+        ("P2", "Engineer"),
+    ]
+
+
+def test_loading_the_same_file_again_changes_nothing(database, tmp_path) -> None:
+    csv_file_name = write_csv(
+        tmp_path / "cvs.csv",
+        "position_number,application_id,age_range\nP1,A1,25-34\nP1,A2,35-44\nP2,A3,45-54\n",
+    )
+    columns = [Applicants.id, Applicants.application_id, Applicants.age_range]
+
+    copy_csv(csv_file_name, Applicants, "application_id")
+    loaded = table_rows(Applicants, *columns)
+    copy_csv(csv_file_name, Applicants, "application_id")
+    assert table_rows(Applicants, *columns) == loaded
+    assert [row[1:] for row in loaded] == [("A1", "25-34"), ("A2", "35-44"), ("A3", "45-54")]
+
+
+def test_reload_updates_changed_rows(database, tmp_path) -> None:
+    copy_csv(
+        write_csv(tmp_path / "v1.csv", "position_number,level\nP1,4\nP2,5\n"),
+        Positions,
+        "position_number",
+    )
+    copy_csv(
+        write_csv(tmp_path / "v2.csv", "position_number,level\nP2,6\nP3,3\n"),
+        Positions,
+        "position_number",
+    )
+    assert table_rows(Positions, Positions.position_number, Positions.level) == [
+        ("P1", "4"),
+        ("P2", "6"),
+        ("P3", "3"),
+    ]
+
+
+def test_header_must_match_the_table(database, tmp_path) -> None:
+    csv_file_name = write_csv(tmp_path / "pds.csv", "position_number,salary\nP1,100\n")
+    with pytest.raises(ValueError, match="salary"):
+        copy_csv(csv_file_name, Positions, "position_number")
@@ -0,0 +1,27 @@
+import pytest
+
+from cv_pipeline.pipelines.compare_assessments import cohens_kappa
+
+
+def test_cohens_kappa_perfect_agreement() -> None:
+    assert cohens_kappa(tp=5, fp=0, fn=0, tn=5) == 1.0
+
+
+def test_cohens_kappa_known_value() -> None:
+    # Observed agreement 0.8, agreement expected by chance 0.5
+    assert cohens_kappa(tp=4, fp=1, fn=1, tn=4) == pytest.approx(0.6)
+
+
+def test_cohens_kappa_chance_agreement() -> None:
+    assert cohens_kappa(tp=1, fp=1, fn=1, tn=1) == 0.0
+
+
+def test_cohens_kappa_worse_than_chance() -> None:
+    assert cohens_kappa(tp=0, fp=5, fn=5, tn=0) == -1.0
+
+
+def test_cohens_kappa_undefined() -> None:
+    # Nothing to compare
+    assert cohens_kappa(tp=0, fp=0, fn=0, tn=0) is None
+    # Both always say Y, so agreement is certain by chance
+    assert cohens_kappa(tp=10, fp=0, fn=0, tn=0) is None
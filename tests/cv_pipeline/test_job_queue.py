@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import String, column, select, values
+
+from cv_pipeline.pipelines.job_queue import JobQueue
+from cv_pipeline.services import services, tables
+
+ProcessingJobs = tables["processing_jobs"]
+
+
+@pytest.fixture
+def jobs(database):
+    return ProcessingJobs
+
+
+def work_list(*application_ids: str):
+    """Stands in for the work list query of cv_process."""
+    rows = values(
+        column("application_id", String),
+        column("position_number", String),
+        column("level", String),
+        name="work_list",
+    ).data([(application_id, "P1", "5") for application_id in application_ids])
+    return select(rows.c.application_id, rows.c.position_number, rows.c.level)
+
+
+def job_statuses() -> dict[str, str]:
+    with services.get_session() as session:
+        return dict(
+            session.execute(select(ProcessingJobs.application_id, ProcessingJobs.status)).all()
+        )
+
+
+def claimed_ids(queue: JobQueue, batch_size: int = 10) -> list[str]:
+    return [item["application_id"] for item in queue.claim(batch_size)]
+
+
+def test_claim_hands_each_job_to_one_worker(jobs) -> None:
+    first, second = JobQueue(jobs), JobQueue(jobs)
+    first.enqueue(work_list("A1", "A2", "A3"))
+
+    assert claimed_ids(first, 2) == ["A1", "A2"]
+    assert claimed_ids(second) == ["A3"]
+    assert claimed_ids(second) == []
+
+
+def test_done_job_is_queued_again_after_its_result_is_deleted(jobs) -> None:
+    queue = JobQueue(jobs)
+    queue.enqueue(work_list("A1", "A2"))
+    assert claimed_ids(queue) == ["A1", "A2"]
+    with services.get_session() as session:
+        assert queue.complete(session, ["A1", "A2"]) == {"A1", "A2"}
+
+    # The results of A1 were deleted, so the work list selects it again
+    queue.enqueue(work_list("A1"))
+    assert job_statuses() == {"A1": "pending", "A2": "done"}
+    assert claimed_ids(queue) == ["A1"]
+
+
+def test_abandoned_job_fails_after_max_attempts(jobs) -> None:
+    # Leases run out as soon as they are taken
+    workers = [JobQueue(jobs, lease_seconds=0, max_attempts=2) for _ in range(3)]
+    workers[0].enqueue(work_list("A1"))
+
+    assert claimed_ids(workers[0]) == ["A1"]
+    assert claimed_ids(workers[1]) == ["A1"]
+    # Both claims died with their worker
+    assert claimed_ids(workers[2]) == []
+    assert job_statuses() == {"A1": "failed"}
+
+
+def test_worker_cannot_complete_a_job_taken_over(jobs) -> None:
+    slow = JobQueue(jobs, lease_seconds=0)
+    other = JobQueue(jobs)
+    slow.enqueue(work_list("A1", "A2"))
+    assert claimed_ids(slow) == ["A1", "A2"]
+
+    # The leases of the slow worker ran out and another worker took over
+    assert claimed_ids(other, 1) == ["A1"]
+    with services.get_session() as session:
+        assert slow.complete(session, ["A1", "A2"]) == {"A2"}
+    with services.get_session() as session:
+        assert other.complete(session, ["A1"]) == {"A1"}
+    assert job_statuses() == {"A1": "done", "A2": "done"}
+
+
+def test_fail_retries_until_max_attempts(jobs) -> None:
+    queue = JobQueue(jobs, max_attempts=2)
+    queue.enqueue(work_list("A1"))
+
+    assert claimed_ids(queue) == ["A1"]
+    queue.fail("A1", "model timed out")
+    assert job_statuses() == {"A1": "pending"}
+
+    assert claimed_ids(queue) == ["A1"]
+    queue.fail("A1", "model timed out again")
+    assert job_statuses() == {"A1": "failed"}
+    assert claimed_ids(queue) == []
+
+    with services.get_session() as session:
+        job = session.get(ProcessingJobs, "A1")
+        assert (job.attempts, job.worker_id, job.last_error) == (2, None, "model timed out again")
+
+    # A new run gives failed jobs another go
+    queue.enqueue(work_list("A1"))
+    assert claimed_ids(queue) == ["A1"]
+
+
+def test_released_job_is_queued_again(jobs) -> None:
+    queue = JobQueue(jobs)
+    queue.enqueue(work_list("A1", "A2"))
+    assert claimed_ids(queue) == ["A1", "A2"]
+
+    # A1 is waiting for calibration so has no result yet
+    with services.get_session() as session:
+        queue.release(session, ["A1"])
+        queue.complete(session, ["A2"])
+    assert job_statuses() == {"A2": "done"}
+
+    queue.enqueue(work_list("A1"))
+    with services.get_session() as session:
+        assert session.get(ProcessingJobs, "A1").attempts == 0
+    assert claimed_ids(queue) == ["A1"]
+
+
+def test_heartbeat_keeps_the_lease(jobs) -> None:
+    queue = JobQueue(jobs, lease_seconds=0)
+    other = JobQueue(jobs)
+    queue.enqueue(work_list("A1"))
+    assert claimed_ids(queue) == ["A1"]
+
+    queue.lease = timedelta(minutes=5)
+    queue.heartbeat()
+    assert claimed_ids(other) == []
@@ -0,0 +1,116 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from sqlalchemy import create_engine, select, update
+
+from cv_pipeline.llm_cache import LLMResponseCache
+from cv_pipeline.services import tables
+
+LLMCache = tables["llm_cache"].__table__
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # As set up by services for LLM_CACHE=sqlite
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'llm_cache.sqlite'}",
+        execution_options={"schema_translate_map": {"cv": None}},
+    )
+    LLMCache.create(engine)
+    yield engine
+    engine.dispose()
+
+
+def new_cache(engine, **kwargs) -> LLMResponseCache:
+    return LLMResponseCache(
+        engine, tables["llm_cache"], model="test/model", temperature=0, prompt_version="1", **kwargs
+    )
+
+
+def response(text: str) -> list[ChatGeneration]:
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def age_entry(engine, cache: LLMResponseCache, prompt: str, age: timedelta) -> None:
+    with engine.begin() as connection:
+        connection.execute(
+            update(LLMCache)
+            .where(LLMCache.c.cache_key == cache.key(prompt, "settings"))
+            .values(created_at=datetime.now(UTC) - age)
+        )
+
+
+def cached_prompts(engine, cache: LLMResponseCache, prompts: list[str]) -> list[str]:
+    keys = {cache.key(prompt, "settings"): prompt for prompt in prompts}
+    with engine.connect() as connection:
+        stored = connection.execute(select(LLMCache.c.cache_key)).scalars()
+        return sorted(keys[key] for key in stored)
+
+
+def test_returns_stored_response(engine) -> None:
+    cache = new_cache(engine)
+    assert cache.lookup("prompt", "settings") is None
+
+    cache.update("prompt", "settings", response("answer"))
+    assert cache.lookup("prompt", "settings") == response("answer")
+    # Other model settings (e.g. a structured output schema) are another entry
+    assert cache.lookup("prompt", "other settings") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_prompt_version_invalidates_responses(engine) -> None:
+    new_cache(engine).update("prompt", "settings", response("answer"))
+    cache = new_cache(engine)
+    cache.prompt_version = "2"
+    assert cache.lookup("prompt", "settings") is None
+
+
+def test_expired_responses_are_ignored_then_pruned(engine) -> None:
+    cache = new_cache(engine, ttl_seconds=3600)
+    cache.update("old", "settings", response("old answer"))
+    cache.update("new", "settings", response("new answer"))
+    age_entry(engine, cache, "old", timedelta(hours=2))
+
+    assert cache.lookup("old", "settings") is None
+    assert cache.lookup("new", "settings") == response("new answer")
+
+    cache.prune()
+    assert cached_prompts(engine, cache, ["old", "new"]) == ["new"]
+
+
+def test_oldest_responses_beyond_max_entries_are_pruned(engine) -> None:
+    cache = new_cache(engine, max_entries=2)
+    cache.prune_every = 3
+    prompts = ["first", "second", "third"]
+    for i, prompt in enumerate(prompts):
+        cache.update(prompt, "settings", response(prompt))
+        age_entry(engine, cache, prompt, timedelta(minutes=len(prompts) - i))
+
+    # The third write pruned the cache
+    assert cached_prompts(engine, cache, prompts) == ["second", "third"]
+    assert cache.lookup("first", "settings") is None
+
+
+def test_bypass_skips_lookups_but_stores_responses(engine) -> None:
+    new_cache(engine).update("prompt", "settings", response("stale answer"))
+
+    bypassed = new_cache(engine, bypass=True)
+    assert bypassed.lookup("prompt", "settings") is None
+    assert (bypassed.hits, bypassed.misses) == (0, 1)
+    bypassed.update("prompt", "settings", response("fresh answer"))
+
+    assert new_cache(engine).lookup("prompt", "settings") == response("fresh answer")
+
+
+def test_clear_only_deletes_this_prompt_version(engine) -> None:
+    old = new_cache(engine)
+    old.update("prompt", "settings", response("old answer"))
+    cache = new_cache(engine)
+    cache.prompt_version = "2"
+    cache.update("prompt", "settings", response("answer"))
+
+    cache.clear()
+    assert old.lookup("prompt", "settings") == response("old answer")
+    assert cache.lookup("prompt", "settings") is None
@@ -0,0 +1,23 @@
+import pytest
+
+from cv_pipeline.pipelines.manifest import IngestionManifest
+from cv_pipeline.services import services, tables
+
+IngestionManifestFiles = tables["ingestion_manifest"]
+
+
+@pytest.fixture
+def manifest(database) -> IngestionManifest:
+    return IngestionManifest(tables["ingestion_manifest"], tables["ingestion_manifest_rows"])
+
+
+def test_start_file_streams_row_keys(manifest) -> None:
+    def row_keys():
+        # More than one chunk, with a key repeated across chunks
+        yield from (f"A{i}" for i in range(12_000))
+        yield "A1"
+
+    pending = manifest.start_file("hash", "cvs.csv", "cvs", row_keys())
+    assert len(pending) == 12_000
+    with services.get_session() as session:
+        assert session.get(IngestionManifestFiles, "hash").rows_total == 12_000
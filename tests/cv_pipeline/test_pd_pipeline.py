@@ -0,0 +1,196 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from tenacity import wait_none
+
+from cv_pipeline import utils as ut
+from cv_pipeline.pipelines import pd_pipeline
+from cv_pipeline.pipelines.pd_pipeline import _DONE, StageStats, run_stage
+from cv_pipeline.services import services
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+async def put_all(queue: asyncio.Queue, items: list) -> None:
+    for item in items:
+        await queue.put(item)
+    await queue.put(_DONE)
+
+
+async def drain(queue: asyncio.Queue) -> list:
+    items = []
+    while (item := await queue.get()) is not _DONE:
+        items.append(item)
+    return items
+
+
+@pytest.mark.asyncio
+async def test_run_stage_passes_batches_on() -> None:
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    batches = []
+
+    async def process(batch):
+        batches.append(batch)
+        # The second item of each batch fails
+        return [item * 10 for item in batch[:1]]
+
+    stats = StageStats("test", workers=1)
+    await put_all(inbox, [1, 2, 3, 4, 5])
+    await run_stage(stats, inbox, outbox, process, batch_size=2)
+
+    assert batches == [[1, 2], [3, 4], [5]]
+    assert await drain(outbox) == [10, 30, 50]
+    assert (stats.done, stats.failed) == (3, 2)
+
+
+@pytest.mark.asyncio
+async def test_run_stage_waits_for_room_on_the_next_queue() -> None:
+    inbox, outbox = asyncio.Queue(), asyncio.Queue(maxsize=1)
+    processed = []
+
+    async def process(batch):
+        processed.extend(batch)
+        return batch
+
+    stats = StageStats("test", workers=2)
+    await put_all(inbox, list(range(10)))
+    stage = asyncio.create_task(run_stage(stats, inbox, outbox, process))
+    await asyncio.sleep(0.01)
+
+    # One result waiting on the full queue and one held by each worker, the
+    # rest of the items and the end marker are still on the inbox
+    assert outbox.full()
+    assert len(processed) == 3
+    assert inbox.qsize() == 8
+
+    assert await drain(outbox) == list(range(10))
+    await stage
+    assert stats.blocked > 0
+
+
+@pytest.mark.asyncio
+async def test_failing_stage_cancels_the_others() -> None:
+    queues = [asyncio.Queue(maxsize=1) for _ in range(3)]
+
+    async def fail(batch):
+        raise RuntimeError("render pool died")
+
+    async def never_reached(batch):
+        return batch
+
+    with pytest.raises(ExceptionGroup) as error:
+        # Without the cancellation the other stages would wait forever
+        async with asyncio.timeout(5), asyncio.TaskGroup() as group:
+            group.create_task(put_all(queues[0], list(range(10))))
+            group.create_task(run_stage(StageStats("a", 1), queues[0], queues[1], fail))
+            group.create_task(run_stage(StageStats("b", 1), queues[1], queues[2], never_reached))
+            group.create_task(drain(queues[2]))
+    assert error.group_contains(RuntimeError, match="render pool died")
+
+
+@pytest.fixture
+def stub_services(monkeypatch) -> SimpleNamespace:
+    """Stubs the render, LLM, embeddings and write steps of the pd pipeline."""
+    stubs = SimpleNamespace(written=[], invalidated=[], missing_vectors=False)
+
+    def pdf_to_message_parts(path, **kwargs):
+        if "BROKEN" in path:
+            raise ValueError("not a pdf")
+        return [{"type": "text", "text": path}]
+
+    async def ainvoke(messages):
+        return SimpleNamespace(content=f"summary of {messages[0].content[-1]['text']}")
+
+    async def embed_documents(texts):
+        vectors = [[float(i)] for i in range(len(texts))]
+        return vectors[:-1] if stubs.missing_vectors else vectors
+
+    monkeypatch.setattr(pd_pipeline.ren, "pdf_to_message_parts", pdf_to_message_parts)
+    monkeypatch.setattr(pd_pipeline, "embed_documents", embed_documents)
+    monkeypatch.setattr(
+        pd_pipeline, "write_positions", lambda batch, collection_name: stubs.written.extend(batch)
+    )
+    monkeypatch.setitem(services.__dict__, "render_pool", None)
+    monkeypatch.setitem(services.__dict__, "render_cache", None)
+    monkeypatch.setitem(services.__dict__, "render_profile", None)
+    monkeypatch.setitem(services.__dict__, "llm", SimpleNamespace(ainvoke=ainvoke))
+    monkeypatch.setitem(
+        services.__dict__,
+        "retrieval_cache",
+        SimpleNamespace(invalidate=lambda levels: stubs.invalidated.append(levels)),
+    )
+    return stubs
+
+
+def positions(*position_numbers: str) -> list[dict]:
+    return [
+        {"position_number": position_number, "level": f"L{i}"}
+        for i, position_number in enumerate(position_numbers)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_pd_pipeline_writes_positions(stub_services) -> None:
+    errors = await pd_pipeline.run_pd_pipeline(positions("P1", "BROKEN", "P3"), "test")
+
+    assert errors == {"BROKEN": "not a pdf"}
+    written = {data["position_number"]: summary for data, summary, _ in stub_services.written}
+    assert written == {
+        "P1": "summary of data/raw/pds/P1.pdf",
+        "P3": "summary of data/raw/pds/P3.pdf",
+    }
+    assert stub_services.invalidated == [{"L0", "L2"}]
+
+
+@pytest.mark.asyncio
+async def test_missing_vectors_fail_the_batch(stub_services) -> None:
+    # The provider returns one vector fewer than the summaries it was sent
+    stub_services.missing_vectors = True
+    errors = await pd_pipeline.run_pd_pipeline(positions("P1", "P2"), "test")
+
+    assert set(errors) == {"P1", "P2"}
+    assert "zip()" in errors["P1"]
+    assert stub_services.written == []
+    assert stub_services.invalidated == [set()]
+
+
+@pytest.fixture
+def embeddings(monkeypatch) -> SimpleNamespace:
+    """Embeddings provider failing with the queued errors before succeeding."""
+    provider = SimpleNamespace(calls=0, errors=[])
+
+    async def aembed_documents(texts):
+        provider.calls += 1
+        if provider.errors:
+            raise provider.errors.pop(0)
+        return [[1.0] for _ in texts]
+
+    provider.aembed_documents = aembed_documents
+    monkeypatch.setitem(services.__dict__, "embeddings", provider)
+    # The provider's rate limiter doesn't retry, so only embed_documents does
+    monkeypatch.setitem(
+        ut._rate_limiters, "ollama_embeddings", ut.RateLimitController("test", max_retries=0)
+    )
+    return provider
+
+
+@pytest.mark.asyncio
+async def test_embed_documents_retries_transient_errors(embeddings) -> None:
+    embeddings.errors = [ConnectionError("reset"), ConnectionError("reset")]
+    embed_documents = pd_pipeline.embed_documents.retry_with(wait=wait_none())
+
+    assert await embed_documents(["a", "b"]) == [[1.0], [1.0]]
+    assert embeddings.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_embed_documents_leaves_rate_limits_to_the_rate_limiter(embeddings) -> None:
+    embeddings.errors = [FakeRateLimitError("429 Too Many Requests")]
+    embed_documents = pd_pipeline.embed_documents.retry_with(wait=wait_none())
+
+    with pytest.raises(FakeRateLimitError):
+        await embed_documents(["a"])
+    assert embeddings.calls == 1
@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+from cv_pipeline.pipelines import preprocess
+from cv_pipeline.services import services, tables
+
+IngestionManifestRows = tables["ingestion_manifest_rows"]
+
+
+@pytest.fixture
+def data(database, tmp_path, monkeypatch) -> Path:
+    """Empty data folders in a temporary working directory."""
+    monkeypatch.chdir(tmp_path)
+    for folder in ["source/cvs", "source/pds", "raw/cvs", "raw/pds"]:
+        (tmp_path / "data" / folder).mkdir(parents=True)
+    return tmp_path / "data"
+
+
+@pytest.fixture
+def built(monkeypatch) -> list:
+    """CVs handed on to be rendered, by call."""
+    built = []
+    monkeypatch.setattr(preprocess, "build_artifacts", built.append)
+    return built
+
+
+def write_cv_csv(data: Path, application_ids: list[str]) -> str:
+    rows = "".join(f"P1,{application_id}\n" for application_id in application_ids)
+    (data / "source" / "cvs" / "cvs.csv").write_text("position_number,application_id\n" + rows)
+    return "data/source/cvs/cvs.csv"
+
+
+def write_cv_pdf(data: Path, application_id: str) -> None:
+    (data / "source" / "cvs" / "P1").mkdir(exist_ok=True)
+    (data / "source" / "cvs" / "P1" / f"{application_id}.pdf").write_bytes(b"%PDF-1.4")
+
+
+def row_statuses() -> dict[str, str]:
+    with services.get_session() as session:
+        return dict(
+            session.execute(
+                select(IngestionManifestRows.row_key, IngestionManifestRows.status)
+            ).all()
+        )
+
+
+def test_second_ingest_of_a_file_is_skipped(data, built, monkeypatch) -> None:
+    loaded = []
+    copy_csv = preprocess.bulk_load.copy_csv
+
+    def record_copy_csv(csv_file_name, Model, key):
+        loaded.append(csv_file_name)
+        return copy_csv(csv_file_name, Model, key)
+
+    monkeypatch.setattr(preprocess.bulk_load, "copy_csv", record_copy_csv)
+    csv_file_name = write_cv_csv(data, ["A1", "A2"])
+    write_cv_pdf(data, "A1")
+    write_cv_pdf(data, "A2")
+
+    preprocess.ingest_cv_file(csv_file_name)
+    assert built == [[("P1", "A1"), ("P1", "A2")]]
+    assert (data / "raw" / "cvs" / "cvs.csv").exists()
+    assert (data / "raw" / "cvs" / "P1" / "A2.pdf").exists()
+
+    # The same file is dropped in again
+    write_cv_csv(data, ["A1", "A2"])
+    preprocess.ingest_cv_file(csv_file_name)
+    assert loaded == [csv_file_name]
+    assert len(built) == 1
+    assert not (data / "source" / "cvs" / "cvs.csv").exists()
+
+
+def test_partly_failed_file_resumes_pending_rows(data, built) -> None:
+    csv_file_name = write_cv_csv(data, ["A1", "A2", "A3"])
+    write_cv_pdf(data, "A1")
+    write_cv_pdf(data, "A3")
+
+    preprocess.ingest_cv_file(csv_file_name)
+    assert built == [[("P1", "A1"), ("P1", "A3")]]
+    assert row_statuses() == {"A1": "done", "A2": "failed", "A3": "done"}
+    # Left in the source folder to be retried
+    assert (data / "source" / "cvs" / "cvs.csv").exists()
+
+    # The missing pdf lands
+    write_cv_pdf(data, "A2")
+    preprocess.ingest_cv_file(csv_file_name)
+    assert built[1:] == [[("P1", "A2")]]
+    assert row_statuses() == {"A1": "done", "A2": "done", "A3": "done"}
+    assert (data / "raw" / "cvs" / "cvs.csv").exists()
+
+
+def test_partly_failed_pd_file_resumes_pending_positions(data, monkeypatch) -> None:
+    summarised = []
+
+    def ingest_pds(csv_data, collection_name):
+        summarised.append([row["position_number"] for row in csv_data])
+        return {"P2": "model timed out"} if len(summarised) == 1 else {}
+
+    monkeypatch.setattr(preprocess, "ingest_pds", ingest_pds)
+    (data / "source" / "pds" / "pds.csv").write_text(
+        "position_number,job_title,level\nP1,Analyst,4\nP2,Engineer,5\nP3,Manager,6\n"
+    )
+    csv_file_name = "data/source/pds/pds.csv"
+
+    preprocess.ingest_pd_file(csv_file_name, "test")
+    assert row_statuses() == {"P1": "done", "P2": "failed", "P3": "done"}
+    preprocess.ingest_pd_file(csv_file_name, "test")
+    assert summarised == [["P1", "P2", "P3"], ["P2"]]
+    assert row_statuses() == {"P1": "done", "P2": "done", "P3": "done"}
+    assert (data / "raw" / "pds" / "pds.csv").exists()
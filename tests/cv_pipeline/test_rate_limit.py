@@ -0,0 +1,328 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+import tenacity
+from langchain_core.caches import InMemoryCache
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from cv_pipeline import utils as ut
+
+
+class FakeRateLimitError(Exception):
+    """HTTP 429 from a provider, with the response headers it came with."""
+
+    status_code = 429
+
+    def __init__(self, headers: dict | None = None):
+        super().__init__("429 Too Many Requests")
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class FlakyChatModel(FakeListChatModel):
+    """Chat model that raises the queued errors before answering."""
+
+    errors: list = []
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return super()._call(*args, **kwargs)
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(ut, "time", fake_clock)
+    # The retries of rate_limited
+    monkeypatch.setattr(tenacity.nap, "time", fake_clock)
+    return fake_clock
+
+
+def chat_model(controller: ut.RateLimitController, **kwargs) -> FlakyChatModel:
+    return FlakyChatModel(
+        responses=["first answer", "second answer"],
+        rate_limiter=ut.ProviderRateLimiter(controller),
+        **kwargs,
+    )
+
+
+def test_is_rate_limit_error() -> None:
+    assert ut.is_rate_limit_error(FakeRateLimitError())
+    assert ut.is_rate_limit_error(SimpleNamespace(response=SimpleNamespace(status_code=429)))
+    assert ut.is_rate_limit_error(SimpleNamespace(code=429))
+    assert not ut.is_rate_limit_error(ValueError("bad input"))
+    assert not ut.is_rate_limit_error(SimpleNamespace(status_code=500))
+
+
+def test_retry_after_seconds_from_headers() -> None:
+    assert ut.retry_after_seconds(FakeRateLimitError({"retry-after": "7"})) == 7.0
+    assert ut.retry_after_seconds(FakeRateLimitError({"retry-after-ms": "1500"})) == 1.5
+    # Milliseconds are more precise so take precedence
+    assert (
+        ut.retry_after_seconds(FakeRateLimitError({"retry-after": "7", "retry-after-ms": "250"}))
+        == 0.25
+    )
+
+
+def test_retry_after_seconds_from_http_date() -> None:
+    retry_at = datetime.now(UTC) + timedelta(seconds=120)
+    error = FakeRateLimitError({"retry-after": format_datetime(retry_at, usegmt=True)})
+    assert 100 < ut.retry_after_seconds(error) <= 120
+
+    retry_at = datetime.now(UTC) - timedelta(seconds=120)
+    error = FakeRateLimitError({"retry-after": format_datetime(retry_at, usegmt=True)})
+    assert ut.retry_after_seconds(error) == 0.0
+
+
+def test_retry_after_seconds_from_google_details() -> None:
+    error = SimpleNamespace(
+        details=[SimpleNamespace(retry_delay=SimpleNamespace(seconds=2, nanos=500_000_000))]
+    )
+    assert ut.retry_after_seconds(error) == 2.5
+    assert ut.retry_after_seconds(SimpleNamespace(details=[{"retryDelay": "3s"}])) == 3.0
+
+
+def test_retry_after_seconds_missing_or_invalid() -> None:
+    assert ut.retry_after_seconds(FakeRateLimitError()) is None
+    assert ut.retry_after_seconds(FakeRateLimitError({"retry-after": "soon"})) is None
+    assert ut.retry_after_seconds(ValueError("bad input")) is None
+
+
+def test_token_bucket_waits_for_refill(clock) -> None:
+    bucket = ut.TokenBucket(60)
+    assert bucket.reserve(60) == 0.0
+    # One unit refills per second
+    assert bucket.reserve(30) == 30.0
+    clock.advance(10)
+    assert bucket.reserve(0) == 20.0
+
+
+def test_token_bucket_caps_oversized_calls(clock) -> None:
+    bucket = ut.TokenBucket(60)
+    # Bigger than the whole budget, so it only waits for a full bucket
+    assert bucket.reserve(1000) == 0.0
+    assert bucket.reserve(1) == 1.0
+
+
+def test_requests_per_minute_budget(clock) -> None:
+    controller = ut.RateLimitController("test", rpm=60, max_concurrency=100)
+    for _ in range(60):
+        assert controller._try_acquire(1) == 0.0
+    assert controller._try_acquire(1) == 1.0
+
+
+def test_concurrency_limit_blocks_further_calls(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=1)
+    assert controller._try_acquire(1) == 0.0
+    assert controller._try_acquire(1) is None
+    controller._release(None)
+    assert controller._try_acquire(1) == 0.0
+
+
+def test_success_increases_limit_additively(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=4)
+    controller.limit = 2.0
+    controller._try_acquire(1)
+    controller._release(None)
+    assert controller.limit == 2.5
+    controller._try_acquire(1)
+    controller._release(None)
+    assert controller.limit == pytest.approx(2.9)
+
+    controller.limit = 4.0
+    controller._try_acquire(1)
+    controller._release(None)
+    assert controller.limit == 4.0
+
+
+def test_rate_limit_halves_limit_once_per_pause(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=8)
+    for _ in range(3):
+        controller._try_acquire(1)
+
+    # Calls that were in flight together all fail with a 429
+    assert controller._release(FakeRateLimitError({"retry-after": "5"})) == 5.0
+    assert controller.limit == 4
+    controller._release(FakeRateLimitError({"retry-after": "5"}))
+    controller._release(FakeRateLimitError({"retry-after": "5"}))
+    assert controller.limit == 4
+    assert controller.rate_limited == 3
+    assert controller.in_flight == 0
+
+    # New calls wait out the pause
+    assert controller._try_acquire(1) == 5.0
+    clock.advance(5)
+    controller._release(FakeRateLimitError({"retry-after": "5"}))
+    assert controller.limit == 2
+
+
+def test_rate_limit_respects_min_concurrency(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=4, min_concurrency=2)
+    for _ in range(3):
+        controller._try_acquire(1)
+        controller._release(FakeRateLimitError({"retry-after": "1"}))
+        clock.advance(1)
+    assert controller.limit == 2
+
+
+def test_rate_limit_without_retry_after_uses_jittered_backoff(clock, monkeypatch) -> None:
+    monkeypatch.setattr(ut.random, "uniform", lambda a, b: b)
+    controller = ut.RateLimitController("test")
+    controller._try_acquire(1)
+    assert controller._release(FakeRateLimitError()) == 4
+
+
+def test_call_retries_after_rate_limit(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=16)
+    attempts = []
+
+    def fn(value):
+        attempts.append(value)
+        if len(attempts) == 1:
+            raise FakeRateLimitError({"retry-after": "3"})
+        return value * 2
+
+    assert controller.call(fn, 21) == 42
+    assert attempts == [21, 21]
+    assert clock.sleeps == [3.0]
+    # Halved by the 429, then grown by the successful retry
+    assert controller.limit == 8 + 1 / 8
+    assert controller.calls == 2
+    assert controller.rate_limited == 1
+    assert controller.in_flight == 0
+
+
+def test_call_raises_other_errors_without_retry(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=4)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        controller.call(fn)
+    assert len(attempts) == 1
+    assert controller.limit == 4
+    assert controller.in_flight == 0
+
+
+def test_call_gives_up_after_max_retries(clock) -> None:
+    controller = ut.RateLimitController("test", max_retries=2)
+    attempts = []
+
+    def fn():
+        attempts.append(1)
+        raise FakeRateLimitError({"retry-after": "1"})
+
+    with pytest.raises(FakeRateLimitError):
+        controller.call(fn)
+    assert len(attempts) == 3
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_acall_retries_after_rate_limit() -> None:
+    controller = ut.RateLimitController("test", max_concurrency=4)
+    attempts = []
+
+    async def fn():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise FakeRateLimitError({"retry-after": "0"})
+        return "done"
+
+    assert await controller.acall(fn) == "done"
+    assert len(attempts) == 2
+    assert controller.rate_limited == 1
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_acall_releases_slot_on_cancellation() -> None:
+    controller = ut.RateLimitController("test", max_concurrency=2)
+    started = asyncio.Event()
+
+    async def fn():
+        started.set()
+        await asyncio.Event().wait()
+
+    task = asyncio.create_task(controller.acall(fn))
+    await started.wait()
+    assert controller.in_flight == 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert controller.in_flight == 0
+    # Cancellation is not a rate limit, so the limit is unchanged
+    assert controller.limit == 2
+    assert controller.rate_limited == 0
+
+
+def test_rate_limited_cache_hits_skip_the_budget(clock) -> None:
+    controller = ut.RateLimitController("test", rpm=60)
+    model = chat_model(controller, cache=InMemoryCache())
+    llm = ut.rate_limited(model, controller)
+
+    assert llm.invoke("question").content == "first answer"
+    assert llm.invoke("question").content == "first answer"
+    assert model.calls == 1
+    assert controller.calls == 1
+    # Only the call to the provider was taken from the budget
+    assert controller.requests.available == 59
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_async_cache_hits_skip_the_budget() -> None:
+    controller = ut.RateLimitController("test")
+    model = chat_model(controller, cache=InMemoryCache())
+    llm = ut.rate_limited(model, controller)
+
+    assert (await llm.ainvoke("question")).content == "first answer"
+    assert (await llm.ainvoke("question")).content == "first answer"
+    assert (await llm.ainvoke("other question")).content == "second answer"
+    assert model.calls == 2
+    assert controller.calls == 2
+    assert controller.in_flight == 0
+
+
+def test_rate_limited_leaves_rate_limits_to_the_controller(clock) -> None:
+    controller = ut.RateLimitController("test", max_retries=2)
+    model = chat_model(controller)
+    model.errors = [FakeRateLimitError({"retry-after": "1"}) for _ in range(5)]
+    llm = ut.rate_limited(model, controller, attempts=5)
+
+    with pytest.raises(FakeRateLimitError):
+        llm.invoke("question")
+    # Retried by the controller only, not again for every attempt
+    assert model.calls == 3
+    assert controller.rate_limited == 3
+    assert controller.in_flight == 0
+
+
+def test_rate_limited_retries_other_errors(clock) -> None:
+    controller = ut.RateLimitController("test")
+    model = chat_model(controller)
+    model.errors = [ValueError("not valid json"), ValueError("not valid json")]
+    llm = ut.rate_limited(model, controller, attempts=3)
+
+    assert llm.invoke("question").content == "first answer"
+    assert model.calls == 3
+    assert controller.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_model_called_directly_is_not_limited(clock) -> None:
+    controller = ut.RateLimitController("test", max_concurrency=1)
+    model = chat_model(controller)
+
+    assert model.invoke("question").content == "first answer"
+    assert model.invoke("question").content == "second answer"
+    assert controller.calls == 0
+    assert controller.in_flight == 0
@@ -0,0 +1,86 @@
+import pytest
+
+from cv_pipeline.retrieval_cache import RetrievalCache
+from cv_pipeline.services import services, tables
+
+
+def related(*similar_position_numbers: str) -> dict:
+    return {
+        "position_description": "summary",
+        "similar_position_numbers": list(similar_position_numbers),
+        "suitability_comments_positive": ["good fit"],
+        "suitability_comments_negative": [],
+    }
+
+
+def cached_positions(cache: RetrievalCache) -> set[str]:
+    return {
+        position_number
+        for position_number, level in [("P1", "5"), ("P2", "5"), ("P3", "6"), ("P4", "6")]
+        if cache.get(position_number, level) is not None
+    }
+
+
+def new_cache(**kwargs) -> RetrievalCache:
+    return RetrievalCache(
+        tables["position_retrieval_cache"], services.get_session, "test", **kwargs
+    )
+
+
+@pytest.fixture
+def cache() -> RetrievalCache:
+    return new_cache(max_entries=2)
+
+
+def fill(cache: RetrievalCache) -> None:
+    cache.put("P1", "5", related("P2"))
+    cache.put("P2", "5", related("P1"))
+    cache.put("P3", "6", related("P4"))
+    cache.put("P4", "6", related("P2", "P3"))
+
+
+def test_least_recently_used_entry_is_evicted(cache) -> None:
+    cache.put("P1", "5", related())
+    cache.put("P2", "5", related())
+    assert cache.get("P1", "5") == related()
+
+    cache.put("P3", "6", related())
+    assert cache.get("P2", "5") is None
+    assert cache.get("P1", "5") == related()
+    assert cache.get("P3", "6") == related()
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_are_copies(cache) -> None:
+    cache.put("P1", "5", related())
+    cache.get("P1", "5")["position_description"] = "changed"
+    assert cache.get("P1", "5")["position_description"] == "summary"
+
+
+@pytest.mark.parametrize("persist", [False, True])
+def test_invalidate_by_position_number(database, persist) -> None:
+    cache = new_cache(persist=persist)
+    fill(cache)
+
+    # New reviews for P3 change P3 and P4, which uses P3 as a similar position
+    cache.invalidate(position_numbers=["P3"])
+    assert cached_positions(cache) == {"P1", "P2"}
+
+
+@pytest.mark.parametrize("persist", [False, True])
+def test_invalidate_by_level(database, persist) -> None:
+    cache = new_cache(persist=persist)
+    fill(cache)
+
+    cache.invalidate(levels=["5"])
+    assert cached_positions(cache) == {"P3", "P4"}
+
+
+def test_invalidate_removes_persisted_entries(database) -> None:
+    fill(new_cache(persist=True))
+    new_cache(persist=True).invalidate(position_numbers=["P2"], levels=["7"])
+
+    # A worker that starts afterwards only finds the entries still valid
+    fresh = new_cache(persist=True)
+    assert cached_positions(fresh) == {"P3"}
+    assert fresh.get("P3", "6") == related("P4")
@@ -0,0 +1,78 @@
+import pytest
+
+from cv_pipeline.pipelines import similar_positions
+from cv_pipeline.pipelines.similar_positions import (
+    get_similar_position_numbers,
+    update_similar_positions,
+)
+
+K = 2
+
+
+@pytest.fixture
+def positions(database, monkeypatch) -> dict[str, float]:
+    """
+    Positions ingested so far, as points on a line searched in place of the
+    vector store. The distance between positions is how far apart they are.
+    """
+    points = {}
+
+    def search_similar_positions(position_number, level, summary, k):
+        distances = sorted(
+            (abs(point - points[position_number]), other)
+            for other, point in points.items()
+            if other != position_number
+        )
+        return [(other, distance) for distance, other in distances[:k]]
+
+    monkeypatch.setattr(similar_positions, "search_similar_positions", search_similar_positions)
+    monkeypatch.setattr(similar_positions, "SIMILAR_POSITIONS_K", K)
+    return points
+
+
+def ingest(positions: dict[str, float], position_number: str, point: float) -> None:
+    positions[position_number] = point
+    update_similar_positions(position_number, "5", "summary")
+
+
+def nearest(positions: dict[str, float], position_number: str) -> list[str]:
+    others = [other for other in positions if other != position_number]
+    return sorted(others, key=lambda other: abs(positions[other] - positions[position_number]))[:K]
+
+
+def test_new_position_displaces_a_neighbour(positions) -> None:
+    ingest(positions, "P1", 0.0)
+    ingest(positions, "P2", 9.0)
+    ingest(positions, "P3", 20.0)
+    assert get_similar_position_numbers("P1") == ["P2", "P3"]
+    assert get_similar_position_numbers("P2") == ["P1", "P3"]
+    assert get_similar_position_numbers("P3") == ["P2", "P1"]
+
+    # P4 is closer to every position than its furthest similar position
+    ingest(positions, "P4", 4.0)
+    assert get_similar_position_numbers("P4") == ["P1", "P2"]
+    assert get_similar_position_numbers("P1") == ["P4", "P2"]
+    assert get_similar_position_numbers("P2") == ["P4", "P1"]
+    assert get_similar_position_numbers("P3") == ["P2", "P4"]
+
+    # P5 is only closer to P3, so the rest keep their similar positions
+    ingest(positions, "P5", 30.0)
+    assert get_similar_position_numbers("P5") == ["P3", "P2"]
+    assert get_similar_position_numbers("P3") == ["P5", "P2"]
+    assert get_similar_position_numbers("P2") == ["P4", "P1"]
+
+
+def test_matches_nearest_positions_after_each_ingest(positions) -> None:
+    points = [5.0, 50.0, 27.0, 1.0, 33.0, 48.0, 12.5, 70.0, 26.0]
+    for i, point in enumerate(points):
+        ingest(positions, f"P{i}", point)
+        for position_number in positions:
+            assert get_similar_position_numbers(position_number) == nearest(
+                positions, position_number
+            )
+
+
+def test_position_without_neighbours_is_recorded(positions) -> None:
+    assert get_similar_position_numbers("P1") is None
+    ingest(positions, "P1", 0.0)
+    assert get_similar_position_numbers("P1") == []
@@ -0,0 +1,135 @@
+from pathlib import Path
+
+import pytest
+
+from cv_pipeline.pipelines import watch
+
+SETTLE_SECONDS = 10
+MAX_WAIT_SECONDS = 600
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch, fake_clock) -> Path:
+    """Empty source folders in a temporary working directory, on a fake clock."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(watch, "time", fake_clock)
+    for folder in ["pds", "cvs"]:
+        (tmp_path / "data" / "source" / folder).mkdir(parents=True)
+    return tmp_path / "data" / "source"
+
+
+@pytest.fixture
+def watcher() -> watch.FolderWatcher:
+    return watch.FolderWatcher(SETTLE_SECONDS, MAX_WAIT_SECONDS)
+
+
+def write_cv_csv(source: Path, name: str, application_ids: list[str]) -> str:
+    rows = "".join(f"P1,{application_id}\n" for application_id in application_ids)
+    (source / "cvs" / name).write_text("position_number,application_id\n" + rows)
+    return f"data/source/cvs/{name}"
+
+
+def write_cv_pdf(source: Path, application_id: str) -> None:
+    (source / "cvs" / "P1").mkdir(exist_ok=True)
+    (source / "cvs" / "P1" / f"{application_id}.pdf").write_bytes(b"%PDF-1.4")
+
+
+def test_csv_is_ready_once_settled(source, watcher, fake_clock) -> None:
+    csv_file_name = write_cv_csv(source, "cvs.csv", ["A1", "A2"])
+    write_cv_pdf(source, "A1")
+    write_cv_pdf(source, "A2")
+
+    # First sight only starts the settle timer
+    assert watcher.ready_files() == []
+    fake_clock.advance(SETTLE_SECONDS - 1)
+    assert watcher.ready_files() == []
+    fake_clock.advance(1)
+    assert watcher.ready_files() == [csv_file_name]
+
+
+def test_change_restarts_settle_timer(source, watcher, fake_clock) -> None:
+    csv_file_name = write_cv_csv(source, "cvs.csv", ["A1"])
+    write_cv_pdf(source, "A1")
+    watcher.ready_files()
+
+    fake_clock.advance(SETTLE_SECONDS)
+    # Still being copied in
+    write_cv_csv(source, "cvs.csv", ["A1", "A2"])
+    write_cv_pdf(source, "A2")
+    assert watcher.ready_files() == []
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.ready_files() == [csv_file_name]
+
+
+def test_waits_for_missing_pdfs_up_to_max_wait(source, watcher, fake_clock) -> None:
+    csv_file_name = write_cv_csv(source, "cvs.csv", ["A1", "A2"])
+    write_cv_pdf(source, "A1")
+    watcher.ready_files()
+
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.ready_files() == []
+    fake_clock.advance(MAX_WAIT_SECONDS - SETTLE_SECONDS)
+    assert watcher.ready_files() == [csv_file_name]
+
+
+def test_position_descriptions_come_first(source, watcher, fake_clock) -> None:
+    cv_csv = write_cv_csv(source, "cvs.csv", [])
+    (source / "pds" / "pds.csv").write_text("position_number\n")
+    watcher.ready_files()
+
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.ready_files() == ["data/source/pds/pds.csv", cv_csv]
+
+
+def test_incomplete_header_is_not_ready(source, watcher, fake_clock) -> None:
+    (source / "cvs" / "cvs.csv").write_text("position_number\nP1\n")
+    watcher.ready_files()
+
+    fake_clock.advance(MAX_WAIT_SECONDS)
+    assert watcher.ready_files() == []
+
+
+def test_ingested_again_only_after_a_change(source, watcher, fake_clock, monkeypatch) -> None:
+    ingested = []
+    monkeypatch.setattr(watch, "ingest_cv_file", ingested.append)
+    csv_file_name = write_cv_csv(source, "cvs.csv", ["A1", "A2"])
+    write_cv_pdf(source, "A1")
+    watcher.poll()
+
+    fake_clock.advance(MAX_WAIT_SECONDS)
+    assert watcher.poll() == 1
+    fake_clock.advance(MAX_WAIT_SECONDS)
+    # Rows with missing pdfs failed, but nothing has changed since
+    assert watcher.poll() == 0
+
+    # The missing pdf lands
+    write_cv_pdf(source, "A2")
+    watcher.poll()
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.poll() == 1
+    assert ingested == [csv_file_name, csv_file_name]
+
+
+def test_failed_ingestion_does_not_stop_the_poll(source, watcher, fake_clock, monkeypatch) -> None:
+    def fail(csv_file_name):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(watch, "ingest_cv_file", fail)
+    write_cv_csv(source, "cvs.csv", [])
+    watcher.poll()
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.poll() == 1
+
+
+def test_forgets_csvs_that_were_moved(source, watcher, fake_clock) -> None:
+    csv_file_name = write_cv_csv(source, "cvs.csv", [])
+    watcher.ready_files()
+    (source / "cvs" / "cvs.csv").unlink()
+    watcher.ready_files()
+    assert csv_file_name not in watcher._seen
+
+    # The same file dropped in again is ingested again
+    write_cv_csv(source, "cvs.csv", [])
+    watcher.ready_files()
+    fake_clock.advance(SETTLE_SECONDS)
+    assert watcher.ready_files() == [csv_file_name]